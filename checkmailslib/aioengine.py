@@ -0,0 +1,615 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016-2018 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Asyncio mailbox engine
+
+All the mailboxes are handled by coroutines running in a single background
+thread. The engine reports what happens through a callback taking an event
+(kind, box, value) as argument:
+
+    * ('connected', box, None): the login to box succeeded
+    * ('unread', box, nb): there are nb unread mails in box
+    * ('login_error', box, msg): the server rejected the login information
+    * ('unknown_server', box, None): the server name could not be resolved
+    * ('connect_error', box, msg): the connection failed
+    * ('folder_error', box, msg): the login succeeded but the folders of box
+      could not be listed, they are listed again at the next check
+    * ('check_error', box, msg): the check failed, the connection is lost
+    * ('check_refused', box, msg): the server refused the check command,
+      the connection is still open
+    * ('timeout', box, None): the connection or the check took too long
+
+The mailboxes with the same server and login share a single connection and
+their checks are done one after the other. The connection errors are
+reported for all of them. After an error (except 'check_refused' and
+'folder_error'), the mailbox is left idle until logout(box, reconnect=True)
+is called. The connections are kept alive by sending NOOP when they have not
+been used for some time.
+"""
+
+
+import asyncio
+import logging
+import ssl
+from imaplib import IMAP4, IMAP4_SSL_PORT
+from socket import gaierror
+from threading import Thread
+
+from checkmailslib.imap import IDLE_TIMEOUT, IDLE_CHANGES, parse_status, \
+    parse_esearch_count, parse_list, split_folders, split_server, is_pattern, \
+    is_selectable
+
+
+class IMAPClient:
+    """Minimal asyncio IMAP4rev1 client, limited to what is needed to count unread mails."""
+
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self.capabilities = ()
+        self.selected = None
+        self._tagnum = 0
+
+    @staticmethod
+    def quote(arg):
+        return '"%s"' % arg.replace('\\', '\\\\').replace('"', '\\"')
+
+    def _new_tag(self):
+        self._tagnum += 1
+        return ('A%i' % self._tagnum).encode()
+
+    async def _readline(self):
+        line = await self.reader.readline()
+        if not line:
+            raise IMAP4.abort('socket error: EOF')
+        line = line.rstrip(b'\r\n')
+        while line.endswith(b'}') and b'{' in line:
+            # literal: read it and the rest of the response
+            size = line[line.rindex(b'{') + 1:-1]
+            if not size.isdigit():
+                break
+            data = await self.reader.readexactly(int(size))
+            line = line + data + (await self.reader.readline()).rstrip(b'\r\n')
+        return line
+
+    async def _send(self, data):
+        self.writer.write(data + b'\r\n')
+        await self.writer.drain()
+
+    @staticmethod
+    def _is_change(line):
+        """Return True if line reports a change in the selected folder."""
+        words = line.split()
+        if words[:2] == [b'*', b'BYE']:
+            raise IMAP4.abort(line.decode(errors='replace'))
+        return len(words) > 2 and words[2].upper() in IDLE_CHANGES
+
+    async def command(self, name, *args):
+        """
+        Send the command name with the given arguments and wait for its
+        completion.
+
+        Return the completion status ('OK' or 'NO'), the list of the untagged
+        responses and the text of the tagged response.
+        """
+        results, untagged = await self.pipeline([(name,) + args])
+        typ, text = results[0]
+        return typ, untagged, text
+
+    async def pipeline(self, commands):
+        """
+        Send all the commands, tuples (name, *args), before waiting for
+        their completion.
+
+        Return the list of the (status, text) of the tagged responses, in
+        the order of the commands, and the list of the untagged responses.
+        """
+        tags = {}
+        for name, *args in commands:
+            tag = self._new_tag()
+            tags[tag] = name
+            self.writer.write(b' '.join([tag, name.encode()] + [arg.encode() for arg in args]) + b'\r\n')
+        await self.writer.drain()
+        results = {}
+        untagged = []
+        while len(results) < len(tags):
+            line = await self._readline()
+            tag = line.split(b' ', 1)[0]
+            if tag in tags:
+                typ, text = (line[len(tag) + 1:].split(b' ', 1) + [b''])[:2]
+                results[tag] = typ.decode().upper(), text
+            elif line.startswith(b'* BYE') and 'LOGOUT' not in tags.values():
+                raise IMAP4.abort(line.decode(errors='replace'))
+            else:
+                untagged.append(line)
+        for tag, (typ, text) in results.items():
+            if typ not in ('OK', 'NO'):
+                raise IMAP4.error('%s command error: %s %s' % (tags[tag], typ, text.decode(errors='replace')))
+        return [results[tag] for tag in tags], untagged
+
+    @staticmethod
+    def _parse_capabilities(lines):
+        for line in lines:
+            if line.upper().startswith(b'* CAPABILITY '):
+                return tuple(line.decode().upper().split()[2:])
+        return ()
+
+    async def connect(self, host, port=IMAP4_SSL_PORT, ssl_context=None):
+        if ssl_context is None:
+            # same default context as imaplib.IMAP4_SSL
+            ssl_context = ssl._create_stdlib_context()
+        self.reader, self.writer = await asyncio.open_connection(host, port,
+                                                                 ssl=ssl_context)
+        greeting = await self._readline()
+        if not greeting.startswith(b'* OK'):
+            raise IMAP4.error(greeting.decode(errors='replace'))
+
+    async def login(self, login, password):
+        """Log in, raise IMAP4.error if the server rejects the login information."""
+        typ, untagged, text = await self.command('LOGIN', self.quote(login),
+                                                 self.quote(password))
+        if typ != 'OK':
+            raise IMAP4.error(text.decode(errors='replace'))
+        # the capabilities can change once authenticated
+        typ, untagged, text = await self.command('CAPABILITY')
+        self.capabilities = self._parse_capabilities(untagged)
+
+    async def select(self, folder):
+        typ, untagged, text = await self.command('SELECT', self.quote(folder))
+        if typ != 'OK':
+            raise IMAP4.error(text.decode(errors='replace'))
+        self.selected = folder
+
+    async def noop(self):
+        await self.command('NOOP')
+
+    async def list_folders(self, folders):
+        """
+        Return the list of the folders to check from the folder field of a
+        mailbox, see imap.list_folders.
+        """
+        names = []
+        for folder in split_folders(folders):
+            if not is_pattern(folder):
+                if folder not in names:
+                    names.append(folder)
+                continue
+            typ, untagged, text = await self.command('LIST', '""', self.quote(folder))
+            if typ != 'OK':
+                raise IMAP4.error(text.decode(errors='replace'))
+            found = False
+            for line in untagged:
+                if line.upper().startswith(b'* LIST '):
+                    flags, name = parse_list(line[7:])
+                    if is_selectable(flags):
+                        found = True
+                        if name not in names:
+                            names.append(name)
+            if not found:
+                logging.warning('No folder matching %r' % folder)
+        return names
+
+    async def count_unseen(self, folders):
+        """
+        Return the number of unread mails in each folder as a dictionary,
+        see imap.count_unseen.
+        """
+        counts = {}
+        commands = [('STATUS', self.quote(folder), '(UNSEEN)')
+                    for folder in folders if folder != self.selected]
+        if self.selected in folders:
+            if 'ESEARCH' in self.capabilities:
+                commands.append(('SEARCH', 'RETURN', '(COUNT)', 'UNSEEN'))
+            else:
+                commands.append(('SEARCH', 'UNSEEN'))
+        results, untagged = await self.pipeline(commands)
+        errors = [text.decode(errors='replace') for typ, text in results if typ != 'OK']
+        if errors:
+            raise IMAP4.error(', '.join(errors))
+        for line in untagged:
+            upper = line.upper()
+            if upper.startswith(b'* STATUS '):
+                folder, items = parse_status(line[9:])
+                counts[folder] = items.get(b'UNSEEN', 0)
+            elif upper.startswith(b'* ESEARCH'):
+                counts[self.selected] = parse_esearch_count(line)
+            elif upper.startswith(b'* SEARCH'):
+                counts[self.selected] = counts.get(self.selected, 0) + len(line.split()) - 2
+        if self.selected in folders:
+            counts.setdefault(self.selected, 0)
+        return counts
+
+    async def idle(self, wakeup, timeout=IDLE_TIMEOUT):
+        """
+        Send the IDLE command and wait until the server reports a change in
+        the selected folder, until wakeup (asyncio.Event) is set or until
+        timeout seconds have passed.
+
+        Return True if the content of the folder changed.
+        """
+        tag = self._new_tag()
+        await self._send(tag + b' IDLE')
+        line = await self._readline()
+        if not line.startswith(b'+'):
+            raise IMAP4.error('IDLE command error: %s' % line.decode(errors='replace'))
+        loop = asyncio.get_running_loop()
+        end = loop.time() + timeout
+        changed = False
+        waiter = asyncio.ensure_future(wakeup.wait())
+        try:
+            while not (changed or waiter.done()) and loop.time() < end:
+                read = asyncio.ensure_future(self._readline())
+                await asyncio.wait({read, waiter}, timeout=end - loop.time(),
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if not read.done():
+                    read.cancel()
+                    await asyncio.wait({read})
+                if not read.cancelled():
+                    changed = self._is_change(read.result())
+        finally:
+            waiter.cancel()
+        await self._send(b'DONE')
+        while True:
+            line = await self._readline()
+            if line.startswith(tag + b' '):
+                if line.split()[1] != b'OK':
+                    raise IMAP4.error('IDLE command error: %s' % line.decode(errors='replace'))
+                return changed
+            changed = self._is_change(line) or changed
+
+    async def logout(self):
+        try:
+            await self.command('LOGOUT')
+        finally:
+            self.close()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class _Account:
+    """State of the coroutine handling the connection shared by the mailboxes of an account."""
+
+    def __init__(self, key, info):
+        self.key = key
+        # (server, (login, password))
+        self.info = info
+        self.task = None
+        # set when there is something to do
+        self.wakeup = asyncio.Event()
+        # logout requested
+        self.stopping = False
+        # logged in
+        self.connected = False
+        # folder field of each mailbox using the connection
+        self.boxes = {}
+        # folders to check for each mailbox, once listed
+        self.folders = {}
+        # mailboxes waiting for their folders to be listed
+        self.joining = set()
+        # mailboxes waiting for a check, in order
+        self.pending = []
+
+    def remove(self, box):
+        self.boxes.pop(box, None)
+        self.folders.pop(box, None)
+        self.joining.discard(box)
+        if box in self.pending:
+            self.pending.remove(box)
+
+
+class AsyncEngine:
+    """Handle all the mailboxes as coroutines of an asyncio loop running in a thread."""
+
+    def __init__(self, callback, timeout, idle=True, keepalive=600):
+        """
+        Create the engine.
+
+        callback: function called with each event (from the engine thread)
+        timeout: maximum time in seconds for the login or a check
+        idle: use IMAP IDLE when the server supports it
+        keepalive: maximum time in seconds without activity on a connection
+        """
+        self.callback = callback
+        self.timeout = timeout
+        self.idle = idle
+        self.keepalive = keepalive
+        self.loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self._run, name='asyncio_engine', daemon=True)
+        # all the following are only accessed from the engine thread
+        self._info = {}
+        # account of each mailbox
+        self._boxes = {}
+        # connection shared by the mailboxes of each (server, login)
+        self._accounts = {}
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _post(self, kind, box, value=None):
+        self.callback((kind, box, value))
+
+    def _post_all(self, account, kind, value=None):
+        for box in list(account.boxes):
+            self._post(kind, box, value)
+
+    def start(self):
+        self._thread.start()
+
+    # --- public API, can be called from any thread
+    def connect(self, box, server, loginfo, folder):
+        """Connect to box and keep the connection open."""
+        self.loop.call_soon_threadsafe(self._connect, box, (server, loginfo, folder))
+
+    def check(self, box):
+        """Count the unread mails in box, the result is reported as an 'unread' event."""
+        self.loop.call_soon_threadsafe(self._check, box)
+
+    def logout(self, box, reconnect=False):
+        """Logout from box and connect again if reconnect is True."""
+        self.loop.call_soon_threadsafe(self._logout, box, reconnect)
+
+    def set_idle(self, idle):
+        """Enable or disable IMAP IDLE, the open connections switch mode right away."""
+        self.loop.call_soon_threadsafe(self._set_idle, idle)
+
+    def stop(self):
+        """Logout from all the mailboxes and stop the engine."""
+        self.loop.call_soon_threadsafe(self._stop)
+
+    def join(self, timeout=None):
+        """Wait for the engine to stop (see stop)."""
+        self._thread.join(timeout)
+
+    # --- engine thread
+    def _connect(self, box, info):
+        server, loginfo, folder = info
+        previous = self._info.get(box)
+        self._info[box] = info
+        account = self._boxes.get(box)
+        if account is not None and not account.task.done():
+            if account.info != (server, loginfo):
+                # the mailbox moved to another account
+                self._logout(box, True)
+            elif previous != info or box not in account.boxes:
+                account.boxes[box] = folder
+                account.folders.pop(box, None)
+                account.joining.add(box)
+                account.wakeup.set()
+            elif box in account.folders:
+                # reuse the connection
+                self._post('connected', box)
+            else:
+                # the folders could not be listed, try again
+                account.joining.add(box)
+                account.wakeup.set()
+            return
+        key = (server, loginfo[0])
+        account = self._accounts.get(key)
+        if (account is None or account.task.done() or account.stopping
+                or account.info != (server, loginfo)):
+            account = _Account(key, (server, loginfo))
+            account.task = self.loop.create_task(self._account(account))
+            self._accounts[key] = account
+        self._boxes[box] = account
+        account.boxes[box] = folder
+        account.joining.add(box)
+        account.wakeup.set()
+
+    def _set_idle(self, idle):
+        self.idle = idle
+        for account in self._accounts.values():
+            account.wakeup.set()
+
+    def _check(self, box):
+        account = self._boxes.get(box)
+        if account is not None and not account.task.done():
+            if box not in account.pending:
+                account.pending.append(box)
+            account.wakeup.set()
+        else:
+            self._post('check_error', box, 'not connected')
+
+    def _logout(self, box, reconnect):
+        account = self._boxes.pop(box, None)
+        if account is None or account.task.done():
+            if reconnect and box in self._info:
+                self._connect(box, self._info[box])
+            return None
+        account.remove(box)
+        if account.boxes:
+            # the connection is still used by other mailboxes, which may now
+            # be able to use IDLE
+            account.wakeup.set()
+            if reconnect and box in self._info:
+                self._connect(box, self._info[box])
+            return None
+        if self._accounts.get(account.key) is account:
+            del self._accounts[account.key]
+        # let the account coroutine terminate IDLE and logout
+        account.stopping = True
+        account.wakeup.set()
+        return self.loop.create_task(self._wait_logout(box, account, reconnect))
+
+    async def _wait_logout(self, box, account, reconnect):
+        done, pending = await asyncio.wait({account.task}, timeout=self.timeout)
+        if pending:
+            account.task.cancel()
+            await asyncio.wait({account.task})
+        if reconnect and box in self._info and box not in self._boxes:
+            self._connect(box, self._info[box])
+
+    def _stop(self):
+        tasks = [self._logout(box, False) for box in list(self._boxes)]
+        tasks = [task for task in tasks if task is not None]
+        if tasks:
+            self.loop.create_task(asyncio.wait(tasks)).add_done_callback(lambda t: self.loop.stop())
+        else:
+            self.loop.stop()
+
+    def _idle_box(self, account, client):
+        """
+        Return the mailbox whose changes can be pushed by the server, if any:
+        IDLE only applies to a single selected folder so the connection must
+        not be shared.
+        """
+        if not (self.idle and 'IDLE' in client.capabilities) or len(account.boxes) != 1:
+            return None
+        for box, folders in account.folders.items():
+            if len(folders) == 1:
+                return box
+        return None
+
+    async def _login(self, client, account):
+        server, loginfo = account.info
+        await client.connect(*split_server(server))
+        try:
+            await client.login(*loginfo)
+        except IMAP4.abort:
+            raise
+        except IMAP4.error as e:
+            for box in account.boxes:
+                logging.error("Incorrect login or password for %(mailbox)s" % {"mailbox": box})
+            self._post_all(account, 'login_error', str(e))
+            return False
+        return True
+
+    async def _join(self, client, account):
+        """List the folders of the mailboxes that started using the connection."""
+        for box in list(account.joining):
+            account.joining.discard(box)
+            folder = account.boxes.get(box)
+            if folder is None:
+                continue
+            try:
+                folders = await asyncio.wait_for(client.list_folders(folder), self.timeout)
+            except IMAP4.abort:
+                raise
+            except IMAP4.error as e:
+                logging.error('%s: %s' % (box, e))
+                self._post('folder_error', box, str(e))
+                continue
+            if box in account.boxes:
+                account.folders[box] = folders
+                logging.info("Connected to %s" % box)
+                self._post('connected', box)
+
+    async def _account(self, account):
+        """
+        Connect to the account and count the unread mails of its mailboxes
+        each time a check is requested or, in IDLE mode, each time the server
+        reports a change.
+        """
+        client = IMAPClient()
+        try:
+            await self._run_account(account, client)
+        except asyncio.CancelledError:
+            client.close()
+            raise
+        except Exception:
+            logging.exception('Unexpected error for %s' % ', '.join(account.boxes))
+        if account.stopping:
+            logging.info('Logging out of %s' % account.info[0])
+            try:
+                await asyncio.wait_for(client.logout(), self.timeout)
+                logging.info('Logged out of %s' % account.info[0])
+            except (IMAP4.error, OSError, asyncio.TimeoutError):
+                pass
+        client.close()
+
+    async def _run_account(self, account, client):
+        wakeup = account.wakeup
+        logging.info("Connecting to %s" % ', '.join(account.boxes))
+        try:
+            if not await asyncio.wait_for(self._login(client, account), self.timeout):
+                return
+        except asyncio.TimeoutError:
+            self._post_all(account, 'timeout')
+            return
+        except gaierror as e:
+            if e.errno == -2:
+                self._post_all(account, 'unknown_server')
+            else:
+                logging.error('%s: %s' % (account.info[0], e))
+                self._post_all(account, 'connect_error', str(e))
+            return
+        except (IMAP4.error, OSError) as e:
+            logging.error('%s: %s' % (account.info[0], e))
+            self._post_all(account, 'connect_error', str(e))
+            return
+        account.connected = True
+
+        idle_box = None
+        changed = False
+        try:
+            while not account.stopping:
+                wakeup.clear()
+                await self._join(client, account)
+                box = self._idle_box(account, client)
+                if box != idle_box:
+                    idle_box = box
+                    if box is not None:
+                        if client.selected != account.folders[box][0]:
+                            await asyncio.wait_for(client.select(account.folders[box][0]),
+                                                   self.timeout)
+                        logging.info("Waiting for changes in %s (IDLE)" % box)
+                        # count the unread mails right away
+                        changed = True
+                if changed and idle_box is not None and idle_box not in account.pending:
+                    account.pending.append(idle_box)
+                changed = False
+                if not account.pending:
+                    if account.stopping or account.joining:
+                        continue
+                    if idle_box is not None:
+                        changed = await asyncio.wait_for(client.idle(wakeup),
+                                                         IDLE_TIMEOUT + self.timeout)
+                    else:
+                        try:
+                            await asyncio.wait_for(wakeup.wait(), self.keepalive)
+                        except asyncio.TimeoutError:
+                            await asyncio.wait_for(client.noop(), self.timeout)
+                    continue
+                # the checks of the mailboxes are done one after the other
+                box = account.pending.pop(0)
+                if box not in account.boxes:
+                    continue
+                logging.info("Collecting unread mails for %s" % box)
+                try:
+                    if box not in account.folders:
+                        # the folders could not be listed when box joined
+                        account.folders[box] = await asyncio.wait_for(
+                            client.list_folders(account.boxes[box]), self.timeout)
+                    counts = await asyncio.wait_for(client.count_unseen(account.folders[box]),
+                                                    self.timeout)
+                except IMAP4.abort:
+                    raise
+                except IMAP4.error as e:
+                    logging.error('%s: %s' % (box, e))
+                    self._post('check_refused', box, str(e))
+                    continue
+                logging.info("Unread mails collected for %s" % box)
+                self._post('unread', box, sum(counts.values()))
+        except asyncio.TimeoutError:
+            self._post_all(account, 'timeout')
+        except (IMAP4.error, OSError) as e:
+            logging.error('%s: %s' % (account.info[0], e))
+            self._post_all(account, 'check_error', str(e))
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016-2018 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Rendering of the icon with the number of unread mails
+"""
+
+
+from collections import OrderedDict
+from io import BytesIO
+from threading import RLock
+
+from PIL import Image, ImageDraw, ImageFont
+
+# number of rendered icons kept in memory
+CACHE_SIZE = 32
+COLOR = (255, 0, 0)
+# larger numbers are displayed as OVERFLOW+
+OVERFLOW = 99
+# characters of the glyph atlas
+GLYPHS = "0123456789+"
+
+
+def badge_text(count):
+    """Return the text displayed in the icon for count unread mails."""
+    if count > OVERFLOW:
+        return "%i+" % OVERFLOW
+    return "%i" % count
+
+
+def text_size(draw, text, font=None):
+    """Return the size of text drawn with font."""
+    try:
+        return draw.textsize(text, font=font)
+    except AttributeError:
+        # Pillow >= 10
+        left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+        return right, bottom
+
+
+class GlyphAtlas:
+    """
+    Bitmaps of the characters of GLYPHS rendered once with a font, the
+    numbers are drawn by pasting them side by side.
+    """
+
+    def __init__(self, font):
+        """font: FreeTypeFont or None for the default font."""
+        if font is None:
+            font = ImageFont.load_default()
+        self._glyphs = {}
+        draw = ImageDraw.Draw(Image.new("L", (1, 1)))
+        # common height so that all the glyphs share the same baseline
+        self.height = max(text_size(draw, c, font)[1] for c in GLYPHS)
+        for c in GLYPHS:
+            width = text_size(draw, c, font)[0]
+            try:
+                advance = font.getlength(c)
+            except AttributeError:
+                # Pillow < 8
+                advance = width
+            mask = Image.new("L", (max(1, width), max(1, self.height)))
+            ImageDraw.Draw(mask).text((0, 0), c, fill=255, font=font)
+            self._glyphs[c] = (mask, advance)
+
+    def size(self, text):
+        """Return the size of text."""
+        last = text[-1]
+        width = sum(self._glyphs[c][1] for c in text[:-1]) + self._glyphs[last][0].width
+        return width, self.height
+
+    def mask(self, text):
+        """Return the mask of text."""
+        mask = Image.new("L", tuple(int(round(x)) for x in self.size(text)))
+        x = 0
+        for c in text:
+            glyph, advance = self._glyphs[c]
+            # the glyph is the coverage of the character, it is composed
+            # over the previous ones
+            mask.paste(255, (int(round(x)), 0), glyph)
+            x += advance
+        return mask
+
+
+class BadgeRenderer:
+    """
+    Draw numbers on the icon, the PNG data of the last CACHE_SIZE icons are
+    kept in memory and the images and fonts are only loaded once.
+    """
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.cache_size = cache_size
+        # base images {path: Image}
+        self._images = {}
+        # fonts {(path, size): FreeTypeFont or None if it cannot be loaded}
+        self._fonts = {}
+        # glyph atlases {(font path, size): GlyphAtlas}
+        self._atlases = {}
+        # rendered icons {(text, font path, size, image path): PNG data}
+        self._cache = OrderedDict()
+        # the preview of the config dialog can be rendered from another thread
+        self._lock = RLock()
+
+    def image(self, path):
+        """Return the image path, loaded once."""
+        im = self._images.get(path)
+        if im is None:
+            im = Image.open(path)
+            im.load()
+            self._images[path] = im
+        return im
+
+    def font(self, path, size):
+        """Return the font path at the given size, None if it cannot be loaded."""
+        key = (path, size)
+        if key not in self._fonts:
+            try:
+                self._fonts[key] = ImageFont.truetype(path, size)
+            except OSError:
+                self._fonts[key] = None
+        return self._fonts[key]
+
+    def atlas(self, font_path, size):
+        """Return the glyph atlas of the font font_path at the given size."""
+        key = (font_path, size)
+        atlas = self._atlases.get(key)
+        if atlas is None:
+            atlas = GlyphAtlas(self.font(font_path, size))
+            self._atlases[key] = atlas
+        return atlas
+
+    def draw(self, text, font_path, size, image):
+        """Return a new image with text (made of GLYPHS) drawn in the middle of image."""
+        im = self.image(image).copy()
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA")
+        W, H = im.size
+        with self._lock:
+            mask = self.atlas(font_path, size).mask(text)
+        w, h = mask.size
+        if w > W:
+            # e.g. the overflow marker with a large font
+            w, h = W, max(1, h * W // w)
+            mask = mask.resize((w, h), Image.LANCZOS)
+        im.paste(COLOR, ((W - w) // 2, (H - h) // 2), mask)
+        return im
+
+    def render(self, text, font_path, size, image):
+        """Return the PNG data of image with text drawn in the middle."""
+        key = (text, font_path, size, image)
+        with self._lock:
+            data = self._cache.get(key)
+            if data is not None:
+                self._cache.move_to_end(key)
+                return data
+            buffer = BytesIO()
+            self.draw(text, font_path, size, image).save(buffer, "PNG")
+            data = buffer.getvalue()
+            self._cache[key] = data
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return data
+
+
+# shared by the tray icon and the preview of the preferences
+RENDERER = BadgeRenderer()
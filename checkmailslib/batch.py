@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016-2018 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+One-shot check of all the active mailboxes, without GUI
+"""
+
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from imaplib import IMAP4
+from socket import gaierror
+
+from checkmailslib.settings import CONFIG, decrypt
+from checkmailslib.imap import IMAPSession, count_unseen, list_folders
+
+
+def check_mailbox(box, server, loginfo, folder, timeout):
+    """
+    Log in box, count the unread mails and log out within timeout seconds.
+
+    Return a dictionary with the mailbox name, the status ('ok',
+    'login_error', 'unknown_server', 'timeout' or 'error'), the number of
+    unread mails in each folder and the duration of each step in seconds.
+    """
+    result = {"mailbox": box, "status": "ok", "error": None, "unread": None,
+              "folders": {}, "timings": {}}
+    start = time.monotonic()
+    end = start + timeout
+    last = start
+
+    def step(name):
+        nonlocal last
+        now = time.monotonic()
+        result["timings"][name] = round(now - last, 6)
+        last = now
+
+    mail = None
+    try:
+        mail = IMAPSession(server, (server, loginfo), timeout=timeout)
+        step("connect")
+        with mail.deadline(end - time.monotonic()):
+            mail.login(*loginfo)
+            step("login")
+            folders = list_folders(mail, folder)
+            result["folders"] = count_unseen(mail, folders)
+            step("check")
+        result["unread"] = sum(result["folders"].values())
+    except TimeoutError:
+        result["status"] = "timeout"
+    except gaierror as e:
+        result["status"] = "unknown_server" if e.errno == -2 else "error"
+        result["error"] = str(e)
+    except IMAP4.error as e:
+        # the failed step is the first one without timing
+        timings = result["timings"]
+        if ("connect" in timings and "login" not in timings
+                and not isinstance(e, IMAP4.abort)):
+            result["status"] = "login_error"
+        else:
+            result["status"] = "error"
+        result["error"] = str(e)
+    except OSError as e:
+        result["status"] = "error"
+        result["error"] = str(e)
+    finally:
+        if mail is not None:
+            mail.close_session(max(0.1, end - time.monotonic()))
+    result["timings"]["total"] = round(time.monotonic() - start, 6)
+    if result["status"] != "ok":
+        logging.error("%s: %s %s", box, result["status"], result["error"] or "")
+    return result
+
+
+def check_once(pwd, jobs=4):
+    """
+    Check all the active mailboxes, at most jobs at the same time.
+
+    Return the list of the results of check_mailbox in the order of the
+    configuration, None if there is no active mailbox.
+    """
+    timeout = CONFIG.getint("General", "timeout") / 1000
+    mailboxes = [box for box in CONFIG.get("Mailboxes", "active").split(", ") if box]
+    infos = []
+    for box in mailboxes:
+        server, login, password, folder = decrypt(box, pwd)
+        if server is not None:
+            infos.append((box, server, (login, password), folder, timeout))
+    if not infos:
+        return None
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        return list(pool.map(lambda info: check_mailbox(*info), infos))
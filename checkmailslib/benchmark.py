@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016-2018 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Startup benchmark
+
+Usage: python3 -m checkmailslib.benchmark [--budget METRIC=SECONDS ...]
+
+checkmails is started several times in a separate configuration directory
+(see CHECKMAILS_LOCAL_PATH in constants), with mailboxes on a local fake IMAP
+server. The following times, measured from the start of the process, are
+reported:
+
+    import       end of the import of checkmailslib.check
+    icon         creation of the system tray icon
+    first_count  first unread mail count received
+
+The first run is done with empty caches (cold), the median of the other
+runs is reported as the warm time. The cost of the imports of each module
+is measured with python -X importtime. The exit status is 1 if a budget is
+exceeded (warm time, or cold time if there is a single run) and 2 if the
+benchmark could not run.
+"""
+
+
+import argparse
+import json
+import os
+import socket
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from configparser import ConfigParser
+from select import select
+from threading import Event, Thread
+
+METRICS = ('import', 'icon', 'first_count')
+PASSWORD = "benchmark"
+
+
+class FakeIMAPServer:
+    """
+    Minimal IMAP server over TLS on localhost, answering the commands used by
+    checkmails: every folder contains nb_unread unread mails, the changes
+    made with set_unread are pushed to the idling clients.
+    """
+
+    def __init__(self, directory, nb_unread=0):
+        self.nb_unread = nb_unread
+        # set once a client is idling, the changes are then pushed to it
+        self.idling = Event()
+        cert = os.path.join(directory, "cert.pem")
+        key = os.path.join(directory, "key.pem")
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048",
+                        "-nodes", "-subj", "/CN=localhost", "-days", "1",
+                        "-keyout", key, "-out", cert],
+                       check=True, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.load_cert_chain(cert, key)
+        self.socket = socket.socket()
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.listen()
+        self.port = self.socket.getsockname()[1]
+        Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, addr = self.socket.accept()
+            except OSError:
+                # server closed
+                return
+            Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        try:
+            conn = self.context.wrap_socket(conn, server_side=True)
+            file = conn.makefile('rwb')
+            self._session(conn, file)
+        except (OSError, ValueError):
+            pass
+        finally:
+            conn.close()
+
+    def _session(self, conn, file):
+        def write(*lines):
+            for line in lines:
+                file.write(line + b'\r\n')
+            file.flush()
+
+        write(b'* OK IMAP4rev1 fake server ready')
+        while True:
+            line = file.readline()
+            if not line:
+                return
+            tag, cmd, args = (line.strip().split(b' ', 2) + [b'', b''])[:3]
+            cmd = cmd.upper()
+            if cmd == b'CAPABILITY':
+                write(b'* CAPABILITY IMAP4rev1 IDLE ESEARCH', tag + b' OK done')
+            elif cmd in (b'LOGIN', b'NOOP', b'CLOSE'):
+                write(tag + b' OK done')
+            elif cmd in (b'SELECT', b'EXAMINE'):
+                write(b'* %i EXISTS' % self.nb_unread, tag + b' OK [READ-WRITE] done')
+            elif cmd == b'STATUS':
+                folder = args.rsplit(b' (', 1)[0]
+                write(b'* STATUS %s (UNSEEN %i)' % (folder, self.nb_unread),
+                      tag + b' OK done')
+            elif cmd == b'LIST':
+                write(b'* LIST (\\HasNoChildren) "/" "INBOX"', tag + b' OK done')
+            elif cmd == b'SEARCH' and b'RETURN' in args.upper():
+                write(b'* ESEARCH (TAG "%s") COUNT %i' % (tag, self.nb_unread),
+                      tag + b' OK done')
+            elif cmd == b'SEARCH':
+                write(b'* SEARCH' + b''.join(b' %i' % (i + 1) for i in range(self.nb_unread)),
+                      tag + b' OK done')
+            elif cmd == b'IDLE':
+                write(b'+ idling')
+                self._idle(conn, write)
+                file.readline()
+                write(tag + b' OK done')
+            elif cmd == b'LOGOUT':
+                write(b'* BYE', tag + b' OK done')
+                return
+            else:
+                write(tag + b' BAD unknown command')
+
+    def _idle(self, conn, write):
+        """Push the new counts until the client sends DONE."""
+        nb_unread = self.nb_unread
+        self.idling.set()
+        while not (conn.pending() or select([conn], [], [], 0.05)[0]):
+            if self.nb_unread != nb_unread:
+                nb_unread = self.nb_unread
+                write(b'* %i EXISTS' % nb_unread)
+
+    def set_unread(self, nb_unread):
+        """Change the number of unread mails, pushed to the idling clients."""
+        self.nb_unread = nb_unread
+
+    def close(self):
+        self.socket.close()
+
+
+def write_config(local_path, nb_mailboxes, engine, **general):
+    """
+    Create the configuration of the benchmark in local_path, general
+    overrides the options of the General section.
+    """
+    config = ConfigParser()
+    config.add_section("General")
+    config.add_section("Mailboxes")
+    for option, value in [("language", "en"), ("time", "300000"),
+                          ("timeout", "60000"), ("font", ""),
+                          ("check_update", "False"), ("trayicon", ""),
+                          ("idle", "True"), ("engine", engine)]:
+        config.set("General", option, value)
+    for option, value in general.items():
+        config.set("General", option, value)
+    config.set("Mailboxes", "active",
+               ", ".join("benchmark%i" % i for i in range(nb_mailboxes)))
+    config.set("Mailboxes", "inactive", "")
+    with open(os.path.join(local_path, "checkmails.ini"), "w") as file:
+        config.write(file)
+    # the password is not asked by the benchmark (see child)
+    with open(os.path.join(local_path, ".pwd"), "w") as file:
+        file.write("benchmark")
+
+
+def child():
+    """Start checkmails and print the times in json once a count is received."""
+    stamps = {}
+    import checkmailslib.check as check
+    stamps['import'] = time.monotonic()
+    from checkmailslib.constants import CONFIG, encrypt
+
+    # one login per mailbox so that each one gets its own connection
+    for i, box in enumerate(CONFIG.get("Mailboxes", "active").split(", ")):
+        encrypt(box, PASSWORD, os.environ["CHECKMAILS_BENCHMARK_SERVER"],
+                "benchmark%i" % i, PASSWORD, "INBOX")
+
+    tray_icon = check.TrayIcon
+
+    def TrayIcon(*args, **kwargs):
+        icon = tray_icon(*args, **kwargs)
+        stamps['icon'] = time.monotonic()
+        return icon
+
+    check.TrayIcon = TrayIcon
+
+    class CheckMails(check.CheckMails):
+        def ask_password(self):
+            self.pwd = PASSWORD
+
+        def process_event(self, event):
+            check.CheckMails.process_event(self, event)
+            if event[0] == 'unread' and 'first_count' not in stamps:
+                stamps['first_count'] = time.monotonic()
+                print(json.dumps(stamps), flush=True)
+                self.quit()
+
+    app = CheckMails()
+    app.mainloop()
+
+
+def run_once(local_path, port, timeout):
+    """Run checkmails once and return the times since the start of the process."""
+    env = dict(os.environ, CHECKMAILS_LOCAL_PATH=local_path,
+               CHECKMAILS_BENCHMARK_SERVER="127.0.0.1:%i" % port)
+    start = time.monotonic()
+    # time.monotonic uses the same clock in all the processes
+    proc = subprocess.run([sys.executable, "-m", "checkmailslib.benchmark", "--child"],
+                          env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          timeout=timeout)
+    for line in proc.stdout.decode().splitlines():
+        if line.startswith("{"):
+            return {metric: t - start for metric, t in json.loads(line).items()}
+    raise RuntimeError("checkmails did not report any count:\n%s"
+                       % proc.stderr.decode(errors="replace").strip())
+
+
+def import_times(local_path, nb=10):
+    """
+    Return the cumulative import time of the checkmailslib modules and the
+    nb modules with the largest self import time (in s).
+    """
+    env = dict(os.environ, CHECKMAILS_LOCAL_PATH=local_path)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                           "import checkmailslib.check"],
+                          env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    own, others = {}, []
+    for line in proc.stderr.decode().splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            self_time, cumulative = int(fields[0]), int(fields[1])
+        except ValueError:
+            # header
+            continue
+        module = fields[2].strip()
+        if module.startswith("checkmailslib"):
+            own[module] = cumulative / 1e6
+        else:
+            others.append((self_time / 1e6, module))
+    others.sort(reverse=True)
+    return own, others[:nb]
+
+
+def parse_budget(text):
+    metric, sep, value = text.partition("=")
+    if metric not in METRICS or not sep:
+        raise argparse.ArgumentTypeError("expected METRIC=SECONDS with METRIC in %s"
+                                         % ", ".join(METRICS))
+    return metric, float(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python3 -m checkmailslib.benchmark",
+                                     description="Measure the startup time of checkmails.")
+    parser.add_argument("--runs", type=int, default=5,
+                        help="number of runs, the first one is cold (default: 5)")
+    parser.add_argument("--mailboxes", type=int, default=2,
+                        help="number of mailboxes (default: 2)")
+    parser.add_argument("--engine", choices=["threads", "asyncio"], default="threads")
+    parser.add_argument("--timeout", type=float, default=60,
+                        help="maximum duration of a run in s (default: 60)")
+    parser.add_argument("--budget", type=parse_budget, action="append", default=[],
+                        metavar="METRIC=SECONDS",
+                        help="fail if METRIC (%s) exceeds SECONDS" % ", ".join(METRICS))
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child()
+        return 0
+
+    with tempfile.TemporaryDirectory(prefix="checkmails_benchmark") as tmp:
+        local_path = os.path.join(tmp, "config")
+        os.mkdir(local_path)
+        write_config(local_path, args.mailboxes, args.engine)
+        try:
+            server = FakeIMAPServer(tmp)
+        except (OSError, subprocess.CalledProcessError) as e:
+            print("Cannot start the fake IMAP server: %s" % e, file=sys.stderr)
+            return 2
+        try:
+            runs = [run_once(local_path, server.port, args.timeout)
+                    for i in range(max(1, args.runs))]
+        except (RuntimeError, subprocess.TimeoutExpired) as e:
+            print("Benchmark failed: %s" % e, file=sys.stderr)
+            return 2
+        finally:
+            server.close()
+        own, others = import_times(local_path)
+
+    print("Import time of the checkmailslib modules (cumulative):")
+    for module, t in sorted(own.items(), key=lambda item: -item[1]):
+        print("    %-32s %8.3f s" % (module, t))
+    print("Slowest imported modules (self):")
+    for t, module in others:
+        print("    %-32s %8.3f s" % (module, t))
+
+    warm = runs[1:] or runs
+    results = {metric: statistics.median(run[metric] for run in warm) for metric in METRICS}
+    print("Startup times (from the start of the process):")
+    print("    %-12s %8s %8s" % ("", "cold", "warm"))
+    for metric in METRICS:
+        print("    %-12s %8.3f %8.3f" % (metric, runs[0][metric], results[metric]))
+
+    exceeded = [(metric, budget) for metric, budget in args.budget
+                if results[metric] > budget]
+    for metric, budget in exceeded:
+        print("Budget exceeded: %s = %.3f s > %.3f s" % (metric, results[metric], budget),
+              file=sys.stderr)
+    return 1 if exceeded else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -24,33 +24,44 @@ Main class
 import os
 import traceback
 import logging
-from imaplib import IMAP4_SSL, IMAP4
+import time
+from imaplib import IMAP4
 from socket import gaierror
-from threading import Thread
+from threading import Thread, Lock, current_thread
+from importlib import import_module
 from queue import Queue
 import crypt
-try:
-    from subprocess import run
-except ImportError:
-    from subprocess import call as run
 from tkinter import Tk, Toplevel, TclError
 from tkinter.messagebox import showerror, askokcancel
 from tkinter.ttk import Entry, Label, Button, Style
-from PIL import Image, ImageDraw, ImageFont
 from checkmailslib.trayicon import TrayIcon
-from checkmailslib.constants import IMAGE, ICON, IMAGE2, save_config, FONTSIZE,\
-    encrypt, decrypt, LOCAL_PATH, CONFIG, internet_on, TTF_FONTS, ICON_48, \
-    PhotoImage
-from checkmailslib.manager import Manager, EditMailbox
-from checkmailslib.config import Config
-from checkmailslib.about import About
-from checkmailslib.messagebox import show_failed_auth_msg
-from checkmailslib.version_check import UpdateChecker
+from checkmailslib.constants import IMAGE, IMAGE2, save_config, FONTSIZE,\
+    encrypt, decrypt, LOCAL_PATH, CONFIG, TTF_FONTS, ICON_48, \
+    PhotoImage, check_password, time_bounds
+from checkmailslib.imap import Idler, IMAPSession, SessionRegistry, \
+    is_dropped, count_unseen, list_folders, split_server
+from checkmailslib.events import EventQueue
+from checkmailslib.scheduler import Scheduler
+from checkmailslib.aioengine import AsyncEngine
+from checkmailslib.notifications import NOTIFIER
+from checkmailslib.network import ConnectivityMonitor
+
+
+def preload(modules):
+    """Import modules, errors are left to the actual import."""
+    for module in modules:
+        try:
+            import_module(module)
+        except ImportError:
+            pass
 
 
 class CheckMails(Tk):
     """System tray app that periodically looks for new mails."""
     def __init__(self):
+        # to log the time needed to display the first unread mail count
+        self.start_time = time.monotonic()
+        self.first_count = False
         Tk.__init__(self, className="CheckMails")
         self.withdraw()
         logging.info('Starting checkmails')
@@ -60,6 +71,8 @@ class CheckMails(Tk):
 
         # system tray icon
         self.icon = TrayIcon(IMAGE)
+        # (text, font, size, image) of the displayed icon
+        self.icon_key = None
         self.icon.add_menu_item(label=_("Details"), command=self.display)
         self.icon.add_menu_item(label=_("Check"), command=self.check_mails)
         self.icon.add_menu_item(label=_("Reconnect"),
@@ -76,12 +89,11 @@ class CheckMails(Tk):
         self.icon.add_menu_item(label=_("Preferences"), command=self.config)
         self.icon.add_menu_separator()
         self.icon.add_menu_item(label=_("Check for updates"),
-                                command=lambda: UpdateChecker(self, True))
-        self.icon.add_menu_item(label=_("About"),
-                                command=lambda: About(self))
+                                command=lambda: self.check_update(True))
+        self.icon.add_menu_item(label=_("About"), command=self.about)
         self.icon.add_menu_separator()
         self.icon.add_menu_item(label=_("Quit"), command=self.quit)
-        self.icon.loop(self)
+        self.icon.attach(self)
         self.icon.bind_left_click(self.display)
 
         self.style = Style(self)
@@ -102,12 +114,24 @@ class CheckMails(Tk):
         self.pwd = None
         # login info
         self.info_conn = {}
-        # time between two checks
+        # initial time between two checks, then it is adapted for each
+        # mailbox by the scheduler
         self.time = CONFIG.getint("General", "time")
+        self.scheduler = Scheduler(self.time / 1000)
         # maximum time for login / check before the connection is reset
         self.timeout = CONFIG.getint("General", "timeout")
+        # use IMAP IDLE for the servers supporting it instead of polling
+        self.idle = CONFIG.getboolean("General", "idle")
+        # maximum time without activity before sending NOOP to keep the
+        # connections alive
+        self.keepalive = CONFIG.getint("General", "keepalive")
 
         self.boxes = {}
+        # connections shared by the mailboxes with the same server and login
+        self.sessions = SessionRegistry()
+        self.release_lock = Lock()
+        # folders to check for each mailbox
+        self.folders = {}
         # number of unread mails for each mailbox
         self.nb_unread = {box: 0 for box in self.info_conn}
         # connection, logout and check are done in separate threads for each
@@ -116,20 +140,61 @@ class CheckMails(Tk):
         self.threads_connect = {}
         self.threads_logout = {}
         self.threads_check = {}
+        # mailboxes in IDLE mode: the server pushes the changes so they are
+        # not polled
+        self.threads_idle = {}
+        self.idlers = {}
         self.login_err_queue = Queue()
+        # events posted by the mailbox engine, processed in the mainloop
+        self.events = EventQueue(self, self.process_event)
+        # network state, the transitions and the results of the rechecks
+        # are posted as 'network' events
+        self.network = ConnectivityMonitor(lambda online: self.events.put(('network', None, online)))
+        self.network.start()
+        # the checks are stopped until the network is back
+        self.waiting_network = False
+        # mailboxes whose server was not found, waiting for the network
+        # state: {box: number of network evaluations when the lookup failed}
+        self.unresolved = {}
+        # mailbox engine: 'threads' (threads for each connection and check)
+        # or 'asyncio' (all the mailboxes handled in a single thread)
+        if CONFIG.get("General", "engine") == "asyncio":
+            self.engine = AsyncEngine(self.events.put, self.timeout / 1000,
+                                      self.idle, self.keepalive / 1000)
+            self.engine.start()
+        else:
+            self.engine = None
+        # mailboxes waiting for login and waiting for the result of the check
+        self.connecting = set()
+        self.checking = set()
+        # mailboxes whose connection failed, they are connected again when
+        # their check is due
+        self.disconnected = set()
+        # mailboxes whose login information was rejected, they are not
+        # checked until they are connected again (see launch_check)
+        self.login_failed = set()
+        # force_notify argument of the check / notification waiting for the
+        # connections / checks to be done, None if there is none
+        self.launch_waiting = None
+        self.notify_waiting = None
+        # mailboxes checked since the last notification
+        self.checked = set()
         # after callbacks id
         self.check_id = ''
         self.timer_id = ''
-        self.notif_id = ''
-        self.internet_id = ''
+        self.keepalive_id = self.after(self.keepalive // 2, self.keep_alive)
         self.notify_no_internet = True  # avoid multiple notification of No Internet connection
         # notification displayed when clicking on the icon
         self.notif = ''
         # retrieve mailbox login information from encrypted files
         self.get_info_conn()
+        # import the modules needed to display the count while waiting for
+        # the servers, the dialogs are imported when they are opened
+        Thread(target=preload, name='preload', daemon=True,
+               args=(["checkmailslib.badge"],)).start()
 
         if CONFIG.getboolean("General", "check_update"):
-            UpdateChecker(self)
+            self.check_update()
 
         # replace Ctrl+A binding by select all for all entries
         self.bind_class("TEntry", "<Control-a>", self.select_all_entry)
@@ -153,15 +218,12 @@ class CheckMails(Tk):
                 self.after_cancel(self.timer_id)
             except ValueError:
                 pass
-            try:
-                self.after_cancel(self.notif_id)
-            except ValueError:
-                pass
-            try:
-                self.after_cancel(self.internet_id)
-            except ValueError:
-                pass
+            self.launch_waiting = None
+            self.notify_waiting = None
+            for box in list(self.idlers):
+                self.idlers.pop(box).stop()
             self.icon.change_icon(IMAGE, "checkmails suspended")
+            self.icon_key = None
             self.icon.set_item_label(3, _("Restart"))
             self.icon.disable_item(1)
             self.icon.disable_item(2)
@@ -170,7 +232,9 @@ class CheckMails(Tk):
             self.icon.set_item_label(3, _("Suspend"))
             self.icon.enable_item(1)
             self.icon.enable_item(2)
-            self.reconnect()
+            self.notify_no_internet = True
+            # the connections are still alive unless the server dropped them
+            self.reset_conn()
             logging.info("CheckMails restarted")
 
     def reconnect(self):
@@ -180,9 +244,9 @@ class CheckMails(Tk):
         except ValueError:
                 pass
         self.nb_unread = {box: 0 for box in self.info_conn}
-        for box in self.boxes:
+        for box in self.info_conn:
             self.logout(box, True, True)
-        self.check_id = self.after(20000, self.launch_check, False)
+        self.launch_check(False)
 
     def display(self):
         if self.icon.get_item_label(3) == _("Suspend"):
@@ -191,13 +255,16 @@ class CheckMails(Tk):
                 notif = _("Checking...")
         else:
             notif = _("Check suspended")
-        run(["notify-send", "-i", IMAGE2, _("Unread mails"), notif])
+        NOTIFIER.notify(_("Unread mails"), notif, IMAGE2, "unread")
 
     def reset_conn(self):
-        """Logout from all mailboxes, reset all variables and reload all the data."""
-        for box in self.boxes:
-            self.logout(box)
-        self.boxes = {}
+        """
+        Reset all variables and reload all the data. The connections to the
+        mailboxes whose login information did not change are reused.
+        """
+        previous = list(self.boxes if self.engine is None else self.info_conn)
+        self.connecting.clear()
+        self.checking.clear()
         self.nb_unread = {box: 0 for box in self.info_conn}
         self.threads_connect = {}
         self.threads_reconnect = {}
@@ -210,11 +277,12 @@ class CheckMails(Tk):
             self.after_cancel(self.check_id)
         except ValueError:
             pass
-        try:
-            self.after_cancel(self.notif_id)
-        except ValueError:
-            pass
+        self.launch_waiting = None
+        self.notify_waiting = None
         self.get_info_conn()
+        for box in previous:
+            if box not in self.info_conn:
+                self.logout(box)
 
     def get_info_conn(self):
         """
@@ -230,49 +298,78 @@ class CheckMails(Tk):
                 self.set_password()
             else:
                 self.ask_password()
+        active = self.icon.get_item_label(3) == _("Suspend")
         if self.pwd is not None:
             for box in mailboxes:
                 server, login, password, folder = decrypt(box, self.pwd)
                 if server is not None:
                     self.info_conn[box] = (server, (login, password), folder)
+                    if active:
+                        # start the DNS lookup and login while the next
+                        # mailboxes are decrypted
+                        self.connect(box)
+        self.scheduler.update({box: time_bounds(box) for box in self.info_conn})
+        self.network.set_hosts(split_server(info[0]) for info in self.info_conn.values())
 
         if not self.info_conn:
             self.notif = _("No active mailbox")
-            run(["notify-send", "-i", IMAGE2, _("No active mailbox"), _("Use the mailbox manager to configure a mailbox.")])
-        elif self.icon.get_item_label(3) == _("Suspend"):
+            NOTIFIER.notify(_("No active mailbox"),
+                            _("Use the mailbox manager to configure a mailbox."),
+                            IMAGE2, "mailboxes")
+        elif active:
             self.notif = ""
-            for box in self.info_conn:
-                self.connect(box)
-            try:
-                self.after_cancel(self.check_id)
-            except ValueError:
-                pass
-            self.check_id = self.after(20000, self.launch_check, False)
+            self.launch_check(False)
+
+    def check_update(self, notify=False):
+        """Look for a new version of checkmails."""
+        from checkmailslib.version_check import UpdateChecker
+        UpdateChecker(self, notify)
+
+    def about(self):
+        """Open the About dialog."""
+        from checkmailslib.about import About
+        About(self)
 
     def change_icon(self, nbmail):
         """Display the number of unread mails nbmail in the system tray icon."""
-        nb = "%i" % nbmail
-        im = Image.open(IMAGE)
-        W, H = im.size
-        draw = ImageDraw.Draw(im)
-        font_path = TTF_FONTS[CONFIG.get("General", "font")]
-        try:
-            font = ImageFont.truetype(font_path, FONTSIZE)
-            w, h = draw.textsize(nb, font=font)
-            draw.text(((W - w) / 2, (H - h) / 2), nb, fill=(255, 0, 0),
-                      font=font)
-        except OSError:
-            w, h = draw.textsize(nb)
-            draw.text(((W - w) / 2, (H - h) / 2), nb, fill=(255, 0, 0))
-        im.save(ICON)
-        self.icon.change_icon(ICON, "checkmails %s" % nb)
+        from checkmailslib.badge import RENDERER, badge_text
+        key = (badge_text(nbmail), TTF_FONTS.path(CONFIG.get("General", "font")),
+               FONTSIZE, IMAGE)
+        if key == self.icon_key:
+            # the icon already displays this number
+            return
+        self.icon_key = key
+        self.icon.change_icon_data(RENDERER.render(*key), "checkmails %i" % nbmail)
 
     def config(self):
         """Open config dialog to set times and language."""
-        Config(self)
-        self.time = CONFIG.getint("General", "time")
+        from checkmailslib.config import Config
+        dialog = Config(self)
+        dialog.grab_set()
+        self.wait_window(dialog)
+        if not dialog.saved:
+            return
+        interval = CONFIG.getint("General", "time")
+        if interval != self.time:
+            # keep the schedule of each mailbox
+            self.time = interval
+            self.scheduler.set_interval(self.time / 1000)
         self.timeout = CONFIG.getint("General", "timeout")
+        self.keepalive = CONFIG.getint("General", "keepalive")
+        idle = CONFIG.getboolean("General", "idle")
+        idle_changed = idle != self.idle
+        self.idle = idle
+        if self.engine is not None:
+            self.engine.timeout = self.timeout / 1000
+            self.engine.keepalive = self.keepalive / 1000
+            if idle_changed:
+                self.engine.set_idle(self.idle)
         if self.icon.get_item_label(3) == _("Suspend"):
+            if idle_changed and self.engine is None:
+                # start or stop the IDLE loops (see connect_shared)
+                for box in list(self.boxes):
+                    if box in self.info_conn and box not in self.login_failed:
+                        self.connect(box)
             self.check_mails(False)
 
     def manage_mailboxes(self):
@@ -283,128 +380,277 @@ class CheckMails(Tk):
             else:
                 self.ask_password()
         if self.pwd is not None:
+            from checkmailslib.manager import Manager
             m = Manager(self, self.pwd)
             m.grab_set()
             self.wait_window(m)
             self.reset_conn()
 
+    def can_idle(self, box, mail):
+        """
+        Return True if the changes in box can be pushed by the server: IDLE
+        only applies to a single selected folder, so the connection must not
+        be shared with other mailboxes.
+        """
+        return (self.idle and Idler.supported(mail) and len(self.folders[box]) == 1
+                and self.users(mail) == [box])
+
+    def users(self, mail):
+        """Return the list of the mailboxes using the connection mail."""
+        return [b for b, m in list(self.boxes.items()) if m is mail]
+
+    def session_alive(self, mail, info):
+        """Return True if mail is an alive connection with the login information info."""
+        if mail.info != info:
+            return False
+        if any(b in self.idlers for b in self.users(mail)):
+            # the connection is waiting for the server in IDLE mode
+            return True
+        return mail.alive(self.timeout / 1000)
+
+    def release_session(self, box, mail):
+        """Stop using mail for box and logout if no other mailbox uses it."""
+        self.stop_idle(box)
+        with self.release_lock:
+            if self.boxes.get(box) is mail:
+                del self.boxes[box]
+            if self.users(mail):
+                return
+        self.sessions.discard(mail)
+        logging.info('Logging out of %s' % box)
+        mail.close_session(self.timeout / 1000)
+        logging.info('Logged out of %s' % box)
+
     def connect_mailbox(self, box):
-        """Connect to the mailbox box and select the folder."""
-        try:
-            logging.info("Connecting to %s" % box)
-            serveur, loginfo, folder = self.info_conn[box]
-            # reinitialize the connection if it takes too long
-            timeout_id = self.after(self.timeout, self.timed_out, box, False, True)
-            self.boxes[box] = IMAP4_SSL(serveur)
-            self.boxes[box].login(*loginfo)
-            self.boxes[box].select(folder)
+        """
+        Connect to the mailbox box. The connection is shared by all the
+        mailboxes with the same server and login and reused as long as it is
+        alive. The folder is selected only in IDLE mode.
+        """
+        key = SessionRegistry.key(self.info_conn[box])
+        # one connection attempt at a time for each account, so that the
+        # other mailboxes can then share it
+        with self.sessions.lock(key):
+            self.connect_shared(box, key)
+
+    def connect_shared(self, box, key):
+        """Connect box using the shared connection of its account (see connect_mailbox)."""
+        serveur, loginfo, folder = self.info_conn[box]
+        mail = self.sessions.get(key)
+        previous = self.boxes.get(box)
+        if previous is not None and box in self.idlers:
+            thread = self.threads_idle.get(box)
+            if (previous is mail and previous.info == (serveur, loginfo)
+                    and self.can_idle(box, mail)
+                    and thread is not None and thread.is_alive()):
+                # the IDLE loop checks the connection regularly
+                logging.info("Reusing connection to %s" % box)
+                self.events.put(('connected', box, None))
+                return
+            # restart the IDLE loop once the connection is checked
+            self.stop_idle(box)
+        if previous is not None and previous is not mail:
+            self.release_session(box, previous)
+        if mail is not None and not self.session_alive(mail, (serveur, loginfo)):
+            self.sessions.discard(mail)
             try:
-                self.after_cancel(timeout_id)
-            except ValueError:
+                mail.shutdown()
+            except OSError:
                 pass
+            mail = None
+        try:
+            # the whole connection process must not take more than timeout
+            timeout = self.timeout / 1000
+            end = time.monotonic() + timeout
+            if mail is None:
+                logging.info("Connecting to %s" % box)
+                mail = IMAPSession(serveur, (serveur, loginfo), timeout=timeout)
+                self.boxes[box] = mail
+                with mail.deadline(end - time.monotonic()):
+                    mail.login(*loginfo)
+                self.sessions.add(key, mail)
+            else:
+                logging.info("Reusing connection to %s" % box)
+                for b in self.users(mail):
+                    if b != box:
+                        # the connection cannot be shared while in IDLE mode
+                        self.stop_idle(b)
+                self.boxes[box] = mail
+            with mail.lock, mail.deadline(end - time.monotonic()):
+                try:
+                    self.folders[box] = list_folders(mail, folder)
+                except IMAP4.abort:
+                    raise
+                except IMAP4.error as e:
+                    # the login succeeded, the folders are listed again at
+                    # the next check
+                    logging.error('%s: %s' % (box, e))
+                    self.folders.pop(box, None)
+                    self.events.put(('folder_error', box, str(e)))
+                    return
+                idle = self.can_idle(box, mail)
+                if idle:
+                    mail.select(self.folders[box][0])
             logging.info("Connected to %s" % box)
+            if idle and box not in self.idlers:
+                self.start_idle(box)
+            self.events.put(('connected', box, None))
 
-        except (IMAP4.error, ConnectionResetError, TimeoutError) as e:
-            try:
-                self.after_cancel(timeout_id)
-            except ValueError:
-                pass
+        except TimeoutError:
+            logging.error('%s: connection timed out' % box)
+            self.events.put(('timeout', box, None))
+        except (IMAP4.error, ConnectionResetError) as e:
             if e.args[0] in [b'Invalid login or password',
                              b'Authenticate error',
                              b'Login failed: authentication failure',
                              b'LOGIN failed']:
                 # Identification error
                 logging.error("Incorrect login or password for %(mailbox)s" % {"mailbox": box})
-                self.login_err_queue.put(box)
+                self.events.put(('login_error', box, str(e)))
             else:
-                # try to reconnect
+                # try to reconnect when the check is due
                 logging.error('%s: %s' % (box, e))
-                self.logout(box, reconnect=True)
+                self.events.put(('connect_error', box, str(e)))
         except gaierror as e:
             if e.errno == -2:
-                # Either there is No Internet connection or the IMAP server is wrong
-                if internet_on():
-                    run(["notify-send", "-i", "dialog-error", _("Error"),
-                         _("Wrong IMAP server for %(mailbox)s.") % {"mailbox": box}])
-                    # remove box from the active mailboxes
-                    active = CONFIG.get("Mailboxes", "active").split(", ")
-                    inactive = CONFIG.get("Mailboxes", "inactive").split(", ")
-                    while "" in active:
-                        active.remove("")
-                    while "" in inactive:
-                        inactive.remove("")
-                    active.remove(box)
-                    inactive.append(box)
-                    CONFIG.set("Mailboxes", "active", ", ".join(active))
-                    CONFIG.set("Mailboxes", "inactive", ", ".join(inactive))
-                    logging.error("Wrong IMAP server for %(mailbox)s." % {"mailbox": box})
-                else:
-                    if self.notify_no_internet:
-                        run(["notify-send", "-i", "dialog-error", _("Error"),
-                             _("No Internet connection.")])
-                        self.notify_no_internet = False
-                    logging.warning("No Internet connection")
-                    # cancel everything
-                    try:
-                        self.after_cancel(self.check_id)
-                    except ValueError:
-                        pass
-                    try:
-                        self.after_cancel(self.timer_id)
-                    except ValueError:
-                        pass
-                    try:
-                        self.after_cancel(self.notif_id)
-                    except ValueError:
-                        pass
-                    try:
-                        self.after_cancel(self.internet_id)
-                    except ValueError:
-                        pass
-                    # periodically checks if the internet connection is turned on
-                    self.internet_id = self.after(self.timeout, self.test_connection)
+                self.events.put(('unknown_server', box, None))
             else:
-                # try to reconnect
+                # try to reconnect when the check is due
                 logging.exception(str(type(e)))
-                run(["notify-send", "-i", "dialog-error", _("Error"),
-                     traceback.format_exc()])
-                self.logout(box, reconnect=True)
+                NOTIFIER.notify(_("Error"), traceback.format_exc(),
+                                "dialog-error", ("error", box))
+                self.events.put(('connect_error', box, str(e)))
+        except OSError as e:
+            logging.error('%s: %s' % (box, e))
+            self.events.put(('connect_error', box, str(e)))
 
         except ValueError:
             # Error sometimes raised when a connection process is interrupted by a logout process
             pass
 
-    def test_connection(self):
+    def server_not_found(self, box):
         """
-        Launch mail check if there is an internet connection otherwise
-        check again for an internet connection after self.timeout.
+        Handle the case where the server of box could not be found:
+        either there is no Internet connection or the IMAP server is wrong.
         """
-        if internet_on():
-            self.reset_conn()
+        # the answer is given by network_changed, the mailbox must not be
+        # deactivated because of an outdated probe
+        self.unresolved[box] = self.network.evaluations
+        self.network.recheck(fresh=True)
+
+    def wrong_server(self, box):
+        """Deactivate box, whose server could not be found while online."""
+        NOTIFIER.notify(_("Error"),
+                        _("Wrong IMAP server for %(mailbox)s.") % {"mailbox": box},
+                        "dialog-error", ("error", box))
+        self.deactivate(box)
+        logging.error("Wrong IMAP server for %(mailbox)s." % {"mailbox": box})
+
+    def no_internet(self):
+        """Cancel all checks and wait for the Internet connection."""
+        if self.notify_no_internet:
+            NOTIFIER.notify(_("Error"), _("No Internet connection."),
+                            "dialog-error", "internet")
+            self.notify_no_internet = False
+        logging.warning("No Internet connection")
+        # cancel everything
+        try:
+            self.after_cancel(self.check_id)
+        except ValueError:
+            pass
+        try:
+            self.after_cancel(self.timer_id)
+        except ValueError:
+            pass
+        self.launch_waiting = None
+        self.notify_waiting = None
+        # the connections are reset when the network is back (see network_changed)
+        self.waiting_network = True
+
+    def deactivate(self, box):
+        """Remove box from the active mailboxes."""
+        active = CONFIG.get("Mailboxes", "active").split(", ")
+        inactive = CONFIG.get("Mailboxes", "inactive").split(", ")
+        while "" in active:
+            active.remove("")
+        while "" in inactive:
+            inactive.remove("")
+        if box in active:
+            active.remove(box)
+        inactive.append(box)
+        CONFIG.set("Mailboxes", "active", ", ".join(active))
+        CONFIG.set("Mailboxes", "inactive", ", ".join(inactive))
+        self.logout(box)
+        self.info_conn.pop(box, None)
+        self.connection_done(box, False)
+        self.check_done(box)
+
+    def network_changed(self, online):
+        """
+        Stop the checks when the network goes down and reconnect as soon as
+        it is back. The mailboxes whose server was not found in the meantime
+        are deactivated if the network is up.
+        """
+        active = self.icon.get_item_label(3) == _("Suspend")
+        if not online:
+            # the failed lookups are retried when the checks are due
+            self.unresolved.clear()
+            if active and not self.waiting_network:
+                self.no_internet()
+            return
+        for box, evaluations in list(self.unresolved.items()):
+            if self.network.evaluations == evaluations:
+                # published before the probe requested by server_not_found
+                continue
+            del self.unresolved[box]
+            if box in self.info_conn and self.network.online():
+                self.wrong_server(box)
+        if self.waiting_network:
+            self.waiting_network = False
             logging.info("Connected to Internet")
             self.notify_no_internet = True
+            self.drop_sessions()
+            if active:
+                self.reset_conn()
+
+    def drop_sessions(self):
+        """
+        Forget the connections opened before a network outage: they are
+        probably dead and the IDLE loops would only notice it after
+        IDLE_TIMEOUT. The mailboxes then get new connections.
+        """
+        for box in list(self.idlers):
+            self.idlers.pop(box).stop()
+        if self.engine is None:
+            for mail in self.sessions.clear():
+                try:
+                    mail.shutdown()
+                except OSError:
+                    pass
         else:
-            self.internet_id = self.after(self.timeout, self.test_connection)
+            for box in self.info_conn:
+                self.engine.logout(box)
 
     def logout_mailbox(self, box, reconnect):
         """
         Logout from box. If reconnect is True, launch connection once
         logout is done.
         """
-        if box in self.boxes:
-            mail = self.boxes[box]
-            try:
-                logging.info('Logging out of %s' % box)
-                mail.logout()
-                logging.info('Logged out of %s' % box)
-            except (IMAP4.abort, OSError):
-                # the connection attempt has aborted due to the logout
-                pass
-            if reconnect:
-                self.connect(box)
+        mail = self.boxes.get(box)
+        if mail is not None:
+            self.release_session(box, mail)
+        if reconnect:
+            # also when the previous connection attempt failed
+            self.connect(box)
 
     def connect(self, box):
         """Launch the connection to the mailbox box in a thread """
+        self.disconnected.discard(box)
+        self.login_failed.discard(box)
+        self.connecting.add(box)
+        if self.engine is not None:
+            self.engine.connect(box, *self.info_conn[box])
+            return
         if not (box in self.threads_connect and self.threads_connect[box].is_alive()):
             self.threads_connect[box] = Thread(target=self.connect_mailbox,
                                                name='connect_' + box,
@@ -412,12 +658,110 @@ class CheckMails(Tk):
                                                args=(box,))
             self.threads_connect[box].start()
 
+    def start_idle(self, box):
+        """Launch the IDLE loop of the mailbox box in a thread."""
+        self.idlers[box] = Idler(self.boxes[box])
+        self.threads_idle[box] = Thread(target=self.idle_mailbox,
+                                        name='idle_' + box,
+                                        daemon=True,
+                                        args=(box, self.idlers[box]))
+        self.threads_idle[box].start()
+
+    def stop_idle(self, box):
+        """Terminate the IDLE loop of box and wait for the connection to be free."""
+        idler = self.idlers.pop(box, None)
+        if idler is None:
+            return
+        idler.stop()
+        thread = self.threads_idle.pop(box, None)
+        if thread is not None and thread is not current_thread():
+            thread.join(self.timeout / 1000)
+            if thread.is_alive():
+                # the server does not answer, unblock the thread
+                try:
+                    idler.mail.shutdown()
+                except OSError:
+                    pass
+
+    def idle_mailbox(self, box, idler):
+        """
+        Count the unread mails in box each time the server reports a change
+        in the folder (IDLE mode).
+        """
+        mail = idler.mail
+        logging.info("Waiting for changes in %s (IDLE)" % box)
+        try:
+            changed = True
+            while not idler.stopped:
+                if changed:
+                    with mail.lock, mail.deadline(self.timeout / 1000):
+                        nb = sum(count_unseen(mail, self.folders[box]).values())
+                    self.events.put(('unread', box, nb))
+                changed = idler.idle()
+        except (IMAP4.error, OSError) as e:
+            if idler.stopped:
+                return
+            logging.error('%s: %s' % (box, e))
+            if is_dropped(e):
+                self.logout(box, force=True, reconnect=True)
+            else:
+                # IDLE refused, fall back to polling
+                self.idlers.pop(box, None)
+        finally:
+            idler.close()
+
+    def update_unread(self, box, nb):
+        """Update the number of unread mails in box after a change pushed by the server."""
+        if self.engine is None and box not in self.idlers:
+            # the mailbox is no longer in IDLE mode
+            return
+        if self.icon.get_item_label(3) != _("Suspend"):
+            return
+        new = nb > self.nb_unread.get(box, 0)
+        self.nb_unread[box] = nb
+        if self.notif.startswith(_("Checking...")):
+            # the notification text will be updated at the end of the check
+            self.change_icon(sum(self.nb_unread.values()))
+            return
+        unread = ["%s : %i" % (b, n) for b, n in self.nb_unread.items() if n > 0]
+        if unread:
+            self.notif = ", ".join(unread)
+        else:
+            self.notif = _("No unread mail")
+        if new:
+            NOTIFIER.notify(_("Unread mails"), self.notif, IMAGE2, "unread")
+        self.change_icon(sum(self.nb_unread.values()))
+
+    def keep_alive(self):
+        """Periodically keep the unused connections alive."""
+        if self.engine is None:
+            Thread(target=self.keepalive_sessions, name='keepalive',
+                   daemon=True).start()
+        self.keepalive_id = self.after(self.keepalive // 2, self.keep_alive)
+
+    def keepalive_sessions(self):
+        """Send NOOP on the unused connections and reconnect the dropped ones."""
+        for box, mail in list(self.boxes.items()):
+            if box in self.idlers:
+                # the IDLE command is re-issued regularly
+                continue
+            if not mail.keepalive(self.keepalive / 1000, self.timeout / 1000):
+                logging.warning('%s: connection dropped by the server' % box)
+                self.logout(box, force=True, reconnect=True)
+
     def logout(self, box, force=False, reconnect=False):
         """
         Launch the logout from box in a thread. If force is True,
         launch the logout even if a logout process is active. If reconnect
         is True, launch the connection to box once the logout is done.
         """
+        if reconnect:
+            self.disconnected.discard(box)
+            self.login_failed.discard(box)
+            self.connecting.add(box)
+        if self.engine is not None:
+            self.engine.logout(box, reconnect)
+            return
         if force or not (box in self.threads_logout and self.threads_logout[box].is_alive()):
             self.threads_logout[box] = Thread(target=self.logout_mailbox,
                                               name='logout_' + box,
@@ -427,173 +771,292 @@ class CheckMails(Tk):
 
     def timed_out(self, box, force=False, reconnect=False):
         """Check Internet connection if check timed out."""
-        if internet_on():
-            self.logout(box, force, reconnect)
+        online = self.network.online()
+        if box in self.connecting:
+            # the connection timed out, it is tried again when the check is due
+            self.connection_failed(box)
         else:
-            if self.notify_no_internet:
-                run(["notify-send", "-i", "dialog-error", _("Error"),
-                     _("No Internet connection.")])
-                self.notify_no_internet = False
-            logging.warning("No Internet connection")
-            # cancel everything
-            try:
-                self.after_cancel(self.check_id)
-            except ValueError:
-                pass
-            try:
-                self.after_cancel(self.timer_id)
-            except ValueError:
-                pass
-            try:
-                self.after_cancel(self.notif_id)
-            except ValueError:
-                pass
-            try:
-                self.after_cancel(self.internet_id)
-            except ValueError:
-                pass
-            # periodically checks if the internet connection is turned on
-            self.internet_id = self.after(self.timeout, self.test_connection)
+            self.scheduler.failed(box)
+            if online:
+                self.logout(box, force, reconnect)
+        if online:
+            # the checks are stopped by network_changed if the network is down
+            self.network.recheck()
+        else:
+            self.no_internet()
+        self.check_done(box)
 
-    def launch_check(self, force_notify=False):
+    def launch_check(self, force_notify=False, wait=True):
         """
-        Check every 20 s if the login to all the mailboxes is done.
-        Once it is the case, launch the unread mail check.
+        Launch the unread mail check once the login to all the mailboxes is
+        done: if some are still connecting, the check is launched when the
+        last one reports (see connection_done) or after self.timeout if wait
+        is False.
         """
-        b = [self.threads_connect[box].is_alive() for box in self.threads_connect]
-        if len(b) < len(self.info_conn) or True in b:
+        try:
+            self.after_cancel(self.check_id)
+        except ValueError:
+            pass
+        if wait and self.connecting:
             logging.info("Waiting for connexion ...")
-            try:
-                self.after_cancel(self.check_id)
-            except ValueError:
-                pass
-            self.check_id = self.after(20000, self.launch_check, force_notify)
-        else:
-            logging.info("Launching check")
-            if not self.login_err_queue.empty():
-                correct = False
-                while not self.login_err_queue.empty():
-                    box = self.login_err_queue.get()
-                    action = show_failed_auth_msg(self, box)
-                    if action == 'correct':
-                        dialog = EditMailbox(self, self.pwd, box)
-                        self.wait_window(dialog)
-                        self.connect(box)
-                        correct = dialog.name or correct
-                    else:
-                        # remove box from the active mailboxes
-                        del(self.boxes[box])
-                        active = CONFIG.get("Mailboxes", "active").split(", ")
-                        inactive = CONFIG.get("Mailboxes", "inactive").split(", ")
-                        while "" in active:
-                            active.remove("")
-                        while "" in inactive:
-                            inactive.remove("")
-                        active.remove(box)
-                        inactive.append(box)
-                        CONFIG.set("Mailboxes", "active", ", ".join(active))
-                        CONFIG.set("Mailboxes", "inactive", ", ".join(inactive))
-                if correct:
-                    self.after_cancel(self.check_id)
-                    self.check_id = self.after(20000, self.launch_check, force_notify)
+            if self.launch_waiting is None:
+                # the mailboxes already logged in are checked right away,
+                # the others as soon as their login is done
+                self.notif = _("Checking...") + "\n"
+                self.launch_waiting = force_notify
+                self.check_mails(force_notify,
+                                 [b for b in self.info_conn if b not in self.connecting])
+            self.launch_waiting = force_notify
+            # do not wait forever for a connection that hangs
+            self.check_id = self.after(self.timeout, self.launch_check,
+                                       force_notify, False)
+            return
+        started = self.launch_waiting is not None
+        self.launch_waiting = None
+        logging.info("Launching check")
+        if not self.login_err_queue.empty():
+            from checkmailslib.manager import EditMailbox
+            from checkmailslib.messagebox import show_failed_auth_msg
+            correct = False
+            while not self.login_err_queue.empty():
+                box = self.login_err_queue.get()
+                action = show_failed_auth_msg(self, box)
+                if action == 'correct':
+                    dialog = EditMailbox(self, self.pwd, box)
+                    self.wait_window(dialog)
+                    self.connect(box)
+                    correct = dialog.name or correct
                 else:
-                    self.check_mails(force_notify)
-            else:
-                self.check_mails(force_notify)
+                    # remove box from the active mailboxes
+                    self.deactivate(box)
+            if correct:
+                self.launch_check(force_notify)
+                return
+        if started:
+            # check the mailboxes that were not checked while waiting, the
+            # failed connections are tried again when their check is due
+            self.check_mails(force_notify,
+                             [b for b in self.info_conn
+                              if b not in self.checked and b not in self.disconnected])
+        else:
+            self.check_mails(force_notify)
+
+    def connection_failed(self, box):
+        """
+        Record that the connection to box failed, it is tried again when the
+        check of box is due so that the retries follow the failure backoff.
+        """
+        self.scheduler.failed(box)
+        self.disconnected.add(box)
+        self.logout(box)
+        self.connection_done(box, False)
+
+    def has_connection(self, box):
+        """Return True if box is connected (the server may have dropped the connection since)."""
+        if box in self.disconnected:
+            return False
+        return self.engine is not None or box in self.boxes
+
+    def connection_done(self, box, connected=True):
+        """Record that the connection to box is finished (successfully or not)."""
+        self.connecting.discard(box)
+        if self.launch_waiting is None:
+            self.schedule()
+        elif not self.connecting:
+            self.launch_check(self.launch_waiting)
+        elif connected:
+            # do not wait for the other mailboxes to check this one
+            self.check_mails(self.launch_waiting, [box])
+
+    def check_done(self, box):
+        """Record that the check of box is finished (successfully or not)."""
+        self.checking.discard(box)
+        if not self.checking and self.launch_waiting is None and self.notify_waiting is not None:
+            self.notify_unread_mails(self.notify_waiting)
+        self.schedule()
+
+    def schedule(self):
+        """Schedule the check of the mailbox(es) due first."""
+        try:
+            self.after_cancel(self.timer_id)
+        except ValueError:
+            pass
+        if self.icon.get_item_label(3) != _("Suspend"):
+            return
+        boxes = [box for box in self.info_conn if box not in self.idlers
+                 and box not in self.connecting and box not in self.checking
+                 and box not in self.login_failed]
+        delay = self.scheduler.next_check(boxes)
+        if delay is not None:
+            self.timer_id = self.after(int(delay * 1000), self.check_due)
+
+    def check_due(self):
+        """Check the mailboxes whose next check is due."""
+        boxes = [box for box in self.info_conn
+                 if box not in self.idlers and box not in self.login_failed]
+        self.check_mails(False, self.scheduler.due(boxes))
 
     def check_mailbox(self, box):
-        """Look for unread mails in box."""
+        """Look for unread mails in box, the result is posted as an event."""
         mail = self.boxes[box]
-        # reinitialize the connection if it takes too long
-        timeout_id = self.after(self.timeout, self.timed_out, box, True, True)
-        logging.info("Collecting unread mails for %s" % box)
         try:
-            r, messages = mail.search(None, '(UNSEEN)')
-            try:
-                self.after_cancel(timeout_id)
-            except ValueError:
-                pass
-            self.nb_unread[box] = len(messages[0].split())
-            if self.nb_unread[box] > 0:
-                self.notif += "%s : %i, " % (box, self.nb_unread[box])
+            # the checks of the mailboxes sharing the connection are queued
+            with mail.lock, mail.deadline(self.timeout / 1000):
+                logging.info("Collecting unread mails for %s" % box)
+                if box not in self.folders:
+                    # the folders could not be listed after the login
+                    self.folders[box] = list_folders(mail, self.info_conn[box][2])
+                nb = sum(count_unseen(mail, self.folders[box]).values())
             logging.info("Unread mails collected for %s" % box)
+            self.events.put(('unread', box, nb))
+        except TimeoutError:
+            logging.error('%s: check timed out' % box)
+            self.events.put(('timeout', box, None))
+        except (IMAP4.error, OSError) as e:
+            if is_dropped(e):
+                self.events.put(('check_error', box, str(e)))
+            else:
+                self.events.put(('check_refused', box, str(e)))
 
-        except (IMAP4.error, ConnectionResetError, TimeoutError) as e:
-            try:
-                self.after_cancel(timeout_id)
-            except ValueError:
-                pass
-            if self.notif != _("Checking...") + "/n":
-                logging.error('%s: %s' % (box, e))
-                notif = self.notif
-                notif += "%s : %s, " % (box, _("Timed out, reconnecting"))
-                run(["notify-send", "-i", IMAGE2, _("Unread mails"), notif])
-                nbtot = 0
-                for b, nb in self.nb_unread.items():
-                    if b != box:
-                        nbtot += nb
-                self.change_icon(nbtot)
+    def check_failed(self, box, error, dropped=True):
+        """
+        Notify that the check of box failed and reconnect if the server
+        dropped the connection.
+        """
+        self.scheduler.failed(box)
+        if self.notif != _("Checking...") + "/n":
+            logging.error('%s: %s' % (box, error))
+            if dropped:
+                reason = _("%(error)s, reconnecting") % {"error": error}
             else:
-                logging.exception(str(type(e)))
+                reason = error
+            notif = self.notif
+            notif += "%s : %s, " % (box, reason)
+            NOTIFIER.notify(_("Unread mails"), notif, IMAGE2, "unread")
+            nbtot = 0
+            for b, nb in self.nb_unread.items():
+                if b != box:
+                    nbtot += nb
+            self.change_icon(nbtot)
+        else:
+            logging.exception(str(type(error)))
+        if dropped:
             self.logout(box, force=True, reconnect=True)
 
-    def check_mails(self, force_notify=True):
+    def check_mails(self, force_notify=True, boxes=None):
         """
-        Check whether there are new mails. If force_notify is True,
-        display a notification even if there is no unread mail.
+        Check whether there are new mails in boxes (all the mailboxes if
+        None). If force_notify is True, display a notification even if there
+        is no unread mail.
         """
-        self.notif = _("Checking...") + "\n"
-        try:
-            self.after_cancel(self.timer_id)
-        except ValueError:
-            pass
-        try:
-            self.after_cancel(self.notif_id)
-        except ValueError:
-            pass
-        for box, mail in self.boxes.items():
-            if not self.threads_connect[box].is_alive() and (box not in self.threads_check or not self.threads_check[box].is_alive()):
+        if boxes is None:
+            self.notif = _("Checking...") + "\n"
+            boxes = self.info_conn
+        boxes = set(boxes) - self.connecting - self.checking - self.login_failed
+        for box in [b for b in boxes if not self.has_connection(b)]:
+            # connect first, the check is done once the connection is made
+            boxes.discard(box)
+            self.connect(box)
+        if self.engine is None:
+            # the number of unread mails of the mailboxes in IDLE mode is
+            # kept up-to-date by the server
+            boxes = boxes.difference(self.idlers)
+        for box in boxes:
+            self.checking.add(box)
+            if self.engine is not None:
+                self.engine.check(box)
+            elif not (box in self.threads_check and self.threads_check[box].is_alive()):
                 self.threads_check[box] = Thread(target=self.check_mailbox,
                                                  name='check_' + box,
                                                  daemon=True,
                                                  args=(box,))
                 self.threads_check[box].start()
-        self.notif_id = self.after(20000, self.notify_unread_mails, force_notify)
-        self.timer_id = self.after(self.time, self.check_mails, False)
+        self.checked.update(boxes)
+        # the notification is displayed once all the checks are done
+        if self.notify_waiting is None or force_notify:
+            self.notify_waiting = force_notify
+        if not self.checking and self.launch_waiting is None:
+            # during the startup, wait for the remaining logins
+            self.notify_unread_mails(self.notify_waiting)
+        self.schedule()
 
     def notify_unread_mails(self, force_notify=True):
         """
-        Check every 20 s if the checks are done for all the mailboxes.
-        If it is the case display the number of unread mails for each boxes.
-        If force_notify is True, display a notification even if there is no
-        unread mail.
+        Display the number of unread mails for each boxes, once the checks
+        are done. A notification is displayed if the checked mailboxes
+        contain unread mails or if force_notify is True.
         """
-        b = [self.threads_check[box].is_alive() for box in self.threads_check]
-        if len(b) < len(self.info_conn) or True in b:
-            self.notif_id = self.after(20000, self.notify_unread_mails, force_notify)
+        self.notify_waiting = None
+        unread = ["%s : %i" % (box, nb) for box, nb in self.nb_unread.items() if nb > 0]
+        checked_unread = any(self.nb_unread.get(box, 0) > 0 for box in self.checked)
+        self.checked.clear()
+        if unread:
+            self.notif = ", ".join(unread)
+            if force_notify or checked_unread:
+                NOTIFIER.notify(_("Unread mails"), self.notif, IMAGE2, "unread")
         else:
-            if self.notif != _("Checking...") + "\n":
-                try:
-                    self.notif = self.notif[:-2].split("\n")[1]
-                    run(["notify-send", "-i", IMAGE2, _("Unread mails"), self.notif])
-                except IndexError:
-                    run(["notify-send", "-i", IMAGE2, _("Unread mails"), self.notif])
-            elif force_notify:
-                run(["notify-send", "-i", IMAGE2, _("Unread mails"), _("No unread mail")])
-                self.notif = _("No unread mail")
+            self.notif = _("No unread mail")
+            if force_notify:
+                NOTIFIER.notify(_("Unread mails"), self.notif, IMAGE2, "unread")
+        self.change_icon(sum(self.nb_unread.values()))
+
+    def process_event(self, event):
+        """Handle the events posted by the mailbox workers or by the asyncio engine."""
+        kind, box, value = event
+        if kind == 'network':
+            self.network_changed(value)
+            return
+        if box not in self.info_conn:
+            # the mailbox was deactivated in the meantime
+            return
+        if kind == 'connected':
+            self.connection_done(box)
+        elif kind == 'unread':
+            if box in self.checking:
+                if not self.first_count:
+                    self.first_count = True
+                    logging.info("Time to first count: %.2f s",
+                                 time.monotonic() - self.start_time)
+                self.scheduler.checked(box, value > self.nb_unread.get(box, 0))
+                self.nb_unread[box] = value
+                # publish the counts without waiting for the other mailboxes
+                self.change_icon(sum(self.nb_unread.values()))
+                self.check_done(box)
             else:
-                self.notif = _("No unread mail")
-            nbtot = 0
-            for nb in self.nb_unread.values():
-                nbtot += nb
-            self.change_icon(nbtot)
+                # change pushed by the server (IDLE)
+                self.update_unread(box, value)
+        elif kind == 'login_error':
+            self.login_err_queue.put(box)
+            self.login_failed.add(box)
+            self.connection_done(box, False)
+        elif kind == 'unknown_server':
+            self.server_not_found(box)
+            self.connection_failed(box)
+        elif kind == 'connect_error':
+            self.connection_failed(box)
+        elif kind == 'folder_error':
+            # the connection is kept, the check is retried after a delay
+            self.check_failed(box, value, dropped=False)
+            self.connection_done(box, False)
+        elif kind == 'check_error':
+            self.check_failed(box, value)
+            self.check_done(box)
+        elif kind == 'check_refused':
+            self.check_failed(box, value, dropped=False)
+            self.check_done(box)
+        elif kind == 'timeout':
+            self.timed_out(box, True, True)
 
     def quit(self):
         """Logout from all the mailboxes and quit."""
-        for box in self.info_conn:
-            self.logout(box)
+        if self.engine is None:
+            for box in self.info_conn:
+                self.logout(box)
+        else:
+            self.engine.stop()
+        self.network.stop()
         try:
-            self.after_cancel(self.loop_id)
+            self.icon.detach()
             self.destroy()
         except (TclError, ValueError):
             # depending on the pending processes when the app is destroyed
@@ -605,10 +1068,8 @@ class CheckMails(Tk):
     def ask_password(self):
         """Ask the master password in order to decrypt the mailbox config files."""
         def ok(event=None):
-            with open(os.path.join(LOCAL_PATH, '.pwd')) as fich:
-                cryptedpwd = fich.read()
             pwd = getpwd.get()
-            if crypt.crypt(pwd, cryptedpwd) == cryptedpwd:
+            if check_password(pwd):
                 # passwords match
                 top.destroy()
                 logging.info('Authentication successful')
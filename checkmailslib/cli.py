@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016-2018 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Command line interface
+
+The modules are imported once the arguments are parsed so that the headless
+modes do not load the GUI.
+"""
+
+
+import argparse
+import logging
+import os
+import signal
+import sys
+
+# exit status
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+EXIT_PASSWORD = 3
+EXIT_NO_MAILBOX = 4
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="checkmails",
+                                     description="System tray unread mail checker.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="check the mailboxes without GUI and publish the counts to the sinks")
+    parser.add_argument("--check-once", action="store_true",
+                        help="check the active mailboxes once, print the counts and exit "
+                             "(status 1 if a check failed)")
+    parser.add_argument("--json", action="store_true",
+                        help="print the result of --check-once as json")
+    parser.add_argument("--jobs", type=int, default=4, metavar="N",
+                        help="number of mailboxes checked at the same time by "
+                             "--check-once (default: 4)")
+    parser.add_argument("--sink", action="append", default=[], metavar="SINK",
+                        help="output of the daemon: stdout, file:<path> or "
+                             "socket:<path> (default: stdout), can be repeated")
+    parser.add_argument("--password-file", metavar="FILE",
+                        help="read the master password from FILE")
+    parser.add_argument("--password-fd", type=int, metavar="FD",
+                        help="read the master password from the file descriptor FD")
+    args = parser.parse_args(argv)
+    if args.daemon and args.check_once:
+        parser.error("--daemon and --check-once are exclusive")
+    if args.json and not args.check_once:
+        parser.error("--json requires --check-once")
+    return parser, args
+
+
+def read_password(args):
+    """
+    Return the master password given by --password-fd, --password-file or
+    the CHECKMAILS_PASSWORD environment variable, None if there is none.
+    """
+    if args.password_fd is not None:
+        with os.fdopen(args.password_fd) as file:
+            return file.readline().rstrip("\n")
+    if args.password_file is not None:
+        with open(args.password_file) as file:
+            return file.readline().rstrip("\n")
+    return os.environ.get("CHECKMAILS_PASSWORD")
+
+
+def get_password(args):
+    """Return the master password, None if it is missing or wrong."""
+    from checkmailslib.settings import check_password
+
+    try:
+        pwd = read_password(args)
+    except OSError as e:
+        logging.error("Cannot read the password: %s", e)
+        return None
+    if pwd is None:
+        logging.error("No password given (CHECKMAILS_PASSWORD, --password-file or --password-fd)")
+        return None
+    try:
+        if check_password(pwd):
+            return pwd
+    except FileNotFoundError:
+        logging.error("No master password set")
+        return None
+    logging.error("Incorrect password")
+    return None
+
+
+def run_daemon(parser, args):
+    from checkmailslib.daemon import Daemon
+    from checkmailslib.sinks import make_sink
+
+    try:
+        sinks = [make_sink(spec) for spec in args.sink or ["stdout"]]
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+    pwd = get_password(args)
+    if pwd is None:
+        return EXIT_PASSWORD
+    # stop cleanly on SIGTERM
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(EXIT_OK))
+    try:
+        Daemon(pwd, sinks).run()
+    except KeyboardInterrupt:
+        pass
+    return EXIT_OK
+
+
+def run_check_once(args):
+    import json
+    import time
+    from checkmailslib.batch import check_once
+
+    pwd = get_password(args)
+    if pwd is None:
+        return EXIT_PASSWORD
+    start = time.monotonic()
+    results = check_once(pwd, args.jobs)
+    if results is None:
+        logging.error("No active mailbox")
+        return EXIT_NO_MAILBOX
+    ok = all(res["status"] == "ok" for res in results)
+    if args.json:
+        print(json.dumps({"status": "ok" if ok else "error",
+                          "total": sum(res["unread"] or 0 for res in results),
+                          "duration": round(time.monotonic() - start, 6),
+                          "mailboxes": results}, indent=2))
+    else:
+        for res in results:
+            if res["status"] == "ok":
+                print("%s: %i" % (res["mailbox"], res["unread"]))
+            else:
+                print("%s: %s" % (res["mailbox"], res["status"]))
+    return EXIT_OK if ok else EXIT_ERROR
+
+
+def run_gui():
+    from checkmailslib.check import CheckMails
+
+    app = CheckMails()
+    app.mainloop()
+    return EXIT_OK
+
+
+def main(argv=None):
+    parser, args = parse_args(argv)
+    try:
+        if args.daemon:
+            return run_daemon(parser, args)
+        if args.check_once:
+            return run_check_once(args)
+        return run_gui()
+    finally:
+        logging.shutdown()
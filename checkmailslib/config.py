@@ -21,14 +21,75 @@ Configuration dialog
 """
 from re import search
 from os.path import expanduser, join
-from os import listdir, remove
+from os import listdir
+from base64 import b64encode
+from io import BytesIO
+from threading import Thread, Condition
 from checkmailslib.constants import CONFIG, save_config, IMAGE, \
     TTF_FONTS, TOOLKITS, FONTSIZE, PhotoImage
-from PIL import Image, ImageDraw, ImageFont
-from tkinter import Toplevel, Menu, StringVar
+from PIL import Image
+from checkmailslib.badge import RENDERER
+from checkmailslib.events import EventQueue
+from tkinter import Toplevel, Menu, StringVar, PhotoImage as TkPhotoImage
 from tkinter.messagebox import showinfo
-from tkinter.ttk import Label, Button, Entry, Menubutton, Frame, Style, Combobox
-import tempfile
+from tkinter.ttk import Label, Button, Entry, Menubutton, Frame, Style, Combobox, \
+    Checkbutton
+
+
+# number of fonts before and after the selected one whose preview is prepared
+PREFETCH = 5
+# PNG data of the font previews {font name: data}, kept between dialogs
+PREVIEWS = {}
+
+
+def render_preview(font_name):
+    """Return the PNG data of the preview of the font font_name."""
+    im = RENDERER.draw("0", TTF_FONTS.path(font_name), FONTSIZE, IMAGE)
+    if im.size[0] > 48:
+        im = im.resize((48, 48), Image.LANCZOS)
+    buffer = BytesIO()
+    im.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class PreviewWorker(Thread):
+    """Render the font previews in the background, the most recent request first."""
+
+    def __init__(self, callback):
+        """callback: function called with (font name, PNG data) from the worker thread."""
+        Thread.__init__(self, name='font_preview', daemon=True)
+        self.callback = callback
+        self._fonts = []
+        self._cond = Condition()
+        self._stopped = False
+
+    def request(self, fonts):
+        """Render the previews of fonts in this order, the previous requests are dropped."""
+        with self._cond:
+            self._fonts = [f for f in fonts if f not in PREVIEWS]
+            self._cond.notify()
+
+    def stop(self):
+        """Stop the worker, callback is no longer called once this returns."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._fonts and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                font = self._fonts.pop(0)
+            if font not in PREVIEWS:
+                PREVIEWS[font] = render_preview(font)
+            with self._cond:
+                # the dialog may have been closed during the rendering
+                if self._stopped:
+                    return
+                self.callback((font, PREVIEWS[font]))
 
 
 class Config(Toplevel):
@@ -37,6 +98,8 @@ class Config(Toplevel):
     def __init__(self, master):
         Toplevel.__init__(self, master, class_="CheckMails")
         self.title(_("Preferences"))
+        # True once the settings are saved
+        self.saved = False
 
         style = Style(self)
         style.map("TCombobox",
@@ -69,8 +132,17 @@ class Config(Toplevel):
         Label(self, text="min").grid(row=0, column=2, padx=(0, 10), pady=(10, 4))
         Label(self, text="min").grid(row=1, column=2, padx=(0, 10), pady=4)
 
+        # --- IDLE
+        self.idle = Checkbutton(self,
+                                text=_("Use push notifications (IMAP IDLE) when the server supports them"))
+        if CONFIG.getboolean("General", "idle"):
+            self.idle.state(("selected", ))
+        else:
+            self.idle.state(("!selected", ))
+        self.idle.grid(row=2, columnspan=3, padx=10, pady=4, sticky="w")
+
         frame = Frame(self)
-        frame.grid(row=2, columnspan=3, padx=6, pady=(0, 6))
+        frame.grid(row=3, columnspan=3, padx=6, pady=(0, 6))
 
         # --- Language
         Label(frame, text=_("Language")).grid(row=0, column=0,
@@ -102,12 +174,13 @@ class Config(Toplevel):
                                          variable=self.gui,
                                          command=self.change_gui)
         # --- Font
-        self.preview_path = tempfile.mktemp(".png", "checkmails_preview")
-        w = max([len(f) for f in TTF_FONTS])
         self.fonts = sorted(TTF_FONTS)
-        self.font = Combobox(frame, values=self.fonts, width=(w * 2) // 3,
+        # fixed width: measuring all the font names is slow with large font sets
+        self.font = Combobox(frame, values=self.fonts, width=30,
                              exportselection=False, state="readonly")
         current_font = CONFIG.get("General", "font")
+        if current_font not in TTF_FONTS:
+            current_font = TTF_FONTS.default()
         if current_font in self.fonts:
             i = self.fonts.index(current_font)
         else:
@@ -119,41 +192,47 @@ class Config(Toplevel):
         self.font.grid(row=2, column=1, padx=8, pady=4, sticky="w")
         self.prev = Label(frame, image=self.img_prev)
         self.prev.grid(row=2, column=2, padx=8, pady=4)
+        # the previews are rendered in the background
+        self.previews = EventQueue(self, self.show_preview)
+        self.preview_worker = PreviewWorker(self.previews.put)
+        self.preview_worker.start()
         self.update_preview()
         self.font.bind('<<ComboboxSelected>>', self.update_preview)
         self.font.bind_class("ComboboxListbox", '<KeyPress>', self.key_nav)
 
         # --- Ok/Cancel
         frame_button = Frame(self)
-        frame_button.grid(row=3, columnspan=3, padx=6, pady=(0, 6))
+        frame_button.grid(row=4, columnspan=3, padx=6, pady=(0, 6))
         Button(frame_button, text="Ok",
                command=self.ok).grid(row=2, column=0, padx=8, pady=4)
         Button(frame_button, text=_("Cancel"),
                command=self.destroy).grid(row=2, column=1, padx=4, pady=4)
 
     def update_preview(self, event=None):
+        """Display the preview of the selected font and prepare the neighbouring ones."""
         self.font.selection_clear()
-        nb = "0"
-        im = Image.open(IMAGE)
-        draw = ImageDraw.Draw(im)
-        font_name = self.font.get()
-        font_path = TTF_FONTS[font_name]
-        W, H = im.size
-        try:
-            font = ImageFont.truetype(font_path, FONTSIZE)
-            w, h = draw.textsize(nb, font=font)
-            draw.text(((W - w) / 2, (H - h) / 2), nb, fill=(255, 0, 0),
-                      font=font)
-        except OSError:
-            w, h = draw.textsize(nb)
-            draw.text(((W - w) / 2, (H - h) / 2), nb, fill=(255, 0, 0))
-        if W > 48:
-            im.resize((48, 48), Image.ANTIALIAS).save(self.preview_path)
+        font = self.font.get()
+        if font in PREVIEWS:
+            self.show_preview((font, PREVIEWS[font]))
+        i = self.font.current()
+        fonts = [font]
+        for k in range(1, PREFETCH + 1):
+            fonts.extend(self.fonts[j] for j in (i + k, i - k)
+                         if 0 <= j < len(self.fonts))
+        self.preview_worker.request(fonts)
+
+    def show_preview(self, preview):
+        """Display the preview (font name, PNG data) if the font is still selected."""
+        font, data = preview
+        if font != self.font.get():
+            return
+        if isinstance(self.img_prev, TkPhotoImage):
+            self.img_prev.configure(data=b64encode(data))
         else:
-            im.save(self.preview_path)
-        self.img_prev.configure(file=self.preview_path)
+            # ImageTk.PhotoImage (Tk < 8.6 cannot read PNG data)
+            from PIL import ImageTk
+            self.img_prev = ImageTk.PhotoImage(Image.open(BytesIO(data)), master=self)
         self.prev.configure(image=self.img_prev)
-        self.prev.update_idletasks()
 
     def key_nav(self, event):
         char = event.char.upper()
@@ -173,10 +252,12 @@ class Config(Toplevel):
         timeout = float(self.timeout_entry.get()) * 60000
         CONFIG.set("General", "time", "%i" % time)
         CONFIG.set("General", "timeout", "%i" % timeout)
+        CONFIG.set("General", "idle", str("selected" in self.idle.state()))
         CONFIG.set("General", "language", self.lang.get().lower()[:2])
         CONFIG.set("General", "font", self.font.get())
         CONFIG.set("General", "trayicon", self.gui.get().lower())
         save_config()
+        self.saved = True
         self.destroy()
 
     def translate(self):
@@ -199,5 +280,8 @@ class Config(Toplevel):
         return b
 
     def destroy(self):
-        remove(self.preview_path)
+        # no preview can be posted once the worker is stopped, so the queue
+        # can be closed without waiting for the rendering in progress
+        self.preview_worker.stop()
+        self.previews.close()
         Toplevel.destroy(self)
@@ -37,139 +37,26 @@ Constants
 """
 
 
-from re import search
-import hashlib
-from Crypto.Cipher import AES
-from Crypto import Random
 import os
-from configparser import ConfigParser
-from locale import getdefaultlocale
-import gettext
-from subprocess import check_output, CalledProcessError
-import logging
-from logging.handlers import TimedRotatingFileHandler
 import warnings
 from tkinter import TclVersion
 from tkinter.messagebox import showwarning
-
-# --- paths
-PATH = os.path.dirname(__file__)
-
-if os.access(PATH, os.W_OK) and os.path.exists(os.path.join(PATH, "images")):
-    # the app is not installed
-    # local directory containing config files
-    LOCAL_PATH = os.path.join(PATH, "config")
-    PATH_LOCALE = os.path.join(PATH, "locale")
-    PATH_IMAGES = os.path.join(PATH, "images")
-else:
-    # local directory containing config files
-    LOCAL_PATH = os.path.join(os.path.expanduser("~"), ".checkmails")
-    PATH_LOCALE = "/usr/share/locale"
-    PATH_IMAGES = "/usr/share/checkmails/images"
-
-if not os.path.isdir(LOCAL_PATH):
-    os.mkdir(LOCAL_PATH)
-PATH_CONFIG = os.path.join(LOCAL_PATH, "checkmails.ini")
-LOG_PATH = os.path.join(LOCAL_PATH, "checkmails.log")
-
-
-# --- log
-handler = TimedRotatingFileHandler(LOG_PATH, when='midnight',
-                                   interval=1, backupCount=7)
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)-15s %(levelname)s: %(message)s',
-                    handlers=[handler])
-logging.getLogger().addHandler(logging.StreamHandler())
-
+from checkmailslib.settings import PATH, LOCAL_PATH, PATH_LOCALE, PATH_IMAGES, \
+    PATH_CONFIG, LOG_PATH, CONFIG, LANGUE, APP_NAME, LANG, save_config, \
+    encrypt, check_password, time_bounds
+from checkmailslib.settings import decrypt as _decrypt
+from checkmailslib.fonts import FontIndex, font_dirs
+from checkmailslib.toolkits import get_available_gui_toolkits
 
 # --- ttf fonts
-local_path = os.path.join(os.path.expanduser("~"), ".fonts")
-try:
-    local_fonts = os.listdir(local_path)
-except FileNotFoundError:
-    local_fonts = []
-TTF_FONTS = {f.split(".")[0]: os.path.join(local_path, f)
-             for f in local_fonts if search(r".(ttf|TTF)$", f)}
-for root, dirs, files in os.walk("/usr/share/fonts"):
-    for f in files:
-        if search(r".(ttf|TTF)$", f):
-            TTF_FONTS[f.split(".")[0]] = os.path.join(root, f)
-if "LiberationSans-Bold" in TTF_FONTS:
-    default_font = "LiberationSans-Bold"
-elif TTF_FONTS:
-    default_font = list(TTF_FONTS.keys())[0]
-else:
-    default_font = ""
-
-
-# --- read config file
-CONFIG = ConfigParser()
-if os.path.exists(PATH_CONFIG):
-    CONFIG.read(PATH_CONFIG)
-    LANGUE = CONFIG.get("General", "language")
-    if not CONFIG.has_option("General", "font"):
-        CONFIG.set("General", "font", default_font)
-    elif CONFIG.get("General", "font") not in TTF_FONTS:
-        CONFIG.set("General", "font", default_font)
-    if not CONFIG.has_option("General", "check_update"):
-        CONFIG.set("General", "check_update", "True")
-    if not CONFIG.has_option("General", "trayicon"):
-        CONFIG.set("General", "trayicon", "")
-else:
-    LANGUE = ""
-    CONFIG.add_section("General")
-    CONFIG.add_section("Mailboxes")
-    # time in ms between to checks
-    CONFIG.set("General", "time", "300000")
-    CONFIG.set("General", "timeout", "60000")
-    CONFIG.set("General", "font", default_font)
-    CONFIG.set("General", "check_update", "True")
-    CONFIG.set("Mailboxes", "active", "")
-    CONFIG.set("Mailboxes", "inactive", "")
-    CONFIG.set("General", "trayicon", "")
-
-
-def save_config():
-    """Save configuration to config file."""
-    with open(PATH_CONFIG, 'w') as fichier:
-        CONFIG.write(fichier)
+# the font directories are only scanned when a font is needed and when they
+# changed since the last scan
+TTF_FONTS = FontIndex(os.path.join(LOCAL_PATH, "fonts.json"), font_dirs())
 
 
 # --- system tray icon
-def get_available_gui_toolkits():
-    """Check which gui toolkits are available to create a system tray icon."""
-    toolkits = {'gtk': True, 'qt': True, 'tk': True}
-    b = False
-    try:
-        import gi
-        b = True
-    except ImportError:
-        toolkits['gtk'] = False
-
-    try:
-        import PyQt5
-        b = True
-    except ImportError:
-        try:
-            import PyQt4
-            b = True
-        except ImportError:
-            try:
-                import PySide
-                b = True
-            except ImportError:
-                toolkits['qt'] = False
-
-    tcl_packages = check_output(["tclsh",
-                                 os.path.join(PATH, "packages.tcl")]).decode().strip().split()
-    toolkits['tk'] = "tktray" in tcl_packages
-    b = b or toolkits['tk']
-    if not b:
-        raise ImportError("No GUI toolkits available to create the system tray icon.")
-    return toolkits
-
-
-TOOLKITS = get_available_gui_toolkits()
+# the toolkits are not imported, only the chosen one is imported by trayicon
+TOOLKITS = get_available_gui_toolkits(os.path.join(LOCAL_PATH, "toolkits.json"))
 GUI = CONFIG.get("General", "trayicon").lower()
 
 if not TOOLKITS.get(GUI):
@@ -190,68 +77,10 @@ if not TOOLKITS.get(GUI):
     CONFIG.set("General", "trayicon", GUI)
 
 
-# --- Translation
-APP_NAME = "checkmails"
-
-if LANGUE not in ["en", "fr"]:
-    # Check the default locale
-    lc = getdefaultlocale()[0][:2]
-    if lc == "fr":
-        # If we have a default, it's the first in the list
-        LANGUE = "fr_FR"
-    else:
-        LANGUE = "en_US"
-    CONFIG.set("General", "language", LANGUE[:2])
-
-gettext.find(APP_NAME, PATH_LOCALE)
-gettext.bind_textdomain_codeset(APP_NAME, "UTF-8")
-gettext.bindtextdomain(APP_NAME, PATH_LOCALE)
-gettext.textdomain(APP_NAME)
-LANG = gettext.translation(APP_NAME, PATH_LOCALE,
-                           languages=[LANGUE], fallback=True)
-LANG.install()
-
-
-# --- Cryptographic functions to safely store login information
 def decrypt(mailbox, pwd):
     """Returns the login and password for the mailbox that where encrypted using pwd."""
-    key = hashlib.sha256(pwd.encode()).digest()
-    try:
-        with open(os.path.join(LOCAL_PATH, mailbox), 'rb') as fich:
-            iv = fich.read(AES.block_size)
-            cipher = AES.new(key, AES.MODE_CFB, iv)
-            server, login, password, folder = cipher.decrypt(fich.read()).decode().split("\n")
-    except FileNotFoundError:
-        showwarning(_("Warning"), _("Unknown mailbox %(name)r will be removed from configuration file.") % {'name': mailbox})
-        active = CONFIG.get("Mailboxes", "active").split(", ")
-        inactive = CONFIG.get("Mailboxes", "inactive").split(", ")
-        while "" in active:
-            active.remove("")
-        while "" in inactive:
-            inactive.remove("")
-        if mailbox in active:
-            active.remove(mailbox)
-        if mailbox in inactive:
-            inactive.remove(mailbox)
-        CONFIG.set("Mailboxes", "active", ", ".join(active))
-        CONFIG.set("Mailboxes", "inactive", ", ".join(inactive))
-        save_config()
-        return None, None, None, None
-    return server, login, password, folder
-
-
-def encrypt(mailbox, pwd, server, login, password, folder):
-    """Encrypt the mailbox connection information using pwd."""
-    key = hashlib.sha256(pwd.encode()).digest()
-    iv = Random.new().read(AES.block_size)
-    cipher = AES.new(key, AES.MODE_CFB, iv)
-    info = [server, login, password, folder]
-    with open(os.path.join(LOCAL_PATH, mailbox), 'wb') as fich:
-        fich.write(iv)
-        try:
-            fich.write(cipher.encrypt("\n".join(info)))
-        except TypeError:
-            fich.write(cipher.encrypt("\n".join(info).encode()))
+    return _decrypt(mailbox, pwd,
+                    lambda msg: showwarning(_("Warning"), msg))
 
 
 # --- Images
@@ -271,15 +100,6 @@ IM_ERROR = os.path.join(PATH_IMAGES, "error.png")
 IM_QUESTION = os.path.join(PATH_IMAGES, "question.png")
 
 
-def internet_on():
-    """Check the Internet connexion."""
-    try:
-        check_output(["ping", "-c", "1", "www.google.com"])
-        return True
-    except CalledProcessError:
-        return False
-
-
 # --- compatibility
 if TclVersion < 8.6:
     # then tkinter cannot import PNG files directly, we need to use PIL
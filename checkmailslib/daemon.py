@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016-2018 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Headless daemon
+
+The mailboxes are handled by the asyncio engine and the events are processed
+in a plain loop waiting on a queue, so neither Tk nor a display is needed.
+The counts are published to sinks (see sinks.py) each time they change.
+"""
+
+
+import logging
+from queue import Queue, Empty
+
+from checkmailslib.settings import CONFIG, decrypt, time_bounds
+from checkmailslib.scheduler import Scheduler
+from checkmailslib.aioengine import AsyncEngine
+
+
+class Daemon:
+    """Check the configured mailboxes and publish the counts to sinks."""
+
+    def __init__(self, pwd, sinks):
+        """
+        pwd: master password
+        sinks: list of Sink
+        """
+        self.sinks = sinks
+        self.timeout = CONFIG.getint("General", "timeout") / 1000
+        self.events = Queue()
+        self.engine = AsyncEngine(self.events.put, self.timeout,
+                                  CONFIG.getboolean("General", "idle"),
+                                  CONFIG.getint("General", "keepalive") / 1000)
+        self.scheduler = Scheduler(CONFIG.getint("General", "time") / 1000)
+        mailboxes = [box for box in CONFIG.get("Mailboxes", "active").split(", ") if box]
+        self.info_conn = {}
+        for box in mailboxes:
+            server, login, password, folder = decrypt(box, pwd)
+            if server is not None:
+                self.info_conn[box] = (server, (login, password), folder)
+        self.scheduler.update({box: time_bounds(box) for box in self.info_conn})
+        # number of unread mails of the checked mailboxes
+        self.nb_unread = {}
+        # state of the mailboxes
+        self.connected = set()
+        self.connecting = set()
+        self.checking = set()
+
+    def run(self):
+        """Check the mailboxes until interrupted (KeyboardInterrupt or SystemExit)."""
+        if not self.info_conn:
+            logging.error("No active mailbox")
+            return
+        logging.info("Starting checkmails daemon")
+        self.engine.start()
+        try:
+            for box in self.info_conn:
+                self.connect(box)
+            while True:
+                boxes = [box for box in self.info_conn
+                         if box not in self.connecting and box not in self.checking]
+                try:
+                    event = self.events.get(timeout=self.scheduler.next_check(boxes))
+                except Empty:
+                    self.check(self.scheduler.due(boxes))
+                else:
+                    self.process_event(event)
+        finally:
+            logging.info("Stopping checkmails daemon")
+            self.engine.stop()
+            # the logouts take at most timeout
+            self.engine.join(self.timeout + 1)
+            for sink in self.sinks:
+                sink.close()
+
+    def connect(self, box):
+        self.connecting.add(box)
+        self.engine.connect(box, *self.info_conn[box])
+
+    def check(self, boxes):
+        """Check boxes, the mailboxes that are not connected are connected first."""
+        for box in boxes:
+            if box in self.connected:
+                self.checking.add(box)
+                self.engine.check(box)
+            else:
+                self.connect(box)
+
+    def reconnect(self, box):
+        """Reconnect to box after a failure."""
+        self.connected.discard(box)
+        self.connecting.add(box)
+        self.engine.logout(box, reconnect=True)
+
+    def publish(self):
+        for sink in self.sinks:
+            sink.publish(dict(self.nb_unread))
+
+    def process_event(self, event):
+        """Handle the events posted by the engine."""
+        kind, box, value = event
+        if box not in self.info_conn:
+            # the login to the mailbox failed
+            return
+        if kind == 'connected':
+            self.connecting.discard(box)
+            self.connected.add(box)
+            # check right away, the next checks are scheduled
+            self.check([box])
+        elif kind == 'unread':
+            if box in self.checking:
+                self.checking.discard(box)
+                self.scheduler.checked(box, value > self.nb_unread.get(box, 0))
+            changed = self.nb_unread.get(box) != value
+            self.nb_unread[box] = value
+            if changed:
+                self.publish()
+        elif kind in ('login_error', 'unknown_server', 'connect_error'):
+            logging.error("%s: connection failed (%s)", box, kind)
+            self.connecting.discard(box)
+            self.connected.discard(box)
+            if kind == 'login_error':
+                # the login information is wrong, retrying will not help
+                self.engine.logout(box)
+                del self.info_conn[box]
+                self.scheduler.update({b: time_bounds(b) for b in self.info_conn})
+            else:
+                # a new connection is made when the check is due
+                self.scheduler.failed(box)
+                self.engine.logout(box)
+        elif kind == 'folder_error':
+            logging.error("%s: %s", box, value)
+            # the connection is kept, the folders are listed again when the
+            # check is due
+            self.connecting.discard(box)
+            self.connected.add(box)
+            self.scheduler.failed(box)
+        elif kind == 'check_refused':
+            logging.error("%s: %s", box, value)
+            self.checking.discard(box)
+            self.scheduler.failed(box)
+        elif kind in ('check_error', 'timeout'):
+            logging.error("%s: %s", box, value or 'timed out')
+            self.checking.discard(box)
+            self.connecting.discard(box)
+            self.scheduler.failed(box)
+            self.reconnect(box)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016-2018 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Queue of events handled in the tkinter mainloop
+"""
+
+
+import os
+from queue import Queue, Empty
+from tkinter import READABLE
+
+
+class EventQueue(Queue):
+    """
+    Queue whose items are passed to callback inside the tkinter mainloop.
+
+    Items can be put in the queue from any thread: a byte is written in a
+    pipe watched by tkinter so that the mainloop wakes up as soon as there is
+    something to process.
+    """
+
+    def __init__(self, master, callback):
+        Queue.__init__(self)
+        self.master = master
+        self.callback = callback
+        self._pipe_r, self._pipe_w = os.pipe()
+        os.set_blocking(self._pipe_r, False)
+        os.set_blocking(self._pipe_w, False)
+        self.master.tk.createfilehandler(self._pipe_r, READABLE, self._process)
+
+    def put(self, item, block=True, timeout=None):
+        Queue.put(self, item, block, timeout)
+        try:
+            os.write(self._pipe_w, b'\0')
+        except BlockingIOError:
+            # the pipe is full so the mainloop will wake up anyway
+            pass
+
+    def _process(self, fd, mask):
+        try:
+            while os.read(fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        while True:
+            try:
+                item = self.get_nowait()
+            except Empty:
+                return
+            self.callback(item)
+
+    def close(self):
+        """Stop watching the pipe and close it."""
+        self.master.tk.deletefilehandler(self._pipe_r)
+        os.close(self._pipe_r)
+        os.close(self._pipe_w)
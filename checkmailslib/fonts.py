@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016-2018 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Index of the available ttf fonts
+"""
+
+
+import os
+import json
+import logging
+from collections.abc import Mapping
+
+DEFAULT_FONT = "LiberationSans-Bold"
+
+
+def font_dirs():
+    """
+    Return the directories containing fonts, from the lowest to the highest
+    priority: the XDG data directories, then the user's ones.
+    """
+    home = os.path.expanduser("~")
+    data_dirs = os.environ.get("XDG_DATA_DIRS") or "/usr/local/share:/usr/share"
+    data_home = os.environ.get("XDG_DATA_HOME") or os.path.join(home, ".local", "share")
+    dirs = [os.path.join(d, "fonts") for d in reversed(data_dirs.split(":")) if d]
+    dirs.append(os.path.join(data_home, "fonts"))
+    dirs.append(os.path.join(home, ".fonts"))
+    # remove duplicates, keeping the highest priority
+    unique = []
+    for d in reversed(dirs):
+        if d not in unique:
+            unique.insert(0, d)
+    return unique
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class FontIndex(Mapping):
+    """
+    Dictionary {font name: path} of the ttf fonts found in dirs.
+
+    The index is built on first use and saved in cache_path. The cache is
+    valid as long as the modification time of the scanned directories does
+    not change (a directory's mtime changes when a file is added or removed
+    in it), so the font directories are only walked again when needed.
+    """
+
+    def __init__(self, cache_path, dirs):
+        self.cache_path = cache_path
+        self.dirs = list(dirs)
+        self._fonts = None
+
+    def _load_cache(self):
+        """Return the cached fonts, None if the cache is missing or outdated."""
+        try:
+            with open(self.cache_path) as file:
+                cache = json.load(file)
+            if cache["roots"] != self.dirs:
+                return None
+            for path, mtime in cache["mtimes"].items():
+                if _mtime(path) != mtime:
+                    return None
+            return cache["fonts"]
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return None
+
+    def _scan(self):
+        """Walk the font directories and save the result in the cache."""
+        fonts = {}
+        # the mtime of missing roots is recorded too (None) so that their
+        # creation invalidates the cache
+        mtimes = {}
+        for root_dir in self.dirs:
+            mtimes[root_dir] = _mtime(root_dir)
+            for root, dirs, files in os.walk(root_dir):
+                if root != root_dir:
+                    mtimes[root] = _mtime(root)
+                for f in files:
+                    if f.endswith((".ttf", ".TTF")):
+                        fonts[f.split(".")[0]] = os.path.join(root, f)
+        tmp = self.cache_path + ".tmp"
+        try:
+            with open(tmp, "w") as file:
+                json.dump({"roots": self.dirs, "mtimes": mtimes,
+                           "fonts": fonts}, file)
+            os.replace(tmp, self.cache_path)
+        except OSError as e:
+            logging.warning("Cannot save the font index: %s", e)
+        return fonts
+
+    @property
+    def fonts(self):
+        if self._fonts is None:
+            fonts = self._load_cache()
+            if fonts is None:
+                logging.info("Building the font index")
+                fonts = self._scan()
+            self._fonts = fonts
+        return self._fonts
+
+    def refresh(self):
+        """Forget the loaded index so that it is checked again on next use."""
+        self._fonts = None
+
+    def __getitem__(self, name):
+        return self.fonts[name]
+
+    def __iter__(self):
+        return iter(self.fonts)
+
+    def __len__(self):
+        return len(self.fonts)
+
+    def default(self):
+        """Return the name of the default font, '' if there is no font."""
+        if DEFAULT_FONT in self.fonts:
+            return DEFAULT_FONT
+        return next(iter(self.fonts), "")
+
+    def path(self, name):
+        """
+        Return the path of the font name or of the default font if name is
+        not available, '' if there is no font.
+        """
+        return self.fonts.get(name) or self.fonts.get(self.default(), "")
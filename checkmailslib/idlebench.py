@@ -0,0 +1,332 @@
+#! /usr/bin/python3
+# -*- coding:Utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+Idle cost benchmark of the system tray backends
+
+Usage: python3 -m checkmailslib.idlebench [--backends gtk,qt,tk] [--json]
+
+checkmails is started with each tray icon backend under a virtual X server
+(Xvfb) with mailboxes on a local fake IMAP server (see benchmark.py). Once
+the first count is received, the process (and its children, e.g. the tray
+icon helper) is observed during two windows:
+
+    idle   nothing happens on the server
+    load   the number of unread mails changes --rate times per second and
+           the changes are pushed to the idling connections
+
+For each window the following measures are reported:
+
+    wakeups  voluntary context switches per second of all the threads
+    cpu      CPU time over wall time (%)
+    rss      resident memory at the end of the window (MiB)
+    lag      delay of a Tk callback scheduled every second (median and
+             maximum, ms), this probe accounts for 1 wakeup/s
+
+The exit status is 2 if the benchmark could not run.
+"""
+
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from threading import Thread
+
+from checkmailslib.benchmark import FakeIMAPServer, write_config, PASSWORD
+from checkmailslib.toolkits import get_available_gui_toolkits
+
+BACKENDS = ('gtk', 'qt', 'tk')
+# interval (ms) of the Tk callback lag probe
+PROBE_INTERVAL = 1000
+# time (s) given to the program to settle after the first count
+SETTLE = 2
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def child():
+    """Start checkmails, print 'ready' once a count is received, then the callback lags."""
+    import checkmailslib.check as check
+    from checkmailslib.constants import CONFIG, encrypt
+
+    # one login per mailbox so that each one gets its own connection
+    for i, box in enumerate(CONFIG.get("Mailboxes", "active").split(", ")):
+        encrypt(box, PASSWORD, os.environ["CHECKMAILS_BENCHMARK_SERVER"],
+                "benchmark%i" % i, PASSWORD, "INBOX")
+
+    class CheckMails(check.CheckMails):
+        ready = False
+
+        def ask_password(self):
+            self.pwd = PASSWORD
+
+        def process_event(self, event):
+            check.CheckMails.process_event(self, event)
+            if event[0] == 'unread' and not self.ready:
+                self.ready = True
+                print("ready", flush=True)
+
+    app = CheckMails()
+
+    def probe(expected):
+        now = time.monotonic()
+        print("lag %f %f" % (now, now - expected), flush=True)
+        app.after(PROBE_INTERVAL, probe, now + PROBE_INTERVAL / 1000)
+
+    app.after(PROBE_INTERVAL, probe, time.monotonic() + PROBE_INTERVAL / 1000)
+    app.mainloop()
+
+
+def process_tree(pid):
+    """Return the list of pid and of its descendants."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as file:
+                # the command name can contain spaces
+                ppid = int(file.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree = [pid]
+    for p in tree:
+        tree.extend(children.get(p, []))
+    return tree
+
+
+def sample(pid):
+    """
+    Return the voluntary context switches, CPU time (s) and RSS (bytes) of
+    the process tree of pid.
+    """
+    switches, cpu, rss = 0, 0, 0
+    for p in process_tree(pid):
+        try:
+            with open('/proc/%i/stat' % p) as file:
+                fields = file.read().rsplit(')', 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+            rss += int(fields[21]) * PAGE_SIZE
+            for task in os.listdir('/proc/%i/task' % p):
+                with open('/proc/%i/task/%s/status' % (p, task)) as file:
+                    for line in file:
+                        if line.startswith('voluntary_ctxt_switches:'):
+                            switches += int(line.split()[1])
+        except (OSError, IndexError, ValueError):
+            # the process exited in the meantime
+            continue
+    return switches, cpu, rss
+
+
+def start_xvfb():
+    """Start Xvfb and return (process, display)."""
+    read, write = os.pipe()
+    try:
+        proc = subprocess.Popen(["Xvfb", "-displayfd", str(write), "-nolisten", "tcp",
+                                 "-screen", "0", "1024x768x24"],
+                                pass_fds=(write,), stderr=subprocess.DEVNULL)
+    finally:
+        os.close(write)
+    with os.fdopen(read) as file:
+        display = file.readline().strip()
+    if not display:
+        proc.kill()
+        raise RuntimeError("Xvfb did not start")
+    return proc, ":" + display
+
+
+class Run:
+    """checkmails running with one backend, its output is read in a thread."""
+
+    def __init__(self, local_path, port, display):
+        env = dict(os.environ, CHECKMAILS_LOCAL_PATH=local_path, DISPLAY=display,
+                   CHECKMAILS_BENCHMARK_SERVER="127.0.0.1:%i" % port)
+        self.proc = subprocess.Popen([sys.executable, "-m", "checkmailslib.idlebench",
+                                      "--child"], env=env, stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE)
+        self.ready = None
+        self.lags = []
+        Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in self.proc.stdout:
+            words = line.decode().split()
+            if words == ["ready"]:
+                self.ready = time.monotonic()
+            elif len(words) == 3 and words[0] == "lag":
+                self.lags.append((float(words[1]), float(words[2])))
+
+    def wait_ready(self, timeout):
+        end = time.monotonic() + timeout
+        while self.ready is None:
+            if self.proc.poll() is not None or time.monotonic() > end:
+                raise RuntimeError("checkmails did not report any count:\n%s"
+                                   % self.stop().strip())
+            time.sleep(0.1)
+
+    def measure(self, duration, action=None):
+        """Observe the process during duration seconds, calling action every 0.01 s if given."""
+        start = time.monotonic()
+        switches, cpu, rss = sample(self.proc.pid)
+        end = start + duration
+        while time.monotonic() < end:
+            if action is None:
+                time.sleep(end - time.monotonic())
+            else:
+                action()
+                time.sleep(0.01)
+        now = time.monotonic()
+        switches2, cpu2, rss = sample(self.proc.pid)
+        lags = [lag for t, lag in self.lags if start <= t <= now] or [0]
+        return {"wakeups": (switches2 - switches) / (now - start),
+                "cpu": 100 * (cpu2 - cpu) / (now - start),
+                "rss": rss / 2 ** 20,
+                "lag_median": 1000 * statistics.median(lags),
+                "lag_max": 1000 * max(lags)}
+
+    def stop(self):
+        """Stop checkmails and return its error output."""
+        self.proc.terminate()
+        try:
+            err = self.proc.communicate(timeout=5)[1]
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            err = self.proc.communicate()[1]
+        return err.decode(errors="replace")
+
+
+def bench_backend(backend, tmp, server, display, args):
+    local_path = os.path.join(tmp, backend + ("_process" if args.tray_process else ""))
+    os.mkdir(local_path)
+    write_config(local_path, args.mailboxes, args.engine, trayicon=backend,
+                 tray_process=str(args.tray_process))
+    server.set_unread(0)
+    run = Run(local_path, server.port, display)
+    try:
+        run.wait_ready(args.timeout)
+        time.sleep(SETTLE)
+        results = {"idle": run.measure(args.idle)}
+        period = 1 / args.rate
+        state = {"next": time.monotonic()}
+
+        def arrival():
+            if time.monotonic() >= state["next"]:
+                server.set_unread(server.nb_unread + 1)
+                state["next"] += period
+
+        results["load"] = run.measure(args.load, arrival)
+        if run.proc.poll() is not None:
+            raise RuntimeError("checkmails exited:\n%s" % run.stop().strip())
+    finally:
+        run.stop()
+    return results
+
+
+def print_report(results):
+    print("%-8s %-5s %10s %8s %9s %12s %12s" % ("backend", "", "wakeups/s", "cpu %",
+                                                 "rss MiB", "lag med ms", "lag max ms"))
+    for backend, res in results.items():
+        if res is None:
+            print("%-8s unavailable" % backend)
+            continue
+        for window in ("idle", "load"):
+            r = res[window]
+            print("%-8s %-5s %10.1f %8.2f %9.1f %12.2f %12.2f"
+                  % (backend, window, r["wakeups"], r["cpu"], r["rss"],
+                     r["lag_median"], r["lag_max"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python3 -m checkmailslib.idlebench",
+                                     description="Measure the cost of checkmails while idle "
+                                                 "and under mail arrival for each tray backend.")
+    parser.add_argument("--backends", default=",".join(BACKENDS),
+                        help="comma separated list of backends (default: %(default)s)")
+    parser.add_argument("--idle", type=float, default=30,
+                        help="duration of the idle window in s (default: 30)")
+    parser.add_argument("--load", type=float, default=30,
+                        help="duration of the load window in s (default: 30)")
+    parser.add_argument("--rate", type=float, default=5,
+                        help="changes of the unread count per second during the load "
+                             "window (default: 5)")
+    parser.add_argument("--mailboxes", type=int, default=2,
+                        help="number of mailboxes (default: 2)")
+    parser.add_argument("--engine", choices=["threads", "asyncio"], default="threads")
+    parser.add_argument("--tray-process", action="store_true",
+                        help="display the tray icon from the helper process")
+    parser.add_argument("--timeout", type=float, default=60,
+                        help="maximum time to the first count in s (default: 60)")
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child()
+        return 0
+    backends = [b for b in args.backends.split(",") if b]
+    unknown = set(backends) - set(BACKENDS)
+    if unknown:
+        parser.error("unknown backends: %s" % ", ".join(sorted(unknown)))
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="checkmails_idlebench") as tmp:
+        try:
+            toolkits = get_available_gui_toolkits(os.path.join(tmp, "toolkits.json"))
+        except ImportError as e:
+            print(e, file=sys.stderr)
+            return 2
+        try:
+            xvfb, display = start_xvfb()
+        except (OSError, RuntimeError) as e:
+            print("Cannot start Xvfb: %s" % e, file=sys.stderr)
+            return 2
+        try:
+            server = FakeIMAPServer(tmp)
+        except (OSError, subprocess.CalledProcessError) as e:
+            xvfb.kill()
+            print("Cannot start the fake IMAP server: %s" % e, file=sys.stderr)
+            return 2
+        try:
+            for backend in backends:
+                if not toolkits.get(backend):
+                    results[backend] = None
+                    continue
+                results[backend] = bench_backend(backend, tmp, server, display, args)
+        except (RuntimeError, OSError) as e:
+            print("Benchmark failed (%s): %s" % (backend, e), file=sys.stderr)
+            return 2
+        finally:
+            server.close()
+            xvfb.terminate()
+            xvfb.wait()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,590 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016-2018 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+IMAP helpers
+"""
+
+
+import logging
+import select
+import socket
+import ssl
+import time
+from contextlib import contextmanager
+from imaplib import IMAP4, IMAP4_SSL, IMAP4_SSL_PORT, _MAXLINE
+from threading import Lock, RLock
+
+# the IDLE command has to be re-issued at least every 29 minutes (RFC 2177)
+IDLE_TIMEOUT = 1500
+# extra time in s given to the server to answer when an IDLE command ends
+IDLE_GRACE = 60
+# untagged responses meaning that the content of the selected folder changed
+IDLE_CHANGES = (b'EXISTS', b'EXPUNGE', b'FETCH', b'RECENT')
+# maximum number of bytes received from the socket at once
+READ_SIZE = 16384
+
+
+class IMAPSession(IMAP4_SSL):
+    """
+    IMAP4_SSL connection that can be kept alive between checks.
+
+    The TLS session is saved so that the next connection to the same server
+    can resume it instead of doing a full handshake. The time of the last
+    command is recorded to send NOOP only when the connection has been
+    unused for too long.
+
+    The operations can be bounded in time with deadline(): each socket
+    operation gets the remaining time as timeout, so a server that stops
+    answering cannot block a thread forever.
+
+    The responses are read through a buffer of the session instead of a
+    file object so that wait() can tell whether a complete line was
+    already received.
+    """
+    # shared context: TLS sessions can only be resumed with the same context
+    _ssl_context = None
+    # last TLS session for each server: {(host, port): (context, session)}
+    _tls_sessions = {}
+
+    def __init__(self, host, info=None, **kwargs):
+        """
+        Open the connection to host ('server' or 'server:port').
+
+        info: connection information (server, (login, password)) used to
+              tell whether the session can be reused for a mailbox
+        timeout: maximum time in seconds for the connection, the TLS
+                 handshake and the greeting of the server
+        """
+        if IMAPSession._ssl_context is None:
+            # same default context as imaplib.IMAP4_SSL
+            IMAPSession._ssl_context = ssl._create_stdlib_context()
+        kwargs.setdefault('ssl_context', IMAPSession._ssl_context)
+        host, port = split_server(host)
+        kwargs.setdefault('port', port)
+        self.info = info
+        self.selected = None
+        # the session is used by one thread at a time
+        self.lock = RLock()
+        self.last_activity = time.monotonic()
+        timeout = kwargs.get('timeout')
+        self._deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            IMAP4_SSL.__init__(self, host, **kwargs)
+        finally:
+            self._deadline = None
+        self.sock.settimeout(None)
+        if getattr(self.sock, 'session_reused', False):
+            logging.info('TLS session resumed for %s' % host)
+
+    def _create_socket(self, *args):
+        sock = IMAP4._create_socket(self, *args)
+        context, session = IMAPSession._tls_sessions.get((self.host, self.port), (None, None))
+        if context is not self.ssl_context:
+            # a session can only be resumed with the context that created it
+            session = None
+        return self.ssl_context.wrap_socket(sock, server_hostname=self.host,
+                                            session=session)
+
+    @contextmanager
+    def deadline(self, timeout):
+        """
+        Raise TimeoutError if the operations done in the block take more
+        than timeout seconds. The connection is then closed since it is in
+        an unknown state.
+        """
+        self._deadline = time.monotonic() + timeout
+        try:
+            yield
+        except TimeoutError:
+            try:
+                self.shutdown()
+            except OSError:
+                pass
+            raise
+        finally:
+            self._deadline = None
+            try:
+                self.sock.settimeout(None)
+            except OSError:
+                pass
+
+    def _apply_deadline(self):
+        if self._deadline is not None:
+            remaining = self._deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError('IMAP operation timed out')
+            self.sock.settimeout(remaining)
+
+    def open(self, host='', port=IMAP4_SSL_PORT, timeout=None):
+        self._buffer = bytearray()
+        IMAP4_SSL.open(self, host, port, timeout)
+
+    def _recv(self):
+        """Receive data into the buffer, return False at the end of the stream."""
+        self._apply_deadline()
+        data = self.sock.recv(READ_SIZE)
+        self._buffer += data
+        return bool(data)
+
+    def read(self, size):
+        while len(self._buffer) < size and self._recv():
+            pass
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readline(self):
+        end = self._buffer.find(b'\n') + 1
+        while not end and len(self._buffer) <= _MAXLINE:
+            start = len(self._buffer)
+            if not self._recv():
+                end = len(self._buffer)
+                break
+            end = self._buffer.find(b'\n', start) + 1
+        if not end or end > _MAXLINE:
+            raise self.error("got more than %d bytes" % _MAXLINE)
+        line = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        return line
+
+    def wait(self, timeout, wakeup=None):
+        """
+        Wait for a line from the server.
+
+        Return True when a line can be read without blocking, False after
+        timeout seconds or as soon as the socket wakeup is readable.
+        """
+        end = time.monotonic() + timeout
+        sockets = [self.sock] if wakeup is None else [self.sock, wakeup]
+        while b'\n' not in self._buffer:
+            if not self.sock.pending():
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    return False
+                try:
+                    readable = select.select(sockets, [], [], remaining)[0]
+                except ValueError:
+                    # the socket was closed by shutdown()
+                    raise IMAP4.abort('socket error: connection closed')
+                if wakeup in readable or not readable:
+                    return False
+            self.sock.settimeout(0)
+            try:
+                data = self.sock.recv(READ_SIZE)
+            except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                # the TLS record did not contain data (e.g. session ticket)
+                continue
+            finally:
+                self.sock.settimeout(None)
+            if not data:
+                # the next read reports the end of the connection
+                return True
+            self._buffer += data
+        return True
+
+    def send(self, data):
+        self._apply_deadline()
+        return IMAP4_SSL.send(self, data)
+
+    def _command(self, name, *args):
+        self.last_activity = time.monotonic()
+        return IMAP4_SSL._command(self, name, *args)
+
+    def login(self, user, password):
+        res = IMAP4_SSL.login(self, user, password)
+        # with TLS 1.3 the session ticket is only received after the handshake
+        if self.sock.session is not None:
+            IMAPSession._tls_sessions[self.host, self.port] = (self.ssl_context,
+                                                               self.sock.session)
+        return res
+
+    def select(self, mailbox='INBOX', readonly=False):
+        typ, data = IMAP4_SSL.select(self, quote(mailbox), readonly)
+        if typ != 'OK':
+            raise IMAP4.error(data[-1].decode(errors='replace'))
+        self.selected = mailbox
+        return typ, data
+
+    def keepalive(self, interval, timeout):
+        """
+        Send NOOP if the connection has not been used for interval seconds.
+
+        Return False if the server dropped the connection or did not answer
+        within timeout seconds. Nothing is done if the session is being used
+        by another thread.
+        """
+        if not self.lock.acquire(blocking=False):
+            return True
+        try:
+            if time.monotonic() - self.last_activity >= interval:
+                with self.deadline(timeout):
+                    self.noop()
+            return True
+        except (IMAP4.abort, OSError):
+            return False
+        finally:
+            self.lock.release()
+
+    def alive(self, timeout):
+        """
+        Return True if the server still answers within timeout seconds.
+
+        The session cannot be used anymore if it timed out.
+        """
+        with self.lock:
+            try:
+                with self.deadline(timeout):
+                    self.noop()
+                return True
+            except (IMAP4.abort, OSError):
+                return False
+
+    def close_session(self, timeout):
+        """Logout, the connection is closed if the server does not answer within timeout seconds."""
+        try:
+            with self.deadline(timeout):
+                self.logout()
+        except (IMAP4.error, OSError):
+            # the connection is already lost
+            try:
+                self.shutdown()
+            except OSError:
+                pass
+
+
+class SessionRegistry:
+    """
+    Connections shared by the mailboxes with the same server and login.
+
+    The connection attempts for an account are serialized with lock(key) so
+    that the mailboxes connected at the same time end up sharing the same
+    session instead of opening one each.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._locks = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def key(info):
+        """Return the key of the connection information (server, (login, password), ...)."""
+        return info[0], info[1][0]
+
+    def lock(self, key):
+        """Return the lock of the connection attempts to the account key."""
+        with self._lock:
+            return self._locks.setdefault(key, Lock())
+
+    def get(self, key):
+        """Return the session of the account key, None if there is none."""
+        return self._sessions.get(key)
+
+    def add(self, key, session):
+        self._sessions[key] = session
+
+    def discard(self, session):
+        """Remove session from the registry."""
+        with self._lock:
+            for key, s in list(self._sessions.items()):
+                if s is session:
+                    del self._sessions[key]
+
+    def clear(self):
+        """Empty the registry and return the sessions it contained."""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        return sessions
+
+
+def is_dropped(error):
+    """Return True if error means that the server dropped the connection."""
+    return isinstance(error, (IMAP4.abort, OSError))
+
+
+def split_server(server):
+    """Return (host, port) from the server field of a mailbox, 'host[:port]'."""
+    host, sep, port = server.rpartition(':')
+    if sep and port.isdigit() and (':' not in host or host.endswith(']')):
+        return host.strip('[]'), int(port)
+    return server, IMAP4_SSL_PORT
+
+
+def split_folders(folders):
+    """
+    Return the list of the folders to check from the folder field of a
+    mailbox: names or LIST patterns (with * and % wildcards) separated by
+    commas.
+    """
+    return [f.strip() for f in folders.split(',') if f.strip()]
+
+
+def is_pattern(folder):
+    """Return True if folder contains wildcards."""
+    return '*' in folder or '%' in folder
+
+
+def quote(folder):
+    """Return folder as an IMAP quoted string."""
+    return '"%s"' % folder.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def response_lines(data):
+    """
+    Join the literals of the untagged response data returned by imaplib
+    to the rest of the response, like '{5}INBOX (UNSEEN 3)'.
+    """
+    lines = []
+    pending = b''
+    for d in data:
+        if d is None:
+            continue
+        if isinstance(d, tuple):
+            pending += d[0] + d[1]
+        else:
+            lines.append(pending + d)
+            pending = b''
+    return lines
+
+
+def parse_name(data):
+    """
+    Return the mailbox name (quoted string, literal or atom) at the
+    beginning of data and the rest of data.
+    """
+    data = data.lstrip()
+    if data.startswith(b'"'):
+        name = bytearray()
+        i = 1
+        while i < len(data) and data[i:i + 1] != b'"':
+            if data[i:i + 1] == b'\\':
+                i += 1
+            name += data[i:i + 1]
+            i += 1
+        return bytes(name).decode(errors='replace'), data[i + 1:]
+    if data.startswith(b'{') and b'}' in data:
+        end = data.index(b'}')
+        size = int(data[1:end])
+        return data[end + 1:end + 1 + size].decode(errors='replace'), data[end + 1 + size:]
+    name, *rest = data.split(b' ', 1)
+    return name.decode(errors='replace'), b' '.join(rest)
+
+
+def parse_status(data):
+    """
+    Return the folder and the dictionary {item: value} from the data of a
+    STATUS response, like '"INBOX" (UNSEEN 3)'.
+    """
+    folder, rest = parse_name(data)
+    words = rest.strip().strip(b'()').upper().split()
+    try:
+        return folder, {words[i]: int(words[i + 1]) for i in range(0, len(words), 2)}
+    except (ValueError, IndexError):
+        raise IMAP4.error('Invalid STATUS response: %s' % data.decode(errors='replace'))
+
+
+def parse_list(data):
+    """
+    Return the flags and the name of the folder from the data of a LIST
+    response, like '(\\HasNoChildren) "/" "INBOX/Lists"'.
+    """
+    end = data.index(b')')
+    flags = data[1:end].upper().split()
+    delimiter, rest = parse_name(data[end + 1:])
+    return flags, parse_name(rest)[0]
+
+
+def parse_esearch_count(data):
+    """Return the COUNT in the data of an ESEARCH response (0 if there is none)."""
+    words = data[data.rfind(b')') + 1:].upper().split()
+    if b'COUNT' in words:
+        return int(words[words.index(b'COUNT') + 1])
+    return 0
+
+
+def is_selectable(flags):
+    """Return True if the folder with the LIST flags can be checked."""
+    return not (b'\\NOSELECT' in flags or b'\\NONEXISTENT' in flags)
+
+
+def list_folders(mail, folders):
+    """
+    Return the list of the folders to check from the folder field of a
+    mailbox, the patterns are expanded with LIST.
+    """
+    names = []
+    for folder in split_folders(folders):
+        if not is_pattern(folder):
+            if folder not in names:
+                names.append(folder)
+            continue
+        typ, data = mail.list('""', quote(folder))
+        if typ != 'OK':
+            raise IMAP4.error(data[-1].decode(errors='replace'))
+        found = False
+        for line in response_lines(data):
+            flags, name = parse_list(line)
+            if is_selectable(flags):
+                found = True
+                if name not in names:
+                    names.append(name)
+        if not found:
+            logging.warning('No folder matching %r' % folder)
+    return names
+
+
+def count_unseen(mail, folders):
+    """
+    Return the number of unread mails in each folder as a dictionary.
+
+    Only the numbers are transferred when possible: pipelined STATUS (UNSEEN)
+    commands for the folders that are not selected, SEARCH RETURN (COUNT)
+    (RFC 4731) for the selected one if the server supports ESEARCH.
+    Otherwise the list of the unread messages of the selected folder is
+    retrieved.
+    """
+    counts = {}
+    selected = mail.selected if mail.state == 'SELECTED' else None
+    others = [folder for folder in folders if folder != selected]
+    # send all the STATUS commands before reading the responses
+    tags = [mail._command('STATUS', quote(folder), '(UNSEEN)') for folder in others]
+    errors = []
+    for tag in tags:
+        typ, data = mail._command_complete('STATUS', tag)
+        if typ != 'OK':
+            errors.append(data[-1].decode(errors='replace'))
+    typ, data = mail._untagged_response('OK', [None], 'STATUS')
+    for line in response_lines(data):
+        folder, items = parse_status(line)
+        counts[folder] = items.get(b'UNSEEN', 0)
+    if errors:
+        raise IMAP4.error(', '.join(errors))
+    if selected is None or selected not in folders:
+        return counts
+    if 'ESEARCH' in mail.capabilities:
+        typ, data = mail._simple_command('SEARCH', 'RETURN', '(COUNT)', 'UNSEEN')
+        typ, data = mail._untagged_response(typ, data, 'ESEARCH')
+        if typ != 'OK':
+            raise IMAP4.error(str(data[-1]))
+        counts[selected] = sum(parse_esearch_count(d) for d in data if d is not None)
+    else:
+        r, messages = mail.search(None, '(UNSEEN)')
+        counts[selected] = len(messages[0].split())
+    return counts
+
+
+class Idler:
+    """
+    Wait for the server to push the changes of the selected folder (RFC 2177).
+
+    All the socket operations are done by the thread running idle(), the
+    other threads only set a flag and write to a wakeup socket in done().
+    """
+
+    def __init__(self, mail):
+        self.mail = mail
+        self.stopped = False
+        self._done = False  # DONE was requested for the current IDLE command
+        self._wakeup, self._waker = socket.socketpair()
+        self._wakeup.setblocking(False)
+        self._waker.setblocking(False)
+
+    @staticmethod
+    def supported(mail):
+        """Return True if the server of mail supports the IDLE command."""
+        return 'IDLE' in mail.capabilities
+
+    def idle(self, timeout=IDLE_TIMEOUT):
+        """
+        Send the IDLE command and block until it is terminated, either
+        because the server reported a change in the selected folder, because
+        done() or stop() was called or after timeout seconds.
+
+        Return True if the content of the folder changed.
+        """
+        with self.mail.lock, self.mail.deadline(timeout + IDLE_GRACE):
+            return self._idle(timeout)
+
+    def _idle(self, timeout):
+        mail = self.mail
+        self._drain()
+        self._done = self.stopped
+        tag = mail._new_tag()
+        mail.send(tag + b' IDLE\r\n')
+        line = mail._get_line()
+        if not line.startswith(b'+'):
+            raise IMAP4.error('IDLE command error: %s' % line.decode(errors='replace'))
+        end = time.monotonic() + timeout
+        changed = False
+        done_sent = False
+        if self._done:
+            # stopped before the server accepted the command
+            mail.send(b'DONE\r\n')
+            done_sent = True
+        while True:
+            if done_sent or mail.wait(end - time.monotonic(), self._wakeup):
+                line = mail._get_line()
+                if line.startswith(tag):
+                    if line.split()[1] != b'OK':
+                        raise IMAP4.error('IDLE command error: %s' % line.decode(errors='replace'))
+                    break
+                words = line.split()
+                if words[:2] == [b'*', b'BYE']:
+                    raise IMAP4.abort(line.decode(errors='replace'))
+                if len(words) > 2 and words[2].upper() in IDLE_CHANGES:
+                    changed = True
+                    if not done_sent:
+                        mail.send(b'DONE\r\n')
+                        done_sent = True
+            else:
+                # drain before reading the flag so that a call to done()
+                # made in between still wakes the next wait up
+                self._drain()
+                if self._done or time.monotonic() >= end:
+                    mail.send(b'DONE\r\n')
+                    done_sent = True
+        return changed
+
+    def _drain(self):
+        try:
+            while self._wakeup.recv(64):
+                pass
+        except OSError:
+            # nothing left to read
+            pass
+
+    def done(self):
+        """Terminate the current IDLE command (can be called from any thread)."""
+        self._done = True
+        try:
+            self._waker.send(b'\0')
+        except OSError:
+            # the idler is closed or already woken up
+            pass
+
+    def stop(self):
+        """Terminate the current IDLE command and do not start a new one."""
+        self.stopped = True
+        self.done()
+
+    def close(self):
+        """Release the wakeup sockets, the idler cannot be used anymore."""
+        self._wakeup.close()
+        self._waker.close()
@@ -0,0 +1,230 @@
+#! /usr/bin/python3
+# -*- coding:Utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+Connectivity monitor
+
+The network state is derived from the routing table (a default route is
+needed to reach the servers) and from a TCP connection to one of the IMAP
+servers. It is evaluated again when the kernel reports a change of the
+links, addresses or routes through a netlink socket, so that the transitions
+are published as soon as they happen without polling nor spawning processes.
+Without netlink (e.g. not Linux), the state is evaluated every
+FALLBACK_INTERVAL seconds.
+"""
+
+
+import logging
+import os
+import socket
+import time
+from select import select
+from threading import Thread, Lock
+
+# maximum time in s to connect to a server
+PROBE_TIMEOUT = 3
+# time in s during which the result of a probe is reused
+PROBE_TTL = 10
+# time in s between two probes when there is a default route but no server
+# can be reached (e.g. the network is up but not the Internet access)
+RETRY_INTERVAL = 30
+# time in s between two evaluations without netlink
+FALLBACK_INTERVAL = 60
+# time in s to wait for the end of a burst of netlink messages
+DEBOUNCE = 0.5
+# netlink multicast groups: links, IPv4 addresses and routes, IPv6 addresses
+# and routes
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+RTMGRP_IPV6_ROUTE = 0x400
+
+
+def has_default_route():
+    """Return True if there is an IPv4 or IPv6 default route."""
+    try:
+        with open('/proc/net/route') as file:
+            next(file)  # header
+            for line in file:
+                fields = line.split()
+                # destination 0.0.0.0, flag RTF_UP
+                if fields[1] == '00000000' and int(fields[3], 16) & 1:
+                    return True
+    except (OSError, StopIteration, IndexError, ValueError):
+        pass
+    try:
+        with open('/proc/net/ipv6_route') as file:
+            for line in file:
+                fields = line.split()
+                # destination ::/0, not the loopback interface
+                if fields[0] == '0' * 32 and fields[1] == '00' and fields[9] != 'lo':
+                    return True
+    except (OSError, IndexError):
+        pass
+    if not os.path.exists('/proc/net/route'):
+        # the routing table is not available, rely on the probe
+        return True
+    return False
+
+
+def probe(hosts, timeout=PROBE_TIMEOUT):
+    """Return True if a TCP connection can be made to one of hosts [(host, port)]."""
+    for host, port in hosts:
+        try:
+            socket.create_connection((host, port), timeout).close()
+            return True
+        except OSError:
+            continue
+    return False
+
+
+def netlink_socket():
+    """Return a socket receiving the changes of the network configuration, None if unavailable."""
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+    except (AttributeError, OSError):
+        return None
+    try:
+        sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE
+                   | RTMGRP_IPV6_IFADDR | RTMGRP_IPV6_ROUTE))
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+class ConnectivityMonitor(Thread):
+    """
+    Follow the network state in a thread and call callback(online) from this
+    thread at each transition and after each recheck() request.
+    """
+
+    def __init__(self, callback, hosts=()):
+        """
+        callback: function called with the new state
+        hosts: servers [(host, port)] used to check the Internet access
+        """
+        Thread.__init__(self, name='connectivity', daemon=True)
+        self.callback = callback
+        self._hosts = list(hosts)
+        self._lock = Lock()
+        # state and time of the last evaluation
+        self._online = None
+        self._time = 0
+        # number of evaluations made, i.e. of probes of the servers
+        self.evaluations = 0
+        # recheck() was called since the last evaluation
+        self._requested = False
+        # the requested evaluation must probe the servers again
+        self._fresh = False
+        self._stopped = False
+        self._pipe_r, self._pipe_w = os.pipe()
+        os.set_blocking(self._pipe_w, False)
+        self._netlink = netlink_socket()
+        if self._netlink is None:
+            logging.warning("Netlink is not available, the network is checked every %i s",
+                            FALLBACK_INTERVAL)
+
+    def set_hosts(self, hosts):
+        with self._lock:
+            self._hosts = list(hosts)
+
+    def online(self):
+        """Return the last known network state, True before the first evaluation."""
+        with self._lock:
+            return self._online is not False
+
+    def recheck(self, fresh=False):
+        """
+        Evaluate the network state again and pass it to the callback, the
+        result is reused if it is less than PROBE_TTL seconds old unless
+        fresh is True (can be called from any thread).
+        """
+        with self._lock:
+            self._requested = True
+            self._fresh = self._fresh or fresh
+        try:
+            os.write(self._pipe_w, b'\0')
+        except BlockingIOError:
+            # already requested
+            pass
+
+    def stop(self):
+        self._stopped = True
+        self.recheck()
+
+    def _evaluate(self):
+        with self._lock:
+            hosts = list(self._hosts)
+            self._fresh = False
+        online = has_default_route() and (not hosts or probe(hosts))
+        with self._lock:
+            changed = self._online is not None and online != self._online
+            self._online = online
+            self._time = time.monotonic()
+            self.evaluations += 1
+        if changed:
+            logging.info("Network %s", "online" if online else "offline")
+        self._publish(online, changed)
+
+    def _publish(self, online, changed):
+        """Call the callback if the state changed or if it was requested."""
+        with self._lock:
+            requested = self._requested
+            self._requested = False
+        if changed or requested:
+            self.callback(online)
+
+    def _drain(self, sock):
+        """Read the pending netlink messages, until the end of the burst."""
+        while select([sock], [], [], DEBOUNCE)[0]:
+            try:
+                sock.recv(65536)
+            except OSError:
+                return
+
+    def run(self):
+        fds = [self._pipe_r] + ([self._netlink] if self._netlink is not None else [])
+        self._evaluate()
+        while not self._stopped:
+            if self._netlink is None:
+                timeout = FALLBACK_INTERVAL
+            elif not self._online and has_default_route():
+                # the link is up but no server answered
+                timeout = RETRY_INTERVAL
+            else:
+                timeout = None
+            ready = select(fds, [], [], timeout)[0]
+            if self._stopped:
+                break
+            if self._pipe_r in ready:
+                os.read(self._pipe_r, 4096)
+                # recent enough result
+                with self._lock:
+                    fresh = self._fresh
+                if (not fresh and self._netlink not in ready
+                        and time.monotonic() - self._time < PROBE_TTL):
+                    self._publish(self._online, False)
+                    continue
+            if self._netlink is not None and self._netlink in ready:
+                self._drain(self._netlink)
+            self._evaluate()
+        if self._netlink is not None:
+            self._netlink.close()
@@ -0,0 +1,347 @@
+#! /usr/bin/python3
+# -*- coding:Utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+Desktop notifications
+
+The notifications are sent to org.freedesktop.Notifications over a session
+bus connection kept open by a worker thread, so that the caller never waits.
+Each category of notification (e.g. the unread mail count) reuses the same
+notification id so that the popup is updated in place instead of stacking a
+new one. notify-send is only used when the session bus cannot be reached.
+
+The minimal D-Bus client below implements the EXTERNAL authentication and
+the marshalling of the basic, array, struct and variant types, which is all
+that is needed to call methods on the bus.
+"""
+
+
+import logging
+import os
+import socket
+import struct
+from queue import Queue
+from threading import Thread, Lock
+try:
+    from subprocess import run
+except ImportError:
+    from subprocess import call as run
+
+APP_NAME = "CheckMails"
+# maximum time in s to wait for the answer of the bus
+TIMEOUT = 5
+# {type code: (struct format, size)}
+FIXED = {'y': ('B', 1), 'b': ('I', 4), 'n': ('h', 2), 'q': ('H', 2),
+         'i': ('i', 4), 'u': ('I', 4), 'x': ('q', 8), 't': ('Q', 8),
+         'd': ('d', 8), 'h': ('I', 4)}
+ALIGN = {'s': 4, 'o': 4, 'g': 1, 'v': 1, 'a': 4, '(': 8, '{': 8}
+# message types
+METHOD_CALL, METHOD_RETURN, ERROR = 1, 2, 3
+# header fields
+PATH, INTERFACE, MEMBER, ERROR_NAME, REPLY_SERIAL, DESTINATION, SIGNATURE = 1, 2, 3, 4, 5, 6, 8
+
+
+class DBusError(Exception):
+    """Error returned by the bus."""
+
+
+def split_signature(signature):
+    """Return the list of the complete types of signature."""
+    types = []
+    i = 0
+    while i < len(signature):
+        j = i
+        while signature[j] == 'a':
+            j += 1
+        if signature[j] in '({':
+            depth = 0
+            for j in range(j, len(signature)):
+                depth += signature[j] in '({'
+                depth -= signature[j] in ')}'
+                if depth == 0:
+                    break
+        types.append(signature[i:j + 1])
+        i = j + 1
+    return types
+
+
+def alignment(code):
+    return FIXED[code][1] if code in FIXED else ALIGN[code]
+
+
+class Marshaller:
+    """Serialize values in the D-Bus wire format (little endian)."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def align(self, n):
+        self.buffer.extend(b'\0' * (-len(self.buffer) % n))
+
+    def write(self, signature, values):
+        for code, value in zip(split_signature(signature), values):
+            self._write(code, value)
+        return self
+
+    def _write(self, code, value):
+        c = code[0]
+        if c in FIXED:
+            fmt, size = FIXED[c]
+            self.align(size)
+            self.buffer.extend(struct.pack('<' + fmt, value))
+        elif c in 'so':
+            data = value.encode()
+            self.align(4)
+            self.buffer.extend(struct.pack('<I', len(data)) + data + b'\0')
+        elif c == 'g':
+            data = value.encode()
+            self.buffer.extend(bytes([len(data)]) + data + b'\0')
+        elif c == 'v':
+            signature, val = value
+            self._write('g', signature)
+            self._write(signature, val)
+        elif c == 'a':
+            self.align(4)
+            pos = len(self.buffer)
+            self.buffer.extend(b'\0\0\0\0')
+            element = code[1:]
+            # the padding before the first element is not part of the length
+            self.align(alignment(element[0]))
+            start = len(self.buffer)
+            for item in (value.items() if element[0] == '{' else value):
+                self._write(element, item)
+            struct.pack_into('<I', self.buffer, pos, len(self.buffer) - start)
+        elif c in '({':
+            self.align(8)
+            for sub, val in zip(split_signature(code[1:-1]), value):
+                self._write(sub, val)
+        else:
+            raise ValueError("unsupported type %r" % code)
+
+
+class Unmarshaller:
+    """Deserialize values from the D-Bus wire format."""
+
+    def __init__(self, data, endian='<', offset=0):
+        self.data = data
+        self.endian = endian
+        self.offset = offset
+
+    def align(self, n):
+        self.offset += -self.offset % n
+
+    def read(self, signature):
+        return [self._read(code) for code in split_signature(signature)]
+
+    def _unpack(self, fmt, size):
+        value = struct.unpack_from(self.endian + fmt, self.data, self.offset)[0]
+        self.offset += size
+        return value
+
+    def _read(self, code):
+        c = code[0]
+        if c in FIXED:
+            fmt, size = FIXED[c]
+            self.align(size)
+            return self._unpack(fmt, size)
+        if c in 'so':
+            self.align(4)
+            length = self._unpack('I', 4)
+            value = self.data[self.offset:self.offset + length].decode()
+            self.offset += length + 1
+            return value
+        if c == 'g':
+            length = self.data[self.offset]
+            value = self.data[self.offset + 1:self.offset + 1 + length].decode()
+            self.offset += length + 2
+            return value
+        if c == 'v':
+            return self._read(self._read('g'))
+        if c == 'a':
+            self.align(4)
+            length = self._unpack('I', 4)
+            element = code[1:]
+            self.align(alignment(element[0]))
+            end = self.offset + length
+            items = []
+            while self.offset < end:
+                items.append(self._read(element))
+            return dict(items) if element[0] == '{' else items
+        if c in '({':
+            self.align(8)
+            return tuple(self._read(sub) for sub in split_signature(code[1:-1]))
+        raise ValueError("unsupported type %r" % code)
+
+
+def bus_address():
+    """Return the address of the session bus socket (AF_UNIX address)."""
+    address = os.environ.get("DBUS_SESSION_BUS_ADDRESS", "")
+    for entry in address.split(";"):
+        transport, sep, params = entry.partition(":")
+        if transport != "unix":
+            continue
+        params = dict(param.partition("=")[::2] for param in params.split(","))
+        if "path" in params:
+            return params["path"]
+        if "abstract" in params:
+            return "\0" + params["abstract"]
+    raise ValueError("no session bus address")
+
+
+class DBusConnection:
+    """Blocking connection to the session bus."""
+
+    def __init__(self, address=None, timeout=TIMEOUT):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.serial = 0
+        try:
+            self.socket.connect(address or bus_address())
+            self._authenticate()
+            self.unique_name = self.call("org.freedesktop.DBus", "/org/freedesktop/DBus",
+                                         "org.freedesktop.DBus", "Hello")[0]
+        except Exception:
+            self.socket.close()
+            raise
+
+    def _authenticate(self):
+        uid = str(os.getuid()).encode().hex().encode()
+        self.socket.sendall(b"\0AUTH EXTERNAL " + uid + b"\r\n")
+        line = b""
+        while not line.endswith(b"\r\n"):
+            data = self.socket.recv(1)
+            if not data:
+                raise OSError("connection closed by the bus")
+            line += data
+        if not line.startswith(b"OK "):
+            raise DBusError("authentication rejected: %s" % line.decode(errors="replace").strip())
+        self.socket.sendall(b"BEGIN\r\n")
+
+    def _recv(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.socket.recv(size - len(data))
+            if not chunk:
+                raise OSError("connection closed by the bus")
+            data.extend(chunk)
+        return bytes(data)
+
+    def _read_message(self):
+        """Return (type, header fields, body) of the next message."""
+        start = self._recv(16)
+        endian = '<' if start[0:1] == b'l' else '>'
+        msg_type = start[1]
+        body_length, serial, fields_length = struct.unpack_from(endian + 'III', start, 4)
+        header_length = 16 + fields_length + (-(16 + fields_length) % 8)
+        data = start + self._recv(header_length - 16 + body_length)
+        fields = dict(Unmarshaller(data, endian, 12).read('a(yv)')[0])
+        signature = fields.get(SIGNATURE, '')
+        body = Unmarshaller(data[header_length:], endian).read(signature)
+        return msg_type, fields, body
+
+    def call(self, destination, path, interface, member, signature='', args=()):
+        """Call the method and return the values of the reply."""
+        self.serial += 1
+        fields = [(PATH, ('o', path)), (INTERFACE, ('s', interface)),
+                  (MEMBER, ('s', member)), (DESTINATION, ('s', destination))]
+        if signature:
+            fields.append((SIGNATURE, ('g', signature)))
+        body = Marshaller().write(signature, args).buffer
+        message = Marshaller().write('yyyyuua(yv)', (ord('l'), METHOD_CALL, 0, 1, len(body),
+                                                      self.serial, fields))
+        message.align(8)
+        self.socket.sendall(message.buffer + body)
+        while True:
+            msg_type, fields, values = self._read_message()
+            # skip the signals (e.g. NameAcquired)
+            if fields.get(REPLY_SERIAL) != self.serial:
+                continue
+            if msg_type == ERROR:
+                raise DBusError("%s: %s" % (fields.get(ERROR_NAME), values[0] if values else ""))
+            return values
+
+    def close(self):
+        self.socket.close()
+
+
+class Notifier:
+    """Send the notifications from a worker thread."""
+
+    def __init__(self):
+        self.queue = Queue()
+        self.bus = None
+        # notification id of each category
+        self.ids = {}
+        self._thread = None
+        self._lock = Lock()
+
+    def notify(self, summary, body="", icon="", category=None):
+        """
+        Display a notification, the notification of the same category, if
+        any, is replaced. Can be called from any thread.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='notifications', daemon=True)
+                self._thread.start()
+        self.queue.put((summary, body, icon, category))
+
+    def _run(self):
+        while True:
+            self._send(*self.queue.get())
+
+    def _connect(self):
+        try:
+            self.bus = DBusConnection()
+        except (OSError, ValueError, DBusError) as e:
+            logging.warning("Cannot connect to the session bus: %s", e)
+            self.bus = None
+
+    def _send(self, summary, body, icon, category):
+        for attempt in range(2):
+            if self.bus is None:
+                self._connect()
+                if self.bus is None:
+                    break
+            try:
+                notif_id = self.bus.call(
+                    "org.freedesktop.Notifications", "/org/freedesktop/Notifications",
+                    "org.freedesktop.Notifications", "Notify", "susssasa{sv}i",
+                    (APP_NAME, self.ids.get(category, 0), icon, summary, body,
+                     [], {}, -1))[0]
+                if category is not None:
+                    self.ids[category] = notif_id
+                return
+            except DBusError as e:
+                # e.g. no notification server
+                logging.warning("Notification failed: %s", e)
+                break
+            except OSError as e:
+                # the connection is lost, try a new one
+                logging.warning("Notification failed: %s", e)
+                self.bus.close()
+                self.bus = None
+        try:
+            run(["notify-send", "-i", icon, summary, body])
+        except OSError as e:
+            logging.error("Cannot display the notification: %s", e)
+
+
+# shared by all the windows
+NOTIFIER = Notifier()
@@ -1,2 +0,0 @@
-catch {package require nonexistentName}
-puts [package names]
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016-2018 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Adaptive polling schedule of the mailboxes
+"""
+
+
+import random
+import time
+
+# relative random variation of the intervals so that many clients started at
+# the same time do not all check the server at the same time
+JITTER = 0.1
+# interval multiplier after a check without new mail
+QUIET_FACTOR = 1.5
+# interval multiplier after a failed check
+FAILURE_FACTOR = 2
+# the mailboxes due within this time (in s) are checked together
+SLACK = 1
+
+
+class _Schedule:
+    def __init__(self, interval, min_time, max_time):
+        self.min_time = min_time
+        self.max_time = max_time
+        self.interval = self.bound(interval)
+        self.due = time.monotonic() + self.jittered()
+
+    def bound(self, interval):
+        return min(self.max_time, max(self.min_time, interval))
+
+    def jittered(self):
+        return self.interval * random.uniform(1 - JITTER, 1 + JITTER)
+
+
+class Scheduler:
+    """
+    Keep the time of the next check of each mailbox.
+
+    The interval between two checks of a mailbox is halved when new mails
+    arrived since the previous check, increased by QUIET_FACTOR otherwise
+    and multiplied by FAILURE_FACTOR when the check failed. It stays within
+    the (min_time, max_time) bounds of the mailbox. All times are in seconds.
+    """
+
+    def __init__(self, interval):
+        """interval: initial interval between two checks."""
+        self.interval = interval
+        self._boxes = {}
+
+    def update(self, bounds):
+        """
+        Set the mailboxes to schedule, bounds is a dictionary
+        {box: (min_time, max_time)}. The schedule of the mailboxes that were
+        already there is kept.
+        """
+        for box in list(self._boxes):
+            if box not in bounds:
+                del self._boxes[box]
+        for box, (min_time, max_time) in bounds.items():
+            sched = self._boxes.get(box)
+            if sched is None:
+                self._boxes[box] = _Schedule(self.interval, min_time, max_time)
+            else:
+                sched.min_time, sched.max_time = min_time, max_time
+                sched.interval = sched.bound(sched.interval)
+
+    def set_interval(self, interval):
+        """
+        Change the initial interval between two checks. The mailboxes already
+        scheduled start again from this interval but their next check is not
+        postponed.
+        """
+        self.interval = interval
+        now = time.monotonic()
+        for sched in self._boxes.values():
+            sched.interval = sched.bound(interval)
+            sched.due = min(sched.due, now + sched.jittered())
+
+    def checked(self, box, new_mail):
+        """Schedule the next check of box after a successful check."""
+        sched = self._boxes.get(box)
+        if sched is None:
+            return
+        if new_mail:
+            sched.interval = sched.bound(sched.interval / 2)
+        else:
+            sched.interval = sched.bound(sched.interval * QUIET_FACTOR)
+        sched.due = time.monotonic() + sched.jittered()
+
+    def failed(self, box):
+        """Schedule the next check of box after a failed check."""
+        sched = self._boxes.get(box)
+        if sched is None:
+            return
+        sched.interval = sched.bound(sched.interval * FAILURE_FACTOR)
+        sched.due = time.monotonic() + sched.jittered()
+
+    def due(self, boxes=None):
+        """Return the list of the mailboxes (among boxes if given) to check now."""
+        now = time.monotonic() + SLACK
+        return [box for box, sched in self._boxes.items()
+                if sched.due <= now and (boxes is None or box in boxes)]
+
+    def next_check(self, boxes=None):
+        """
+        Return the time until the next check among boxes (all the mailboxes
+        if None), None if there is nothing to check.
+        """
+        dues = [sched.due for box, sched in self._boxes.items()
+                if boxes is None or box in boxes]
+        if not dues:
+            return None
+        return max(0, min(dues) - time.monotonic())
+
+    def interval_of(self, box):
+        """Return the current interval between two checks of box."""
+        return self._boxes[box].interval
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016-2018 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Paths, configuration, translation and encryption of the connection
+information, without GUI so that they can be used by the headless daemon
+"""
+
+
+import hashlib
+import os
+import crypt
+from configparser import ConfigParser
+from locale import getdefaultlocale
+import gettext
+import logging
+from logging.handlers import TimedRotatingFileHandler
+
+# --- paths
+PATH = os.path.dirname(__file__)
+
+if os.access(PATH, os.W_OK) and os.path.exists(os.path.join(PATH, "images")):
+    # the app is not installed
+    # local directory containing config files
+    LOCAL_PATH = os.path.join(PATH, "config")
+    PATH_LOCALE = os.path.join(PATH, "locale")
+    PATH_IMAGES = os.path.join(PATH, "images")
+else:
+    # local directory containing config files
+    LOCAL_PATH = os.path.join(os.path.expanduser("~"), ".checkmails")
+    PATH_LOCALE = "/usr/share/locale"
+    PATH_IMAGES = "/usr/share/checkmails/images"
+if os.environ.get("CHECKMAILS_LOCAL_PATH"):
+    # separate configuration, used by the benchmark
+    LOCAL_PATH = os.environ["CHECKMAILS_LOCAL_PATH"]
+
+if not os.path.isdir(LOCAL_PATH):
+    os.mkdir(LOCAL_PATH)
+PATH_CONFIG = os.path.join(LOCAL_PATH, "checkmails.ini")
+LOG_PATH = os.path.join(LOCAL_PATH, "checkmails.log")
+
+
+# --- log
+handler = TimedRotatingFileHandler(LOG_PATH, when='midnight',
+                                   interval=1, backupCount=7)
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)-15s %(levelname)s: %(message)s',
+                    handlers=[handler])
+logging.getLogger().addHandler(logging.StreamHandler())
+
+
+# --- read config file
+CONFIG = ConfigParser()
+if os.path.exists(PATH_CONFIG):
+    CONFIG.read(PATH_CONFIG)
+    LANGUE = CONFIG.get("General", "language")
+    if not CONFIG.has_option("General", "font"):
+        CONFIG.set("General", "font", "")
+    if not CONFIG.has_option("General", "check_update"):
+        CONFIG.set("General", "check_update", "True")
+    if not CONFIG.has_option("General", "trayicon"):
+        CONFIG.set("General", "trayicon", "")
+    if not CONFIG.has_option("General", "idle"):
+        CONFIG.set("General", "idle", "True")
+    if not CONFIG.has_option("General", "engine"):
+        CONFIG.set("General", "engine", "threads")
+    if not CONFIG.has_option("General", "keepalive"):
+        CONFIG.set("General", "keepalive", "600000")
+    if not CONFIG.has_option("General", "min_time"):
+        CONFIG.set("General", "min_time", "60000")
+    if not CONFIG.has_option("General", "max_time"):
+        CONFIG.set("General", "max_time", "1800000")
+    if not CONFIG.has_option("General", "tray_process"):
+        CONFIG.set("General", "tray_process", "False")
+else:
+    LANGUE = ""
+    CONFIG.add_section("General")
+    CONFIG.add_section("Mailboxes")
+    # time in ms between to checks
+    CONFIG.set("General", "time", "300000")
+    CONFIG.set("General", "timeout", "60000")
+    # an unavailable font (e.g. '') is replaced by the default one
+    CONFIG.set("General", "font", "")
+    CONFIG.set("General", "check_update", "True")
+    CONFIG.set("Mailboxes", "active", "")
+    CONFIG.set("Mailboxes", "inactive", "")
+    CONFIG.set("General", "trayicon", "")
+    CONFIG.set("General", "idle", "True")
+    # 'threads' or 'asyncio'
+    CONFIG.set("General", "engine", "threads")
+    # maximum time in ms without activity on a connection
+    CONFIG.set("General", "keepalive", "600000")
+    # bounds in ms of the time between two checks of a mailbox, can be set
+    # for each mailbox in a 'Mailbox <name>' section
+    CONFIG.set("General", "min_time", "60000")
+    CONFIG.set("General", "max_time", "1800000")
+    # display the tray icon from a helper process
+    CONFIG.set("General", "tray_process", "False")
+
+
+def save_config():
+    """Save configuration to config file."""
+    with open(PATH_CONFIG, 'w') as fichier:
+        CONFIG.write(fichier)
+
+
+def time_bounds(box):
+    """
+    Return the minimum and maximum time in s between two checks of box,
+    set in the section 'Mailbox <box>' of the configuration file or in
+    the General section for all the mailboxes.
+    """
+    section = "Mailbox %s" % box
+    min_time = CONFIG.getint(section, "min_time",
+                             fallback=CONFIG.getint("General", "min_time"))
+    max_time = CONFIG.getint(section, "max_time",
+                             fallback=CONFIG.getint("General", "max_time"))
+    return min_time / 1000, max(min_time, max_time) / 1000
+
+
+# --- Translation
+APP_NAME = "checkmails"
+
+if LANGUE not in ["en", "fr"]:
+    # Check the default locale
+    lc = getdefaultlocale()[0][:2]
+    if lc == "fr":
+        # If we have a default, it's the first in the list
+        LANGUE = "fr_FR"
+    else:
+        LANGUE = "en_US"
+    CONFIG.set("General", "language", LANGUE[:2])
+
+gettext.find(APP_NAME, PATH_LOCALE)
+if hasattr(gettext, "bind_textdomain_codeset"):
+    # removed in python 3.10
+    gettext.bind_textdomain_codeset(APP_NAME, "UTF-8")
+gettext.bindtextdomain(APP_NAME, PATH_LOCALE)
+gettext.textdomain(APP_NAME)
+LANG = gettext.translation(APP_NAME, PATH_LOCALE,
+                           languages=[LANGUE], fallback=True)
+LANG.install()
+
+
+# --- Cryptographic functions to safely store login information
+def check_password(pwd):
+    """Return True if pwd is the master password."""
+    with open(os.path.join(LOCAL_PATH, '.pwd')) as fich:
+        cryptedpwd = fich.read()
+    return crypt.crypt(pwd, cryptedpwd) == cryptedpwd
+
+
+def decrypt(mailbox, pwd, warn=logging.warning):
+    """
+    Returns the login and password for the mailbox that where encrypted using pwd.
+
+    If the mailbox file does not exist, the mailbox is removed from the
+    configuration and warn is called with the warning message.
+    """
+    # imported on first use to display the tray icon sooner
+    from Crypto.Cipher import AES
+    key = hashlib.sha256(pwd.encode()).digest()
+    try:
+        with open(os.path.join(LOCAL_PATH, mailbox), 'rb') as fich:
+            iv = fich.read(AES.block_size)
+            cipher = AES.new(key, AES.MODE_CFB, iv)
+            server, login, password, folder = cipher.decrypt(fich.read()).decode().split("\n")
+    except FileNotFoundError:
+        warn(_("Unknown mailbox %(name)r will be removed from configuration file.") % {'name': mailbox})
+        active = CONFIG.get("Mailboxes", "active").split(", ")
+        inactive = CONFIG.get("Mailboxes", "inactive").split(", ")
+        while "" in active:
+            active.remove("")
+        while "" in inactive:
+            inactive.remove("")
+        if mailbox in active:
+            active.remove(mailbox)
+        if mailbox in inactive:
+            inactive.remove(mailbox)
+        CONFIG.set("Mailboxes", "active", ", ".join(active))
+        CONFIG.set("Mailboxes", "inactive", ", ".join(inactive))
+        save_config()
+        return None, None, None, None
+    return server, login, password, folder
+
+
+def encrypt(mailbox, pwd, server, login, password, folder):
+    """Encrypt the mailbox connection information using pwd."""
+    from Crypto.Cipher import AES
+    from Crypto import Random
+    key = hashlib.sha256(pwd.encode()).digest()
+    iv = Random.new().read(AES.block_size)
+    cipher = AES.new(key, AES.MODE_CFB, iv)
+    info = [server, login, password, folder]
+    with open(os.path.join(LOCAL_PATH, mailbox), 'wb') as fich:
+        fich.write(iv)
+        try:
+            fich.write(cipher.encrypt("\n".join(info)))
+        except TypeError:
+            fich.write(cipher.encrypt("\n".join(info).encode()))
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016-2018 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Outputs of the unread mail counts of the headless daemon
+
+The counts are published as a json object
+{"time": <unix time>, "total": <total count>, "mailboxes": {<box>: <count>}}
+on a single line.
+"""
+
+
+import json
+import logging
+import os
+import socket
+import sys
+import time
+from threading import Thread, Lock
+
+
+def format_counts(counts):
+    """Return the json line publishing counts, a dictionary {box: count}."""
+    return json.dumps({"time": time.time(), "total": sum(counts.values()),
+                       "mailboxes": counts}, sort_keys=True) + "\n"
+
+
+class Sink:
+    """Output of the unread mail counts."""
+
+    def publish(self, counts):
+        """Publish counts, a dictionary {box: count}."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class StdoutSink(Sink):
+    """Print the counts on the standard output."""
+
+    def publish(self, counts):
+        sys.stdout.write(format_counts(counts))
+        sys.stdout.flush()
+
+
+class FileSink(Sink):
+    """Write the last counts in a file, replaced atomically."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def publish(self, counts):
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as file:
+                file.write(format_counts(counts))
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logging.error("Cannot write the counts in %s: %s", self.path, e)
+
+
+class SocketSink(Sink):
+    """
+    Send the counts to the clients connected to a unix socket: each client
+    receives the last counts when it connects and then every update. The
+    sockets are non-blocking, the clients that do not read their updates are
+    disconnected once their socket buffer is full.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._clients = []
+        self._last = None
+        self._lock = Lock()
+        if os.path.exists(path):
+            # left by a previous instance
+            os.remove(path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(path)
+        self._socket.listen()
+        Thread(target=self._accept, name='socket_sink', daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, addr = self._socket.accept()
+            except OSError:
+                # socket closed
+                return
+            client.setblocking(False)
+            with self._lock:
+                if self._last is not None and not self._send(client, self._last):
+                    continue
+                self._clients.append(client)
+
+    @staticmethod
+    def _send(client, data):
+        """Send data to client, return False if the client is gone or too slow."""
+        try:
+            sent = client.send(data)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            client.close()
+            return False
+        if sent == len(data):
+            return True
+        logging.warning("Disconnecting a client of the socket sink that does not read the counts")
+        client.close()
+        return False
+
+    def publish(self, counts):
+        data = format_counts(counts).encode()
+        with self._lock:
+            self._last = data
+            self._clients = [c for c in self._clients if self._send(c, data)]
+
+    def close(self):
+        self._socket.close()
+        with self._lock:
+            for client in self._clients:
+                client.close()
+            self._clients.clear()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def make_sink(spec):
+    """
+    Return the sink described by spec: 'stdout', 'file:<path>' or
+    'socket:<path>'. Raise ValueError if spec is not valid.
+    """
+    kind, sep, path = spec.partition(":")
+    if kind == "stdout" and not sep:
+        return StdoutSink()
+    if kind == "file" and path:
+        return FileSink(path)
+    if kind == "socket" and path:
+        return SocketSink(path)
+    raise ValueError("invalid sink %r, expected stdout, file:<path> or socket:<path>" % spec)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016-2018 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Detection of the GUI toolkits available to create the system tray icon
+"""
+
+
+import os
+import sys
+import json
+import logging
+import importlib.util
+try:
+    from importlib import metadata
+except ImportError:
+    # python < 3.8
+    metadata = None
+
+# modules providing each toolkit, by order of preference, with the name of
+# their distribution
+GTK_MODULES = [('gi', 'PyGObject')]
+QT_MODULES = [('PyQt5', 'PyQt5'), ('PyQt4', 'PyQt4'), ('PySide', 'PySide')]
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def probe_module(module, dist):
+    """
+    Return the version of module if it is installed without importing it,
+    None otherwise. When the distribution metadata is missing, the
+    modification time of the module is used instead.
+    """
+    try:
+        spec = importlib.util.find_spec(module)
+    except (ImportError, ValueError):
+        return None
+    if spec is None:
+        return None
+    if metadata is not None:
+        try:
+            return metadata.version(dist)
+        except metadata.PackageNotFoundError:
+            pass
+    return "mtime %s" % _mtime(spec.origin or list(spec.submodule_search_locations)[0])
+
+
+def probe_modules(modules):
+    """Return the versions of the first installed module among modules."""
+    for module, dist in modules:
+        version = probe_module(module, dist)
+        if version is not None:
+            return [module, version]
+    return None
+
+
+def probe_tktray():
+    """
+    Return whether the tktray Tcl extension is available and the
+    directories where Tcl looks for packages.
+    """
+    from tkinter import Tcl, TclError
+
+    tcl = Tcl()
+    try:
+        # make Tcl load the package indexes
+        tcl.eval('catch {package require nonexistentName}')
+        available = "tktray" in tcl.eval('package names').split()
+        auto_path = tcl.splitlist(tcl.eval('set auto_path'))
+    except TclError:
+        return False, []
+    return available, [str(d) for d in auto_path]
+
+
+def get_available_gui_toolkits(cache_path):
+    """
+    Check which gui toolkits are available to create a system tray icon.
+
+    Only the metadata of the toolkits are looked up, they are not imported.
+    The result is saved in cache_path and reused as long as the interpreter,
+    the versions of the Python toolkits and the Tcl package directories are
+    unchanged.
+    """
+    from tkinter import TclVersion
+
+    key = [sys.executable, sys.version, TclVersion,
+           probe_modules(GTK_MODULES), probe_modules(QT_MODULES)]
+    try:
+        with open(cache_path) as file:
+            cache = json.load(file)
+        if cache["key"] == key and all(_mtime(d) == m for d, m in cache["tcl_dirs"]):
+            toolkits = cache["toolkits"]
+        else:
+            toolkits = None
+    except (OSError, ValueError, KeyError, TypeError):
+        toolkits = None
+
+    if toolkits is None:
+        logging.info("Detecting the available GUI toolkits")
+        tktray, tcl_dirs = probe_tktray()
+        toolkits = {'gtk': key[3] is not None,
+                    'qt': key[4] is not None,
+                    'tk': tktray}
+        tmp = cache_path + ".tmp"
+        try:
+            with open(tmp, "w") as file:
+                json.dump({"key": key, "toolkits": toolkits,
+                           "tcl_dirs": [[d, _mtime(d)] for d in tcl_dirs]},
+                          file)
+            os.replace(tmp, cache_path)
+        except OSError as e:
+            logging.warning("Cannot save the GUI toolkits: %s", e)
+
+    if not any(toolkits.values()):
+        raise ImportError("No GUI toolkits available to create the system tray icon.")
+    return toolkits
@@ -21,9 +21,12 @@ System tray icon.
 """
 
 
-from checkmailslib.constants import GUI
+from checkmailslib.constants import GUI, CONFIG
 
-if GUI == 'gtk':
+if CONFIG.getboolean("General", "tray_process"):
+    # the toolkit is only loaded by the helper process
+    from checkmailslib.trayicon.proxy import TrayIconProxy as TrayIcon
+elif GUI == 'gtk':
     from checkmailslib.trayicon.gtkicon import TrayIcon
 elif GUI == 'qt':
     from checkmailslib.trayicon.qticon import TrayIcon
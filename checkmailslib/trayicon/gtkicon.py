@@ -20,9 +20,12 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 System tray icon using Gtk 3.
 """
 
+import os
+from checkmailslib.constants import ICON
+from checkmailslib.trayicon.mainloop import LoopIntegration, GLibIteration
 import gi
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk
+from gi.repository import Gtk, GdkPixbuf, GLib
 
 APPIND_SUPPORT = 1
 try:
@@ -37,6 +40,7 @@ class TrayIcon:
     def __init__(self, icon, appid="Checkmails"):
         self.menu = Gtk.Menu()
         self.menu_items = []
+        self.mainloop = LoopIntegration(GLibIteration(GLib))
 
         if APPIND_SUPPORT == 1:
             self.ind = AppIndicator3.Indicator.new(
@@ -44,11 +48,13 @@ class TrayIcon:
             self.ind.set_status(AppIndicator3.IndicatorStatus.ACTIVE)
             self.ind.set_menu(self.menu)
             self.change_icon = self._change_icon_appind
+            self.change_icon_data = self._change_icon_data_appind
         else:
             self.ind = Gtk.StatusIcon()
             self.ind.set_from_file(icon)
             self.ind.connect('popup-menu', self._on_popup_menu)
             self.change_icon = self._change_icon_fallback
+            self.change_icon_data = self._change_icon_data_fallback
 
     def _on_popup_menu(self, icon, button, time):
         self.menu.popup(None, None, Gtk.StatusIcon.position_menu, icon, button, time)
@@ -73,11 +79,26 @@ class TrayIcon:
     def _change_icon_fallback(self, icon, desc):
         self.ind.set_from_file(icon)
 
-    def loop(self, tk_window):
+    def _change_icon_data_appind(self, data, desc):
+        # AppIndicator only accepts icon files
+        tmp = ICON + ".tmp"
+        with open(tmp, 'wb') as file:
+            file.write(data)
+        os.replace(tmp, ICON)
+        self.ind.set_icon_full(ICON, desc)
+
+    def _change_icon_data_fallback(self, data, desc):
+        loader = GdkPixbuf.PixbufLoader.new_with_type('png')
+        loader.write(data)
+        loader.close()
+        self.ind.set_from_pixbuf(loader.get_pixbuf())
+
+    def attach(self, tk_window):
         """Update Gtk GUI inside tkinter mainloop."""
-        while Gtk.events_pending():
-            Gtk.main_iteration()
-        tk_window.loop_id = tk_window.after(10, self.loop, tk_window)
+        self.mainloop.attach(tk_window)
+
+    def detach(self):
+        self.mainloop.detach()
 
     def get_item_label(self, item):
         return self.menu_items[item].get_label()
@@ -0,0 +1,141 @@
+#! /usr/bin/python3
+# -*- coding:Utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+Tray icon helper process
+
+Display the tray icon with the toolkit given on the command line and
+exchange messages with the checker through the standard input and output,
+see proxy.py for the protocol. The helper exits at the end of its input.
+"""
+
+
+import json
+import os
+import sys
+from base64 import b64decode
+
+
+class Helper:
+    """Apply the messages of the checker to the tray icon and report the clicks."""
+
+    def __init__(self, icon, quit):
+        """
+        icon: TrayIcon
+        quit: function stopping the main loop of the toolkit
+        """
+        self.icon = icon
+        self.quit = quit
+        # number of menu entries, separators included
+        self.entries = 0
+        self._buffer = b""
+
+    def send(self, message):
+        try:
+            sys.stdout.buffer.write(json.dumps(message).encode() + b"\n")
+            sys.stdout.buffer.flush()
+        except OSError:
+            # the checker is gone
+            self.quit()
+
+    def on_input(self, *args):
+        """Read and apply the available messages, return False at the end of the input."""
+        try:
+            data = os.read(sys.stdin.fileno(), 65536)
+        except BlockingIOError:
+            return True
+        if not data:
+            self.quit()
+            return False
+        lines = (self._buffer + data).split(b"\n")
+        self._buffer = lines.pop()
+        for line in lines:
+            self.process(json.loads(line.decode()))
+        return True
+
+    def process(self, message):
+        cmd = message[0]
+        if cmd == "item":
+            index = self.entries
+            self.entries += 1
+            self.icon.add_menu_item(label=message[1],
+                                    command=lambda: self.send(["click", index]))
+        elif cmd == "separator":
+            self.entries += 1
+            self.icon.add_menu_separator()
+        elif cmd == "icon":
+            self.icon.change_icon(message[1], message[2])
+        elif cmd == "icon_data":
+            self.icon.change_icon_data(b64decode(message[1]), message[2])
+        elif cmd == "label":
+            self.icon.set_item_label(message[1], message[2])
+        elif cmd == "enable":
+            self.icon.enable_item(message[1])
+        elif cmd == "disable":
+            self.icon.disable_item(message[1])
+        elif cmd == "left_click":
+            self.icon.bind_left_click(lambda: self.send(["left_click"]))
+
+
+def run_gtk(icon_path):
+    from gi.repository import GLib
+    from checkmailslib.trayicon.gtkicon import TrayIcon, Gtk
+
+    helper = Helper(TrayIcon(icon_path), Gtk.main_quit)
+    GLib.io_add_watch(sys.stdin.fileno(), GLib.PRIORITY_DEFAULT,
+                      GLib.IOCondition.IN | GLib.IOCondition.HUP, helper.on_input)
+    Gtk.main()
+
+
+def run_qt(icon_path):
+    from checkmailslib.trayicon.qticon import TrayIcon
+    try:
+        from PyQt5.QtCore import QSocketNotifier
+    except ImportError:
+        try:
+            from PyQt4.QtCore import QSocketNotifier
+        except ImportError:
+            from PySide.QtCore import QSocketNotifier
+
+    icon = TrayIcon(icon_path)
+    helper = Helper(icon, icon.quit)
+    notifier = QSocketNotifier(sys.stdin.fileno(), QSocketNotifier.Read)
+    notifier.activated.connect(helper.on_input)
+    icon.exec_()
+
+
+def run_tk(icon_path):
+    import tkinter
+    from checkmailslib.trayicon.tkicon import TrayIcon
+
+    root = tkinter.Tk(className="CheckMails")
+    root.withdraw()
+    helper = Helper(TrayIcon(icon_path, master=root), root.destroy)
+    root.tk.createfilehandler(sys.stdin.fileno(), tkinter.READABLE, helper.on_input)
+    root.mainloop()
+
+
+def main(argv=None):
+    gui, icon_path = (argv or sys.argv[1:])[:2]
+    os.set_blocking(sys.stdin.fileno(), False)
+    {'gtk': run_gtk, 'qt': run_qt, 'tk': run_tk}[gui](icon_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+#! /usr/bin/python3
+# -*- coding:Utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+Integration of the Gtk and Qt main loops in the tkinter mainloop
+
+After each iteration, the toolkit gives the file descriptors it polls and
+the time before its next timer: the tkinter mainloop watches these file
+descriptors and schedules the next iteration for the timer, so an idle
+process sleeps in the tkinter mainloop instead of polling the toolkit.
+"""
+
+
+import os
+import select
+import stat
+from tkinter import READABLE, WRITABLE, EXCEPTION
+
+# delay (ms) before the next iteration when the GLib main context is owned
+# by another thread
+RETRY_DELAY = 10
+
+
+def open_fds():
+    """Return the set of the file descriptors open in the process."""
+    try:
+        fds = [int(fd) for fd in os.listdir('/proc/self/fd')]
+    except OSError:
+        return set()
+    # skip the descriptor of the listed directory, closed by now
+    return set(fd for fd in fds if _is_open(fd))
+
+
+def _is_open(fd):
+    try:
+        os.fstat(fd)
+        return True
+    except OSError:
+        return False
+
+
+def watchable(fd):
+    """Return True if fd is a socket, a pipe or an eventfd."""
+    try:
+        mode = os.fstat(fd).st_mode
+        if stat.S_ISSOCK(mode) or stat.S_ISFIFO(mode):
+            return True
+        return os.readlink('/proc/self/fd/%i' % fd) == 'anon_inode:[eventfd]'
+    except OSError:
+        # closed in the meantime
+        return False
+
+
+def tk_mask(events):
+    """Return the tkinter file handler mask matching the poll events."""
+    mask = 0
+    if events & select.POLLIN:
+        mask |= READABLE
+    if events & select.POLLOUT:
+        mask |= WRITABLE
+    if events & select.POLLPRI:
+        mask |= EXCEPTION
+    # a hang up or an error makes the file descriptor readable
+    return mask or READABLE
+
+
+class GLibIteration:
+    """
+    Iteration of the default GLib main context for LoopIntegration.
+
+    The steps of g_main_context_iteration are split around the tkinter
+    mainloop: the sources are prepared and the context is queried at the
+    end of an iteration, the tkinter mainloop waits on the file descriptors
+    and the timeout returned, then the next iteration checks and dispatches
+    the sources that are ready.
+    """
+
+    def __init__(self, GLib):
+        self.context = GLib.MainContext.default()
+        self._priority = None  # priority of the last prepare, None if not prepared
+        self._poll_fds = []
+
+    def __call__(self):
+        context = self.context
+        if not context.acquire():
+            # the context is run by another thread
+            return {}, RETRY_DELAY
+        try:
+            if self._priority is not None:
+                events = {}
+                for pfd in self._poll_fds:
+                    events[pfd.fd] = events.get(pfd.fd, 0) | pfd.events
+                poll = select.poll()
+                for fd, mask in events.items():
+                    poll.register(fd, mask)
+                revents = dict(poll.poll(0))
+                for pfd in self._poll_fds:
+                    pfd.revents = revents.get(pfd.fd, 0)
+                if context.check(self._priority, self._poll_fds):
+                    context.dispatch()
+            ready, self._priority = context.prepare()
+            timeout, self._poll_fds = context.query(self._priority)[1:]
+        finally:
+            context.release()
+        fds = {}
+        for pfd in self._poll_fds:
+            fds[pfd.fd] = fds.get(pfd.fd, 0) | tk_mask(pfd.events)
+        if ready:
+            timeout = 0
+        return fds, (None if timeout < 0 else timeout)
+
+
+class LoopIntegration:
+    """Run the iterations of a toolkit main loop from the tkinter mainloop."""
+
+    def __init__(self, iterate):
+        """
+        iterate: function processing the toolkit events that are ready, it
+                 returns ({fd: tkinter mask}, timeout) with the file
+                 descriptors to watch until the next iteration and the time
+                 in ms before the next toolkit timer, None if there is none
+        """
+        self.iterate = iterate
+        self.tk_window = None
+        self.fds = {}
+        self._after_id = None
+
+    def attach(self, tk_window):
+        """Start processing the toolkit events inside the mainloop of tk_window."""
+        self.tk_window = tk_window
+        self._run()
+
+    def detach(self):
+        """Stop processing the toolkit events."""
+        if self.tk_window is None:
+            return
+        for fd in self.fds:
+            self.tk_window.tk.deletefilehandler(fd)
+        self.fds = {}
+        if self._after_id is not None:
+            self.tk_window.after_cancel(self._after_id)
+            self._after_id = None
+        self.tk_window = None
+
+    def _on_event(self, fd, mask):
+        self._run()
+
+    def _on_timeout(self):
+        self._after_id = None
+        self._run()
+
+    def _run(self):
+        if self._after_id is not None:
+            self.tk_window.after_cancel(self._after_id)
+            self._after_id = None
+        fds, timeout = self.iterate()
+        if self.tk_window is None:
+            # detached by a toolkit callback
+            return
+        tk = self.tk_window.tk
+        for fd in set(self.fds).difference(fds):
+            tk.deletefilehandler(fd)
+        for fd, mask in fds.items():
+            if self.fds.get(fd) != mask:
+                tk.createfilehandler(fd, mask, self._on_event)
+        self.fds = fds
+        if timeout is not None:
+            self._after_id = self.tk_window.after(max(int(timeout), 0), self._on_timeout)
@@ -0,0 +1,253 @@
+#! /usr/bin/python3
+# -*- coding:Utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+System tray icon hosted in a helper process
+
+The tray icon toolkit runs in a separate process (see helper.py) so that it
+does not share the interpreter and the main loop with the checker and a crash
+of the toolkit does not bring the checker down: the helper is restarted and
+the icon and the menu are restored.
+
+The two processes exchange json arrays, one per line, through the standard
+input and output of the helper. The messages to the helper are written
+without blocking: while the pipe is full they are kept and only the last icon
+is sent.
+
+checker -> helper:
+    ["item", label]              add a menu item
+    ["separator"]                add a menu separator
+    ["icon", path, desc]         display the icon file path
+    ["icon_data", data, desc]    display the base64 encoded PNG data
+    ["label", item, label]       change the label of a menu item
+    ["enable", item], ["disable", item]
+    ["left_click"]               report the left clicks on the icon
+
+helper -> checker:
+    ["click", item]              the menu item was activated
+    ["left_click"]               the icon was clicked
+"""
+
+
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from base64 import b64encode
+from tkinter import READABLE, WRITABLE
+from checkmailslib.constants import GUI
+
+# the helper is not restarted after MAX_RESTARTS crashes in a row within
+# RESTART_WINDOW seconds
+MAX_RESTARTS = 5
+RESTART_WINDOW = 60
+
+
+class TrayIconProxy:
+    """Same interface as the TrayIcon of the toolkits, the icon is displayed by the helper."""
+
+    def __init__(self, icon, gui=GUI):
+        """
+        icon: path to the initial icon
+        gui: toolkit of the helper ('gtk', 'qt' or 'tk')
+        """
+        self.gui = gui
+        self.icon_path = icon
+        # state replayed when the helper is restarted
+        self._items = []     # [label, enabled], None for separators
+        self._commands = []
+        self._icon = ["icon", icon, ""]
+        self._left_click = None
+        self.tk_window = None
+        self._buffer = b""
+        # messages waiting for room in the pipe and data partially written
+        self._queue = []
+        self._output = b""
+        self._restarts = []
+        # the helper kept crashing, the icon is no longer displayed
+        self._abandoned = False
+        self._start()
+
+    def _start(self):
+        self.process = subprocess.Popen([sys.executable, "-m",
+                                         "checkmailslib.trayicon.helper", self.gui,
+                                         self.icon_path],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        os.set_blocking(self.process.stdout.fileno(), False)
+        os.set_blocking(self.process.stdin.fileno(), False)
+        self._buffer = b""
+        self._queue = []
+        self._output = b""
+        self._send(self._icon)
+        for i, item in enumerate(self._items):
+            if item is None:
+                self._send(["separator"])
+                continue
+            label, enabled = item
+            self._send(["item", label])
+            if not enabled:
+                self._send(["disable", i])
+        if self._left_click is not None:
+            self._send(["left_click"])
+        if self.tk_window is not None:
+            self._watch()
+
+    def _send(self, message):
+        if self._abandoned:
+            return
+        if message[0] in ("icon", "icon_data"):
+            # only the last icon is worth displaying
+            self._queue = [m for m in self._queue if m[0] not in ("icon", "icon_data")]
+        self._queue.append(message)
+        self._flush()
+
+    def _flush(self, fd=None, mask=None):
+        """Write the pending messages as long as the pipe is not full."""
+        try:
+            while self._output or self._queue:
+                if not self._output:
+                    self._output = b"".join(json.dumps(m).encode() + b"\n"
+                                            for m in self._queue)
+                    self._queue = []
+                self._output = self._output[os.write(self.process.stdin.fileno(),
+                                                     self._output):]
+        except BlockingIOError:
+            pass
+        except OSError:
+            # the helper exited, it is restarted when its output is closed
+            # and the state is replayed
+            self._queue = []
+            self._output = b""
+        if self.tk_window is None:
+            return
+        if self._output or self._queue:
+            # wait for the helper to read its input
+            self.tk_window.tk.createfilehandler(self.process.stdin.fileno(),
+                                                WRITABLE, self._flush)
+        else:
+            self.tk_window.tk.deletefilehandler(self.process.stdin.fileno())
+
+    def _watch(self):
+        self.tk_window.tk.createfilehandler(self.process.stdout.fileno(),
+                                            READABLE, self._on_readable)
+        self._flush()
+
+    def _on_readable(self, fd, mask):
+        try:
+            data = os.read(fd, 4096)
+        except BlockingIOError:
+            return
+        if not data:
+            self._on_exit()
+            return
+        lines = (self._buffer + data).split(b"\n")
+        self._buffer = lines.pop()
+        for line in lines:
+            try:
+                message = json.loads(line.decode())
+            except ValueError:
+                logging.error("Invalid message from the tray icon helper: %r", line)
+                continue
+            if message[0] == "click":
+                command = self._commands[message[1]]
+                if command is not None:
+                    command()
+            elif message[0] == "left_click" and self._left_click is not None:
+                self._left_click()
+
+    def _on_exit(self):
+        """Restart the helper after a crash."""
+        self.tk_window.tk.deletefilehandler(self.process.stdout.fileno())
+        self.tk_window.tk.deletefilehandler(self.process.stdin.fileno())
+        self.process.stdout.close()
+        self.process.stdin.close()
+        returncode = self.process.wait()
+        now = time.monotonic()
+        self._restarts = [t for t in self._restarts if now - t < RESTART_WINDOW]
+        if len(self._restarts) >= MAX_RESTARTS:
+            logging.error("The tray icon helper keeps exiting (status %s), giving up", returncode)
+            # the checker goes on without icon
+            self._abandoned = True
+            self._queue = []
+            self._output = b""
+            return
+        self._restarts.append(now)
+        logging.error("The tray icon helper exited (status %s), restarting it", returncode)
+        self._start()
+
+    def attach(self, tk_window):
+        """Process the messages of the helper inside tkinter mainloop."""
+        self.tk_window = tk_window
+        self._watch()
+
+    def detach(self):
+        """Stop the helper."""
+        if self.tk_window is not None and self.process.stdout is not None \
+                and not self.process.stdout.closed:
+            self.tk_window.tk.deletefilehandler(self.process.stdout.fileno())
+            self.tk_window.tk.deletefilehandler(self.process.stdin.fileno())
+        self.tk_window = None
+        try:
+            # the helper exits at the end of its input
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(1)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+    def add_menu_item(self, label="", command=None):
+        self._items.append([label, True])
+        self._commands.append(command)
+        self._send(["item", label])
+
+    def add_menu_separator(self):
+        self._items.append(None)
+        self._commands.append(None)
+        self._send(["separator"])
+
+    def change_icon(self, icon, desc):
+        self._icon = ["icon", icon, desc]
+        self._send(self._icon)
+
+    def change_icon_data(self, data, desc):
+        self._icon = ["icon_data", b64encode(data).decode(), desc]
+        self._send(self._icon)
+
+    def get_item_label(self, item):
+        return self._items[item][0]
+
+    def set_item_label(self, item, label):
+        self._items[item][0] = label
+        self._send(["label", item, label])
+
+    def disable_item(self, item):
+        self._items[item][1] = False
+        self._send(["disable", item])
+
+    def enable_item(self, item):
+        self._items[item][1] = True
+        self._send(["enable", item])
+
+    def bind_left_click(self, command):
+        self._left_click = command
+        self._send(["left_click"])
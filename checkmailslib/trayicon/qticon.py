@@ -21,18 +21,29 @@ System tray icon using Qt.
 """
 try:
     from PyQt5.QtWidgets import QApplication, QSystemTrayIcon, QMenu, QAction
-    from PyQt5.QtGui import QIcon
+    from PyQt5.QtGui import QIcon, QPixmap
+    from PyQt5.QtCore import QAbstractEventDispatcher, QEventLoop, QObject
 except ImportError:
     try:
-        from PyQt4.QtGui import QApplication, QSystemTrayIcon, QMenu, QAction, QIcon
+        from PyQt4.QtGui import QApplication, QSystemTrayIcon, QMenu, QAction, QIcon, QPixmap
+        from PyQt4.QtCore import QAbstractEventDispatcher, QEventLoop, QObject
     except ImportError:
-        from PySide.QtGui import QApplication, QSystemTrayIcon, QMenu, QAction, QIcon
+        from PySide.QtGui import QApplication, QSystemTrayIcon, QMenu, QAction, QIcon, QPixmap
+        from PySide.QtCore import QAbstractEventDispatcher, QEventLoop, QObject
+try:
+    from gi.repository import GLib
+except ImportError:
+    GLib = None
 import sys
+from tkinter import READABLE
+from checkmailslib.trayicon.mainloop import LoopIntegration, GLibIteration, \
+    open_fds, watchable
 
 
 class TrayIcon(QApplication):
 
     def __init__(self, icon):
+        fds = open_fds()
         QApplication.__init__(self, sys.argv)
         # Init QSystemTrayIcon
         self.icon = QIcon(icon)
@@ -44,6 +55,16 @@ class TrayIcon(QApplication):
         self.tray_icon.setContextMenu(self.menu)
         self.tray_icon.show()
 
+        dispatcher = QAbstractEventDispatcher.instance()
+        if GLib is not None and dispatcher.inherits('QEventDispatcherGlib'):
+            # the Qt events are sources of the default GLib main context
+            self.mainloop = LoopIntegration(GLibIteration(GLib))
+        else:
+            # Qt does not tell which file descriptors it polls, the ones
+            # opened at initialization are watched
+            self.fds = {fd: READABLE for fd in open_fds() - fds if watchable(fd)}
+            self.mainloop = LoopIntegration(self.iterate)
+
     def add_menu_separator(self):
         self.menu.addSeparator()
 
@@ -53,15 +74,49 @@ class TrayIcon(QApplication):
         self.menu.addAction(action)
         self.menu_items.append(action)
 
-    def loop(self, tk_window):
-        self.processEvents()
-        tk_window.loop_id = tk_window.after(10, self.loop, tk_window)
+    def iterate(self):
+        """
+        Process the pending Qt events, return the file descriptors to watch
+        and the time in ms before the next Qt timer (see LoopIntegration).
+        """
+        dispatcher = QAbstractEventDispatcher.instance()
+        dispatcher.processEvents(QEventLoop.AllEvents)
+        return self.fds, self.next_timer(dispatcher)
+
+    def next_timer(self, dispatcher):
+        """Return the time in ms before the next timer of the Qt objects, None if there is none."""
+        delays = []
+        for obj in [self, self.tray_icon] + self.allWidgets():
+            for child in [obj] + obj.findChildren(QObject):
+                for timer in dispatcher.registeredTimers(child):
+                    if isinstance(timer, tuple):
+                        # Qt 4: (id, interval), the remaining time is unknown
+                        delays.append(timer[1])
+                    else:
+                        delays.append(dispatcher.remainingTime(timer.timerId))
+        delays = [delay for delay in delays if delay >= 0]
+        return min(delays) if delays else None
+
+    def attach(self, tk_window):
+        """Update Qt GUI inside tkinter mainloop."""
+        self.mainloop.attach(tk_window)
+
+    def detach(self):
+        self.mainloop.detach()
 
     def change_icon(self, icon, desc):
         del self.icon
         self.icon = QIcon(icon)
         self.tray_icon.setIcon(self.icon)
 
+    def change_icon_data(self, data, desc):
+        """Display the icon from its PNG data."""
+        pixmap = QPixmap()
+        pixmap.loadFromData(data, "PNG")
+        del self.icon
+        self.icon = QIcon(pixmap)
+        self.tray_icon.setIcon(self.icon)
+
     def get_item_label(self, item):
         return self.menu_items[item].text()
 
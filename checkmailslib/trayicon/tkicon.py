@@ -26,6 +26,8 @@ system tray manager.
 """
 
 import tkinter
+from base64 import b64encode
+from io import BytesIO
 from checkmailslib.constants import PhotoImage
 
 
@@ -167,10 +169,22 @@ class TrayIcon(tkinter.BaseWidget, tkinter.Wm):
         self.icon.configure(file=icon)
         self.update()
 
-    def loop(self, tk_window):
+    def change_icon_data(self, data, desc):
+        """Display the icon from its PNG data."""
+        if isinstance(self.icon, tkinter.PhotoImage):
+            self.icon.configure(data=b64encode(data))
+        else:
+            # ImageTk.PhotoImage (Tk < 8.6 cannot read PNG data)
+            from PIL import Image
+            self.icon.paste(Image.open(BytesIO(data)))
+        self.update()
+
+    def attach(self, tk_window):
         # no need to update since it is part of the tk mainloop
-        self.update_idletasks()
-        tk_window.loop_id = tk_window.after(10, self.loop, tk_window)
+        pass
+
+    def detach(self):
+        pass
 
     def get_item_label(self, item):
         return self.menu.entrycget(item, 'label')
@@ -24,10 +24,6 @@ Check for updates
 
 import re
 import logging
-try:
-    from subprocess import run
-except ImportError:
-    from subprocess import call as run
 from threading import Thread
 from urllib import request, error
 from html.parser import HTMLParser
@@ -35,6 +31,7 @@ from webbrowser import open as webOpen
 from tkinter import Toplevel, PhotoImage
 from tkinter.ttk import Label, Button, Frame, Checkbutton
 from checkmailslib.constants import CONFIG, save_config, IM_QUESTION, IMAGE2
+from checkmailslib.notifications import NOTIFIER
 from checkmailslib.version import __version__
 
 
@@ -112,7 +109,7 @@ class UpdateChecker(Toplevel):
             self.b1.focus_set()
         else:
             if self.notify:
-                run(["notify-send", "-i", IMAGE2, _("Update"), _("CheckMails is up-to-date.")])
+                NOTIFIER.notify(_("Update"), _("CheckMails is up-to-date."), IMAGE2, "update")
             logging.info("CheckMails is up-to-date")
             self.destroy()
 
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016-2018 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Tests of the asyncio mailbox engine
+
+The tests connect to the fake IMAP server of the benchmark, they are
+skipped if openssl is not installed.
+"""
+
+
+import shutil
+import socket
+import ssl
+import tempfile
+import unittest
+from queue import Queue, Empty
+from unittest import mock
+
+from checkmailslib import aioengine
+from checkmailslib.aioengine import AsyncEngine
+from checkmailslib.benchmark import FakeIMAPServer
+
+TIMEOUT = 5
+LOGIN = ('login', 'password')
+
+
+def client_context():
+    """Return a TLS context accepting the self-signed certificate of the fake server."""
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+@unittest.skipIf(shutil.which("openssl") is None, "openssl is not installed")
+class AsyncEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.server = FakeIMAPServer(directory.name, nb_unread=3)
+        self.addCleanup(self.server.close)
+        self.address = '127.0.0.1:%i' % self.server.port
+        context = mock.patch.object(aioengine.ssl, '_create_stdlib_context', client_context)
+        context.start()
+        self.addCleanup(context.stop)
+        self.events = Queue()
+
+    def start(self, idle=False):
+        engine = AsyncEngine(self.events.put, TIMEOUT, idle=idle)
+        engine.start()
+        self.addCleanup(engine.join, TIMEOUT)
+        self.addCleanup(engine.stop)
+        return engine
+
+    def next_event(self, timeout=TIMEOUT):
+        return self.events.get(timeout=timeout)
+
+    def assertNoEvent(self, timeout=0.5):
+        self.assertRaises(Empty, self.events.get, timeout=timeout)
+
+    def test_check(self):
+        engine = self.start()
+        engine.connect('box', self.address, LOGIN, 'INBOX')
+        self.assertEqual(self.next_event(), ('connected', 'box', None))
+        engine.check('box')
+        self.assertEqual(self.next_event(), ('unread', 'box', 3))
+        self.server.set_unread(1)
+        engine.check('box')
+        self.assertEqual(self.next_event(), ('unread', 'box', 1))
+
+    def test_shared_connection(self):
+        engine = self.start()
+        engine.connect('a', self.address, LOGIN, 'INBOX')
+        engine.connect('b', self.address, LOGIN, 'INBOX, Lists')
+        self.assertEqual({self.next_event(), self.next_event()},
+                         {('connected', 'a', None), ('connected', 'b', None)})
+        engine.check('a')
+        engine.check('b')
+        self.assertEqual([self.next_event(), self.next_event()],
+                         [('unread', 'a', 3), ('unread', 'b', 6)])
+
+    def test_idle(self):
+        engine = self.start(idle=True)
+        engine.connect('box', self.address, LOGIN, 'INBOX')
+        self.assertEqual(self.next_event(), ('connected', 'box', None))
+        # the unread mails are counted as soon as IDLE starts
+        self.assertEqual(self.next_event(), ('unread', 'box', 3))
+        self.assertTrue(self.server.idling.wait(TIMEOUT))
+        self.server.set_unread(4)
+        self.assertEqual(self.next_event(), ('unread', 'box', 4))
+        self.assertNoEvent()
+
+    def test_connection_refused(self):
+        # free port: nothing listens on it
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        address = '127.0.0.1:%i' % sock.getsockname()[1]
+        sock.close()
+        engine = self.start()
+        engine.connect('box', address, LOGIN, 'INBOX')
+        kind, box, msg = self.next_event()
+        self.assertEqual((kind, box), ('connect_error', 'box'))
+        # the mailbox is left alone until it is connected again
+        self.assertNoEvent()
+        engine.check('box')
+        self.assertEqual(self.next_event(), ('check_error', 'box', 'not connected'))
+        engine.logout('box', reconnect=True)
+        self.assertEqual(self.next_event()[:2], ('connect_error', 'box'))
+        self.assertNoEvent()
+
+    def test_logout(self):
+        engine = self.start()
+        engine.connect('box', self.address, LOGIN, 'INBOX')
+        self.assertEqual(self.next_event(), ('connected', 'box', None))
+        engine.logout('box')
+        engine.check('box')
+        self.assertEqual(self.next_event(), ('check_error', 'box', 'not connected'))
+        engine.logout('box', reconnect=True)
+        self.assertEqual(self.next_event(), ('connected', 'box', None))
+        engine.stop()
+        engine.join(TIMEOUT)
+        self.assertFalse(engine._thread.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016-2018 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Tests of the rendering of the icon, skipped if PIL is not installed
+"""
+
+
+import os
+import tempfile
+import unittest
+from io import BytesIO
+from unittest import mock
+
+try:
+    from PIL import Image
+    from checkmailslib import badge
+    from checkmailslib.badge import BadgeRenderer, GlyphAtlas, badge_text
+except ImportError:
+    badge = None
+
+
+@unittest.skipIf(badge is None, "PIL is not installed")
+class BadgeRendererTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.image = os.path.join(directory.name, "mail.png")
+        Image.new("RGBA", (48, 48), (255, 255, 255, 255)).save(self.image)
+        # missing font: the default font of PIL is used
+        self.font = os.path.join(directory.name, "missing.ttf")
+        self.renderer = BadgeRenderer(cache_size=2)
+
+    def render(self, text):
+        return self.renderer.render(text, self.font, 20, self.image)
+
+    def test_badge_text(self):
+        self.assertEqual(badge_text(0), "0")
+        self.assertEqual(badge_text(badge.OVERFLOW), str(badge.OVERFLOW))
+        self.assertEqual(badge_text(badge.OVERFLOW + 1), "%i+" % badge.OVERFLOW)
+
+    def test_render(self):
+        data = self.render("3")
+        im = Image.open(BytesIO(data))
+        self.assertEqual(im.size, (48, 48))
+        colors = [color for count, color in im.convert("RGB").getcolors()]
+        self.assertIn((255, 255, 255), colors)
+        # the text is drawn in COLOR, with antialiasing
+        self.assertTrue(any(g < 64 and r > 192 for r, g, b in colors))
+
+    def test_cache(self):
+        with mock.patch.object(self.renderer, "draw", wraps=self.renderer.draw) as draw:
+            first = self.render("1")
+            self.assertIs(self.render("1"), first)
+            self.assertEqual(draw.call_count, 1)
+            self.render("2")
+            # "1" was used last, "2" is evicted
+            self.render("1")
+            self.render("3")
+            self.assertEqual(draw.call_count, 3)
+            self.render("1")
+            self.assertEqual(draw.call_count, 3)
+            self.render("2")
+            self.assertEqual(draw.call_count, 4)
+            # other size
+            self.renderer.render("1", self.font, 12, self.image)
+            self.assertEqual(draw.call_count, 5)
+
+    def test_loaded_once(self):
+        with mock.patch.object(badge.Image, "open", wraps=Image.open) as image_open, \
+                mock.patch.object(badge.ImageFont, "truetype",
+                                  wraps=badge.ImageFont.truetype) as truetype:
+            for text in ("1", "2", "3", "4"):
+                self.render(text)
+        self.assertEqual(image_open.call_count, 1)
+        # PIL may load its default font with truetype too
+        self.assertEqual([c for c in truetype.call_args_list if c.args[0] == self.font],
+                         [mock.call(self.font, 20)])
+
+
+@unittest.skipIf(badge is None, "PIL is not installed")
+class GlyphAtlasTest(unittest.TestCase):
+
+    def setUp(self):
+        self.atlas = GlyphAtlas(None)
+
+    def test_glyphs(self):
+        for count in (0, 7, 42, badge.OVERFLOW, 1000):
+            self.assertTrue(set(badge_text(count)) <= set(badge.GLYPHS))
+
+    def test_size(self):
+        one, advance = self.atlas._glyphs["1"]
+        two = self.atlas._glyphs["2"][0]
+        self.assertEqual(self.atlas.size("1"), (one.width, self.atlas.height))
+        self.assertEqual(self.atlas.size("12"), (advance + two.width, self.atlas.height))
+
+    def test_mask(self):
+        one = self.atlas._glyphs["1"][0]
+        self.assertEqual(self.atlas.mask("1").tobytes(), one.tobytes())
+        mask = self.atlas.mask("%i+" % badge.OVERFLOW)
+        self.assertEqual(mask.size, tuple(round(x) for x in self.atlas.size("99+")))
+        nine = self.atlas._glyphs["9"][0]
+        self.assertEqual(mask.crop((0, 0) + nine.size).tobytes(), nine.tobytes())
+
+    def test_shared_atlas(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        image = os.path.join(directory.name, "mail.png")
+        Image.new("RGBA", (16, 16)).save(image)
+        renderer = BadgeRenderer()
+        font = os.path.join(directory.name, "missing.ttf")
+        with mock.patch.object(badge, "GlyphAtlas", wraps=GlyphAtlas) as atlas:
+            for count in (1, 25, 1000):
+                renderer.render(badge_text(count), font, 30, image)
+        self.assertEqual(atlas.call_count, 1)
+        # the overflow marker is scaled down to fit in the icon
+        data = renderer.render(badge_text(1000), font, 30, image)
+        self.assertEqual(Image.open(BytesIO(data)).size, (16, 16))
+
+
+if __name__ == "__main__":
+    unittest.main()
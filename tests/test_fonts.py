@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016-2018 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Tests of the font index
+"""
+
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from checkmailslib.fonts import FontIndex, font_dirs
+
+
+def touch(path):
+    open(path, "w").close()
+
+
+def bump_mtime(path):
+    """Change the mtime of path, the resolution of the filesystem may be coarse."""
+    mtime = os.stat(path).st_mtime_ns + 10 ** 9
+    os.utime(path, ns=(mtime, mtime))
+
+
+class FontIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.tmp = directory.name
+        self.cache = os.path.join(self.tmp, "fonts.json")
+        self.system = os.path.join(self.tmp, "system")
+        self.user = os.path.join(self.tmp, "user")
+        os.makedirs(os.path.join(self.system, "liberation"))
+        touch(os.path.join(self.system, "liberation", "LiberationSans-Bold.ttf"))
+        touch(os.path.join(self.system, "DejaVuSans.TTF"))
+        touch(os.path.join(self.system, "README"))
+
+    def index(self):
+        """Return a new index and the mock counting its scans."""
+        index = FontIndex(self.cache, [self.system, self.user])
+        scan = mock.patch.object(index, "_scan", wraps=index._scan).start()
+        self.addCleanup(mock.patch.stopall)
+        return index, scan
+
+    def test_scan(self):
+        index, scan = self.index()
+        self.assertEqual(dict(index),
+                         {"LiberationSans-Bold": os.path.join(self.system, "liberation",
+                                                              "LiberationSans-Bold.ttf"),
+                          "DejaVuSans": os.path.join(self.system, "DejaVuSans.TTF")})
+        self.assertEqual(index.default(), "LiberationSans-Bold")
+        self.assertEqual(index.path("Unknown"), index["LiberationSans-Bold"])
+        len(index)
+        self.assertEqual(scan.call_count, 1)
+
+    def test_cache(self):
+        fonts = dict(self.index()[0])
+        index, scan = self.index()
+        self.assertEqual(dict(index), fonts)
+        scan.assert_not_called()
+
+    def test_invalidation(self):
+        dict(self.index()[0])
+        # font added in a subdirectory
+        touch(os.path.join(self.system, "liberation", "LiberationMono.ttf"))
+        bump_mtime(os.path.join(self.system, "liberation"))
+        index, scan = self.index()
+        self.assertIn("LiberationMono", index)
+        self.assertEqual(scan.call_count, 1)
+        # creation of a missing font directory
+        os.mkdir(self.user)
+        touch(os.path.join(self.user, "Custom.ttf"))
+        index, scan = self.index()
+        self.assertIn("Custom", index)
+        self.assertEqual(scan.call_count, 1)
+        # other font directories
+        index = FontIndex(self.cache, [self.user])
+        self.assertEqual(list(index), ["Custom"])
+
+    def test_refresh(self):
+        index, scan = self.index()
+        dict(index)
+        touch(os.path.join(self.system, "Extra.ttf"))
+        bump_mtime(self.system)
+        self.assertNotIn("Extra", index)
+        index.refresh()
+        self.assertIn("Extra", index)
+        self.assertEqual(scan.call_count, 2)
+
+    def test_invalid_cache(self):
+        with open(self.cache, "w") as file:
+            file.write("[1, 2")
+        index, scan = self.index()
+        self.assertIn("DejaVuSans", index)
+        self.assertEqual(scan.call_count, 1)
+
+    def test_no_font(self):
+        index = FontIndex(self.cache, [self.user])
+        self.assertEqual(index.default(), "")
+        self.assertEqual(index.path("DejaVuSans"), "")
+
+    def test_font_dirs(self):
+        environ = {"HOME": self.tmp, "XDG_DATA_DIRS": "/usr/share:/opt/share:",
+                   "XDG_DATA_HOME": os.path.join(self.tmp, "data")}
+        with mock.patch.dict(os.environ, environ):
+            self.assertEqual(font_dirs(), ["/opt/share/fonts", "/usr/share/fonts",
+                                           os.path.join(self.tmp, "data", "fonts"),
+                                           os.path.join(self.tmp, ".fonts")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016-2018 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Tests of the IMAP helpers
+
+The session tests connect to the fake IMAP server of the benchmark, they
+are skipped if openssl is not installed.
+"""
+
+
+import shutil
+import ssl
+import tempfile
+import time
+import unittest
+from imaplib import IMAP4
+from threading import Timer
+from unittest import mock
+
+from checkmailslib.benchmark import FakeIMAPServer
+from checkmailslib.imap import IMAPSession, count_unseen, parse_esearch_count, \
+    parse_status, response_lines, parse_list, is_selectable, split_folders, \
+    list_folders, split_server, SessionRegistry, Idler
+
+
+def client_context():
+    """Return a TLS context accepting the self-signed certificate of the fake server."""
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+class ParserTest(unittest.TestCase):
+
+    def test_status(self):
+        self.assertEqual(parse_status(b'"INBOX" (UNSEEN 3)'), ('INBOX', {b'UNSEEN': 3}))
+        self.assertEqual(parse_status(b'Lists (MESSAGES 12 unseen 0)'),
+                         ('Lists', {b'MESSAGES': 12, b'UNSEEN': 0}))
+        self.assertEqual(parse_status(b'"a \\"b\\" c" (UNSEEN 1)'),
+                         ('a "b" c', {b'UNSEEN': 1}))
+        self.assertRaises(IMAP4.error, parse_status, b'"INBOX" (UNSEEN)')
+
+    def test_status_literal(self):
+        # imaplib returns the literal as a tuple followed by the end of the line
+        data = [(b'{8}', b'My (box)'), b' (UNSEEN 4)', b'"INBOX" (UNSEEN 1)', None]
+        lines = response_lines(data)
+        self.assertEqual(lines, [b'{8}My (box) (UNSEEN 4)', b'"INBOX" (UNSEEN 1)'])
+        self.assertEqual([parse_status(line) for line in lines],
+                         [('My (box)', {b'UNSEEN': 4}), ('INBOX', {b'UNSEEN': 1})])
+
+    def test_esearch_count(self):
+        self.assertEqual(parse_esearch_count(b'(TAG "A12") COUNT 5'), 5)
+        self.assertEqual(parse_esearch_count(b'COUNT 7'), 7)
+        self.assertEqual(parse_esearch_count(b'(TAG "A12") UID MIN 3 count 2'), 2)
+        # no unread mail: the server may omit COUNT
+        self.assertEqual(parse_esearch_count(b'(TAG "A12")'), 0)
+
+    def test_list(self):
+        self.assertEqual(parse_list(b'(\\HasNoChildren) "/" "INBOX/Lists"'),
+                         ([b'\\HASNOCHILDREN'], 'INBOX/Lists'))
+        # flat hierarchy: NIL delimiter
+        self.assertEqual(parse_list(b'() NIL INBOX'), ([], 'INBOX'))
+        self.assertEqual(parse_list(b'(\\Noselect) "." {9}My folder'),
+                         ([b'\\NOSELECT'], 'My folder'))
+        self.assertFalse(is_selectable(parse_list(b'(\\Noselect) "/" "Archives"')[0]))
+        self.assertFalse(is_selectable([b'\\NONEXISTENT']))
+        self.assertTrue(is_selectable([b'\\HASCHILDREN']))
+
+    def test_split_folders(self):
+        self.assertEqual(split_folders('INBOX'), ['INBOX'])
+        self.assertEqual(split_folders(' INBOX, Lists/* ,, Work '),
+                         ['INBOX', 'Lists/*', 'Work'])
+        self.assertEqual(split_folders(''), [])
+
+    def test_split_server(self):
+        self.assertEqual(split_server('imap.example.com'), ('imap.example.com', 993))
+        self.assertEqual(split_server('imap.example.com:1993'), ('imap.example.com', 1993))
+        self.assertEqual(split_server('[::1]:1993'), ('::1', 1993))
+        # IPv6 address without port
+        self.assertEqual(split_server('2001:db8::1'), ('2001:db8::1', 993))
+
+
+class SessionRegistryTest(unittest.TestCase):
+
+    def test_key(self):
+        info = ('imap.example.com', ('login', 'password'), 'INBOX')
+        self.assertEqual(SessionRegistry.key(info), ('imap.example.com', 'login'))
+
+    def test_lock(self):
+        registry = SessionRegistry()
+        key = ('imap.example.com', 'login')
+        lock = registry.lock(key)
+        self.assertIs(registry.lock(key), lock)
+        self.assertIsNot(registry.lock(('imap.example.com', 'other')), lock)
+        with lock:
+            # a second connection attempt to the same account has to wait
+            self.assertFalse(registry.lock(key).acquire(blocking=False))
+        self.assertTrue(registry.lock(key).acquire(blocking=False))
+        lock.release()
+
+    def test_sessions(self):
+        registry = SessionRegistry()
+        first, second = object(), object()
+        registry.add(('a', 'login'), first)
+        registry.add(('b', 'login'), second)
+        self.assertIs(registry.get(('a', 'login')), first)
+        self.assertIsNone(registry.get(('c', 'login')))
+        registry.discard(first)
+        self.assertIsNone(registry.get(('a', 'login')))
+        # discarding a session twice is harmless
+        registry.discard(first)
+        self.assertEqual(registry.clear(), [second])
+        self.assertIsNone(registry.get(('b', 'login')))
+        self.assertEqual(registry.clear(), [])
+
+
+class ServerMixin:
+    """Session logged in to the fake IMAP server."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.server = FakeIMAPServer(directory.name, nb_unread=3)
+        self.addCleanup(self.server.close)
+        self.mail = IMAPSession('127.0.0.1:%i' % self.server.port,
+                                ssl_context=client_context(), timeout=5)
+        self.addCleanup(self.mail.close_session, 5)
+        self.mail.login('login', 'password')
+
+
+@unittest.skipIf(shutil.which("openssl") is None, "openssl is not installed")
+class SessionTest(ServerMixin, unittest.TestCase):
+
+    def test_list_folders(self):
+        # the fake server lists INBOX for every pattern
+        self.assertEqual(list_folders(self.mail, 'Work, *, INBOX'), ['Work', 'INBOX'])
+
+    def test_count_unseen_pipelined(self):
+        calls = []
+        command = self.mail._command
+        complete = self.mail._command_complete
+
+        def record_command(name, *args):
+            calls.append(name)
+            return command(name, *args)
+
+        def record_complete(name, tag):
+            calls.append('complete')
+            return complete(name, tag)
+
+        with mock.patch.object(self.mail, '_command', record_command), \
+                mock.patch.object(self.mail, '_command_complete', record_complete):
+            counts = count_unseen(self.mail, ['INBOX', 'Lists', 'Work'])
+        self.assertEqual(counts, {'INBOX': 3, 'Lists': 3, 'Work': 3})
+        # all the commands are sent before the first response is read
+        self.assertEqual(calls, ['STATUS'] * 3 + ['complete'] * 3)
+
+    def test_count_unseen_selected(self):
+        self.mail.select('INBOX')
+        self.server.set_unread(2)
+        with mock.patch.object(self.mail, 'search', wraps=self.mail.search) as search:
+            counts = count_unseen(self.mail, ['INBOX', 'Lists'])
+        self.assertEqual(counts, {'INBOX': 2, 'Lists': 2})
+        # the selected folder is counted with ESEARCH
+        search.assert_not_called()
+
+    def test_count_unseen_without_esearch(self):
+        self.mail.select('INBOX')
+        self.mail.capabilities = tuple(c for c in self.mail.capabilities if c != 'ESEARCH')
+        self.assertEqual(count_unseen(self.mail, ['INBOX']), {'INBOX': 3})
+
+
+@unittest.skipIf(shutil.which("openssl") is None, "openssl is not installed")
+class IdlerTest(ServerMixin, unittest.TestCase):
+
+    def setUp(self):
+        ServerMixin.setUp(self)
+        self.mail.select('INBOX')
+        self.idler = Idler(self.mail)
+        self.addCleanup(self.idler.close)
+
+    def idle(self, timeout=5):
+        """Return the result of idle() and its duration."""
+        start = time.monotonic()
+        changed = self.idler.idle(timeout)
+        return changed, time.monotonic() - start
+
+    def later(self, function, *args):
+        timer = Timer(0.2, function, args)
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+    def test_supported(self):
+        self.assertTrue(Idler.supported(self.mail))
+
+    def test_timeout(self):
+        changed, duration = self.idle(0.2)
+        self.assertFalse(changed)
+        self.assertGreaterEqual(duration, 0.2)
+        # the connection can still be used
+        self.assertEqual(count_unseen(self.mail, ['INBOX']), {'INBOX': 3})
+
+    def test_change(self):
+        self.later(self.server.set_unread, 5)
+        changed, duration = self.idle()
+        self.assertTrue(changed)
+        self.assertLess(duration, 4)
+        self.assertEqual(count_unseen(self.mail, ['INBOX']), {'INBOX': 5})
+
+    def test_done(self):
+        # done() is called from another thread
+        self.later(self.idler.done)
+        changed, duration = self.idle()
+        self.assertFalse(changed)
+        self.assertLess(duration, 4)
+        self.assertFalse(self.idler.stopped)
+        # done() only terminates the current command
+        self.assertFalse(self.idle(0.2)[0])
+
+    def test_stop(self):
+        self.later(self.idler.stop)
+        self.assertLess(self.idle()[1], 4)
+        self.assertTrue(self.idler.stopped)
+        # IDLE is terminated right away once stopped
+        self.assertLess(self.idle()[1], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
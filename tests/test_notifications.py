@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016-2018 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Tests of the D-Bus notifications
+
+The round trip tests run a private session bus with dbus-daemon and a fake
+notification server, they are skipped if dbus-daemon is not installed.
+"""
+
+
+import os
+import shutil
+import struct
+import subprocess
+import time
+import unittest
+from threading import Thread
+from unittest import mock
+
+from checkmailslib import notifications
+from checkmailslib.notifications import Marshaller, Unmarshaller, \
+    DBusConnection, Notifier, split_signature, bus_address
+
+
+NOTIFY_SIGNATURE = "susssasa{sv}i"
+
+
+class MarshallingTest(unittest.TestCase):
+
+    def test_split_signature(self):
+        self.assertEqual(split_signature(NOTIFY_SIGNATURE),
+                         ['s', 'u', 's', 's', 's', 'as', 'a{sv}', 'i'])
+        self.assertEqual(split_signature('yyyyuua(yv)'),
+                         ['y', 'y', 'y', 'y', 'u', 'u', 'a(yv)'])
+        self.assertEqual(split_signature('aa{s(iv)}y'), ['aa{s(iv)}', 'y'])
+
+    def test_dict_alignment(self):
+        data = Marshaller().write('ya{sv}', (1, {'k': ('u', 7)})).buffer
+        expected = (b'\x01\0\0\0'            # byte, padding to the array length
+                    + struct.pack('<I', 16)   # array length, without padding
+                    + struct.pack('<I', 1) + b'k\0'   # key, at offset 8
+                    + b'\x01u\0'              # variant signature
+                    + b'\0\0\0'               # padding to the uint32
+                    + struct.pack('<I', 7))
+        self.assertEqual(bytes(data), expected)
+
+    def test_empty_dict_alignment(self):
+        # the padding to the first element is written even if there is none
+        data = Marshaller().write('a{sv}', ({},)).buffer
+        self.assertEqual(bytes(data), b'\0' * 8)
+        data = Marshaller().write('ua{sv}i', (1, {}, -1)).buffer
+        self.assertEqual(bytes(data), struct.pack('<IIi', 1, 0, -1))
+
+    def test_header_fields_alignment(self):
+        data = Marshaller().write('yyyyuua(yv)', (ord('l'), 1, 0, 1, 0, 1,
+                                                  [(1, ('o', '/a'))])).buffer
+        expected = (b'l\x01\0\x01' + struct.pack('<II', 0, 1)
+                    + struct.pack('<I', 11)   # array length, at offset 12
+                    + b'\x01'                 # field code, at offset 16
+                    + b'\x01o\0'              # variant signature
+                    + struct.pack('<I', 2) + b'/a\0')
+        self.assertEqual(bytes(data), expected)
+        data = Marshaller().write('a(yv)', ([(1, ('o', '/a')), (3, ('s', 'Hello'))],)).buffer
+        # the second struct starts on a multiple of 8
+        self.assertEqual(data[19:24], b'\0' * 5)
+        self.assertEqual(data[24], 3)
+
+    def test_round_trip(self):
+        values = ("CheckMails", 3, "icon", "Unread mails", "box : 2",
+                  ["default", "Open"], {"urgency": ("y", 1), "category": ("s", "email"),
+                                        "x": ("i", -5)}, -1)
+        data = Marshaller().write(NOTIFY_SIGNATURE, values).buffer
+        result = Unmarshaller(bytes(data)).read(NOTIFY_SIGNATURE)
+        self.assertEqual(result[:6], list(values[:6]))
+        self.assertEqual(result[6], {"urgency": 1, "category": "email", "x": -5})
+        self.assertEqual(result[7], -1)
+        fields = [(1, ('o', '/org/freedesktop/Notifications')), (6, ('s', ':1.2')),
+                  (8, ('g', NOTIFY_SIGNATURE))]
+        data = Marshaller().write('ya(yv)', (2, fields)).buffer
+        self.assertEqual(Unmarshaller(bytes(data)).read('ya(yv)'),
+                         [2, [(code, value) for code, (sig, value) in fields]])
+
+
+class NotificationServer(DBusConnection):
+    """Fake org.freedesktop.Notifications service answering Notify."""
+
+    def __init__(self, address):
+        DBusConnection.__init__(self, address)
+        self.received = []
+        self.next_id = 10
+        self.call("org.freedesktop.DBus", "/org/freedesktop/DBus",
+                  "org.freedesktop.DBus", "RequestName", "su",
+                  ("org.freedesktop.Notifications", 0))
+        self.thread = Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def _recv(self, size):
+        data = DBusConnection._recv(self, size)
+        if size == 16:
+            # fixed part of the header of a message
+            self.call_serial = struct.unpack_from('<I', data, 8)[0]
+        return data
+
+    def serve(self):
+        while True:
+            try:
+                msg_type, fields, body = self._read_message()
+            except OSError:
+                return
+            if msg_type != notifications.METHOD_CALL or fields.get(notifications.MEMBER) != "Notify":
+                continue
+            self.received.append(body)
+            notif_id = body[1]
+            if not notif_id:
+                notif_id = self.next_id
+                self.next_id += 1
+            reply = Marshaller().write('u', (notif_id,)).buffer
+            self.serial += 1
+            header = Marshaller().write('yyyyuua(yv)', (
+                ord('l'), notifications.METHOD_RETURN, 0, 1, len(reply), self.serial,
+                [(notifications.REPLY_SERIAL, ('u', self.call_serial)),
+                 (notifications.DESTINATION, ('s', fields[7])),
+                 (notifications.SIGNATURE, ('g', 'u'))]))
+            header.align(8)
+            self.socket.sendall(header.buffer + reply)
+
+
+@unittest.skipIf(shutil.which("dbus-daemon") is None, "dbus-daemon is not installed")
+class NotifyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = subprocess.Popen(["dbus-daemon", "--session", "--print-address", "--nofork"],
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.addCleanup(self.bus.wait)
+        self.addCleanup(self.bus.kill)
+        address = self.bus.stdout.readline().decode().strip()
+        self.bus.stdout.close()
+        environ = mock.patch.dict(os.environ, {"DBUS_SESSION_BUS_ADDRESS": address})
+        environ.start()
+        self.addCleanup(environ.stop)
+        self.server = NotificationServer(bus_address())
+        self.addCleanup(self.server.close)
+
+    def wait_notifications(self, nb):
+        end = time.monotonic() + notifications.TIMEOUT
+        while len(self.server.received) < nb and time.monotonic() < end:
+            time.sleep(0.01)
+        return self.server.received
+
+    def test_hello(self):
+        bus = DBusConnection()
+        self.addCleanup(bus.close)
+        self.assertTrue(bus.unique_name.startswith(":"))
+
+    def test_notify(self):
+        notifier = Notifier()
+        with mock.patch.object(notifications, "run") as run:
+            notifier.notify("Unread mails", "box : 1", "icon.png", "unread")
+            notifier.notify("Error", "failed", "dialog-error")
+            notifier.notify("Unread mails", "box : 2", "icon.png", "unread")
+            received = self.wait_notifications(3)
+        run.assert_not_called()
+        self.assertEqual(received,
+                         [["CheckMails", 0, "icon.png", "Unread mails", "box : 1", [], {}, -1],
+                          ["CheckMails", 0, "dialog-error", "Error", "failed", [], {}, -1],
+                          # the notification of the category is replaced
+                          ["CheckMails", 10, "icon.png", "Unread mails", "box : 2", [], {}, -1]])
+        self.assertEqual(notifier.ids, {"unread": 10})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016-2018 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Tests of the adaptive polling schedule
+"""
+
+
+import unittest
+from unittest import mock
+
+from checkmailslib import scheduler
+from checkmailslib.scheduler import Scheduler
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.
+        patches = [mock.patch.object(scheduler.time, 'monotonic', lambda: self.now),
+                   # no jitter
+                   mock.patch.object(scheduler.random, 'uniform', lambda a, b: 1)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.scheduler = Scheduler(60)
+        self.scheduler.update({'a': (10, 300), 'b': (10, 300)})
+
+    def test_backoff(self):
+        sched = self.scheduler
+        sched.checked('a', False)
+        self.assertEqual(sched.interval_of('a'), 60 * scheduler.QUIET_FACTOR)
+        sched.failed('a')
+        self.assertEqual(sched.interval_of('a'),
+                         60 * scheduler.QUIET_FACTOR * scheduler.FAILURE_FACTOR)
+        sched.checked('a', True)
+        self.assertEqual(sched.interval_of('a'),
+                         60 * scheduler.QUIET_FACTOR * scheduler.FAILURE_FACTOR / 2)
+        self.assertEqual(sched.interval_of('b'), 60)
+
+    def test_bounds(self):
+        sched = self.scheduler
+        for i in range(10):
+            sched.failed('a')
+            sched.checked('b', True)
+        self.assertEqual(sched.interval_of('a'), 300)
+        self.assertEqual(sched.interval_of('b'), 10)
+        # new bounds of an existing mailbox
+        sched.update({'a': (10, 120), 'b': (30, 300)})
+        self.assertEqual(sched.interval_of('a'), 120)
+        self.assertEqual(sched.interval_of('b'), 30)
+        sched.set_interval(5)
+        self.assertEqual(sched.interval_of('a'), 10)
+        self.assertEqual(sched.interval_of('b'), 30)
+
+    def test_jitter(self):
+        with mock.patch.object(scheduler.random, 'uniform', lambda a, b: b):
+            self.scheduler.checked('a', False)
+        self.assertAlmostEqual(self.scheduler.next_check(['a']),
+                               90 * (1 + scheduler.JITTER))
+
+    def test_due(self):
+        sched = self.scheduler
+        self.assertEqual(sched.due(), [])
+        self.assertEqual(sched.next_check(), 60)
+        sched.failed('a')
+        self.now += 60 - scheduler.SLACK
+        # the mailboxes due within SLACK are checked together
+        self.assertEqual(sched.due(), ['b'])
+        self.assertEqual(sched.due(['a']), [])
+        self.assertEqual(sched.next_check(['a']), 60 + scheduler.SLACK)
+        self.assertEqual(sched.next_check([]), None)
+        self.now += 1000
+        self.assertEqual(sorted(sched.due()), ['a', 'b'])
+        self.assertEqual(sched.next_check(), 0)
+
+    def test_update(self):
+        sched = self.scheduler
+        sched.checked('a', False)
+        sched.update({'a': (10, 300), 'c': (10, 300)})
+        # the schedule of the mailboxes that were already there is kept
+        self.assertEqual(sched.interval_of('a'), 90)
+        self.assertEqual(sched.interval_of('c'), 60)
+        self.assertRaises(KeyError, sched.interval_of, 'b')
+        # unknown mailboxes are ignored
+        sched.checked('b', True)
+        sched.failed('b')
+
+
+if __name__ == "__main__":
+    unittest.main()
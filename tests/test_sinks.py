@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CheckMails - System tray unread mail checker
+Copyright 2016-2018 Juliette Monsel <j_4321@protonmail.com>
+
+CheckMails is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CheckMails is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Tests of the outputs of the headless daemon
+"""
+
+
+import io
+import json
+import os
+import socket
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from checkmailslib import sinks
+from checkmailslib.sinks import FileSink, SocketSink, StdoutSink, format_counts, \
+    make_sink
+
+
+def read_line(client):
+    """Return the next json line received by client."""
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = client.recv(4096)
+        if not chunk:
+            raise ConnectionError("closed by the sink")
+        data += chunk
+    return json.loads(data.decode())
+
+
+class SinkTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.tmp = directory.name
+
+    def test_format(self):
+        line = format_counts({"b": 2, "a": 1})
+        self.assertTrue(line.endswith("\n"))
+        self.assertEqual(line.count("\n"), 1)
+        data = json.loads(line)
+        self.assertEqual(data["total"], 3)
+        self.assertEqual(data["mailboxes"], {"a": 1, "b": 2})
+        self.assertAlmostEqual(data["time"], time.time(), delta=60)
+
+    def test_make_sink(self):
+        self.assertIsInstance(make_sink("stdout"), StdoutSink)
+        self.assertEqual(make_sink("file:/tmp/counts").path, "/tmp/counts")
+        for spec in ("stdout:x", "file:", "socket", "udp:host"):
+            self.assertRaises(ValueError, make_sink, spec)
+
+    def test_stdout(self):
+        with mock.patch.object(sinks.sys, "stdout", io.StringIO()) as stdout:
+            StdoutSink().publish({"a": 1})
+            StdoutSink().publish({"a": 0})
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual([json.loads(line)["total"] for line in lines], [1, 0])
+
+    def test_file(self):
+        path = os.path.join(self.tmp, "counts.json")
+        sink = FileSink(path)
+        sink.publish({"a": 1})
+        sink.publish({"a": 4, "b": 1})
+        with open(path) as file:
+            self.assertEqual(json.load(file)["mailboxes"], {"a": 4, "b": 1})
+        self.assertEqual(os.listdir(self.tmp), ["counts.json"])
+        with self.assertLogs(level="ERROR"):
+            FileSink(os.path.join(self.tmp, "missing", "counts.json")).publish({})
+
+    def connect(self, path):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.settimeout(5)
+        client.connect(path)
+        self.addCleanup(client.close)
+        return client
+
+    def test_socket(self):
+        path = os.path.join(self.tmp, "counts.sock")
+        # left by a previous instance
+        open(path, "w").close()
+        sink = SocketSink(path)
+        self.addCleanup(sink.close)
+        first = self.connect(path)
+        # wait for the client to be accepted
+        end = time.monotonic() + 5
+        while not sink._clients and time.monotonic() < end:
+            time.sleep(0.01)
+        sink.publish({"a": 1})
+        self.assertEqual(read_line(first)["total"], 1)
+        # a new client receives the last counts
+        second = self.connect(path)
+        self.assertEqual(read_line(second)["total"], 1)
+        sink.publish({"a": 2})
+        self.assertEqual(read_line(first)["total"], 2)
+        self.assertEqual(read_line(second)["total"], 2)
+        sink.close()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(first.recv(10), b"")
+
+    def test_slow_client(self):
+        path = os.path.join(self.tmp, "counts.sock")
+        sink = SocketSink(path)
+        self.addCleanup(sink.close)
+        client = self.connect(path)
+        end = time.monotonic() + 5
+        while not sink._clients and time.monotonic() < end:
+            time.sleep(0.01)
+        counts = {"mailbox %i" % i: i for i in range(100)}
+        with self.assertLogs(level="WARNING"):
+            # the client does not read, its socket buffer fills up
+            for i in range(10000):
+                sink.publish(counts)
+                if not sink._clients:
+                    break
+        self.assertEqual(sink._clients, [])
+
+
+if __name__ == "__main__":
+    unittest.main()